@@ -7,17 +7,33 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import folium
 
+from tdsp_categories import mapping_path, normalize_categories
+from tdsp_data import DATA_PATH, load_crashes
+from tdsp_profile import enable_from_env
 
 """
 **Accessing data using the [NYC OpenData Motor Vehicle Collisions - Crashes dataset](https://data.cityofnewyork.us/Public-Safety/Motor-Vehicle-Collisions-Crashes/h9gi-nx95).  Each row represents a crash event. The Motor Vehicle Collisions data tables contain information from all police-reported motor vehicle collisions in NYC.**
 """
 
-# Uploading my data by mounting my Google Drive.
-from google.colab import drive
-drive.mount('/content/drive')
+# Uploading my data by mounting my Google Drive. Outside of Colab there is no Drive to mount;
+# use `python tdsp_report.py <path to csv>` there to render every chart and map without a display.
+try:
+    from google.colab import drive
+    drive.mount('/content/drive')
+except ImportError:
+    pass
 
-# Reads the data using pandas read_csv function
-data = pd.read_csv('/content/drive/MyDrive/Motor_Vehicle_Collisions_-_Crashes_20241007.csv')
+# With TDSP_PROFILE=<file>.json set, the time and memory of every loading, mapping and feature
+# step are written to that file when the session ends
+enable_from_env()
+
+# Reads the data once with an explicit schema; later runs open the Parquet cache instead of the CSV
+data = load_crashes(DATA_PATH)
+
+# Merges spelling variants of the vehicle types and contributing factors ('Taxi' and 'TAXI', the two
+# 'Station Wagon/Sport Utility Vehicle' entries, ...) into canonical categories. The learned mapping is
+# kept next to the cache, so later runs only resolve values they have not seen before.
+normalize_categories(data, mapping_path(DATA_PATH))
 
 # Prints the first 5 rows of the data using the 'head' function of pandas
 data.head()
@@ -43,7 +59,6 @@ desc_stats
 
 # Imports the pandas library
 import pandas as pd
-data = pd.read_csv('/content/drive/MyDrive/Motor_Vehicle_Collisions_-_Crashes_20241007.csv')
 
 # Leverages the isnull() and sum() functions to find the number of missing values in each column
 missing_values = pd.isnull(data).sum()
@@ -123,6 +138,30 @@ plt.show()
 > Data Visualization: Use visual representations of the data that highlight the importance of merging these categories. Charts or graphs that show combined totals can help stakeholders understand the real impact of these vehicle types.
 """
 
+# The charts above only look at the first vehicle of each crash. Counts every vehicle in slots 1-5 from
+# integer codes, without melting the five columns into one long column.
+from tdsp_vehicles import vehicle_counts
+
+vehicles = vehicle_counts(data)
+
+fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(18, 7))
+top_types = vehicles.type_counts().head(10)
+sns.barplot(x=top_types.index, y=top_types.values, hue=top_types.index, palette='cividis', legend=False, ax=ax1)
+ax1.set_title('Top 10 Vehicle Types, All Vehicles in Each Crash')
+ax1.set_ylabel('Number of vehicles')
+all_factors = vehicles.factor_counts().head(10)
+sns.barplot(x=all_factors.index, y=all_factors.values, hue=all_factors.index, palette='magma', legend=False, ax=ax2)
+ax2.set_title('Top 10 Contributing Factors, All Vehicles in Each Crash')
+ax2.set_ylabel('Number of vehicles')
+for ax in (ax1, ax2):
+    plt.setp(ax.get_xticklabels(), rotation=45, ha='right')
+plt.tight_layout()
+plt.show()
+
+# Which vehicle types crash together, and which factors are recorded for which vehicle types
+print(vehicles.vehicle_pairs(n=10))
+print(vehicles.factor_type_table(factors=10, types=6))
+
 # Graphing the *types* of crashes within this dataset and their frequencies.
 
 import matplotlib.pyplot as plt
@@ -161,16 +200,12 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 
-# Loads the dataset
-file_path = '/content/drive/MyDrive/Motor_Vehicle_Collisions_-_Crashes_20241007.csv'
-data = pd.read_csv(file_path)
-
-# Converts 'CRASH DATE' and 'CRASH TIME' to datetime
-data['CRASH DATE'] = pd.to_datetime(data['CRASH DATE'])
-data['CRASH TIME'] = pd.to_datetime(data['CRASH TIME'], format='%H:%M')
+# Reuses the dataset loaded above; 'CRASH DATE' is already parsed on load
 
 # Time of Day Analysis
-data['Hour of Day'] = data['CRASH TIME'].dt.hour
+# Adds 'CRASH TIMESTAMP', 'Hour of Day', 'Weekday' and 'Month' once, parsing each distinct date and time a single time
+from tdsp_time import add_temporal_features
+add_temporal_features(data)
 
 # Groups by 'Hour of Day' and calculates the average number of crashes per hour
 average_crashes_per_hour = data.groupby('Hour of Day').size() / data['Hour of Day'].nunique()
@@ -191,11 +226,8 @@ plt.show()
 
 # Ploting a graph to determine how COVID-19 impacted the number of crashes per month, if at all.
 
-# Converts 'CRASH DATE' to datetime format
-data['CRASH DATE'] = pd.to_datetime(data['CRASH DATE'])
-
-# Groups by month and year to get the number of crashes per month
-monthly_crashes = data.groupby(data['CRASH DATE'].dt.to_period("M")).size()
+# Groups by the 'Month' period added by add_temporal_features to get the number of crashes per month
+monthly_crashes = data.groupby('Month').size()
 
 # Plots the trend over time
 plt.figure(figsize=(15, 7))
@@ -215,10 +247,14 @@ plt.show()
 
 import matplotlib.pyplot as plt
 import seaborn as sns
-from statsmodels.tsa.seasonal import seasonal_decompose
+from tdsp_timeseries import TOTAL, TimeSeriesEngine
 
-# Counts the number of crashes per day, group by CRASH DATE
-daily_crashes = data.groupby(data['CRASH DATE']).size()
+# Builds the daily, weekly and monthly series of every borough, primary factor and hour of day in one
+# grouped pass per column, and decomposes each of them with STL (no NaN edges, unlike seasonal_decompose)
+engine = TimeSeriesEngine().build(data)
+
+# Counts the number of crashes per day
+daily_crashes = engine.series()[TOTAL]
 
 # Sets the plot style
 sns.set(style="darkgrid")
@@ -232,20 +268,32 @@ plt.ylabel('Number of Crashes')
 plt.legend()
 plt.show()
 
-# Decomposes the time series
-decomposition = seasonal_decompose(daily_crashes, model='additive', period=365)
+# The decomposition of the daily citywide series
+decomposition = engine.components['daily'][None][TOTAL]
 
 # Plots the decomposed components
 fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(15, 12))
-decomposition.trend.plot(ax=ax1)
+decomposition['trend'].plot(ax=ax1)
 ax1.set_title('Trend')
-decomposition.seasonal.plot(ax=ax2)
+decomposition['seasonal'].plot(ax=ax2)
 ax2.set_title('Seasonal')
-decomposition.resid.plot(ax=ax3)
+decomposition['resid'].plot(ax=ax3)
 ax3.set_title('Residuals')
 plt.tight_layout()
 plt.show()
 
+# Compares the weekly trend of each borough, decomposed in the same pass
+fig, ax = plt.subplots(figsize=(15, 6))
+for borough, components in engine.components['weekly']['BOROUGH'].items():
+    if components is not None:
+        components['trend'].plot(ax=ax, label=borough)
+ax.set_title('Weekly Crash Trend by Borough')
+ax.set_xlabel('Date')
+ax.set_ylabel('Number of Crashes per Week')
+ax.legend()
+plt.tight_layout()
+plt.show()
+
 """
 > The Time Series Plot shows the number of daily crashes over time, long-term trends, seasonal patterns, or significant outliers.
 
@@ -259,6 +307,15 @@ plt.show()
 > Based on the 'residual graph', there was a clear unexpected change at the start of 2014 and an even bigger change at the beginning of 2020. The change in 2014 might point to an unusual event that briefly affected crash numbers, while the change in 2020 likely connects to the start of COVID-19. Due to quarantines and fewer cars on the road, crash numbers dropped more than expected, causing these differences from the trend.
 """
 
+# Flags outlying days and months and sustained shifts in the daily and monthly series, citywide and per borough.
+# The detectors update one value at a time; saving the monitor lets a daily refresh feed only the new days.
+from tdsp_anomaly import CrashMonitor
+
+monitor = CrashMonitor(slices=['BOROUGH'])
+flags = monitor.update(data)
+print(flags[flags['kind'] != 'outlier'].sort_values('start'))
+print(flags[flags['series'] == 'monthly/ALL'].sort_values('score').head(10))
+
 # Builds a bar chart to compare and analyze the number of crashes across the five boroughs: Brooklyn (also known as Kings County), Queens, Manhattan, Bronx, and Staten Island.
 # Plots a bar chart to compare the number of crashes that occurred in each of the five boroughs.
 
@@ -284,20 +341,30 @@ plt.show()
 > Reasons as to why certain boroughs can have a higher or lower number of crashes can be due to factors such as population. For example, if there is a higher population in Brooklyn than in Staten Island, then the number of crashes can play a big role in why there are more crashes in Brooklyn than in Staten Island.
 """
 
+# Divides the borough counts by each borough's 2020 Census population, with 95% confidence intervals, so that
+# boroughs of different sizes can be compared. Vehicle types need a fleet table to do the same, e.g. registrations:
+# risk_rates(data, 'VEHICLE TYPE CODE 1', load_exposure('registrations.csv', 'VEHICLE TYPE CODE 1', 'vehicles'))
+from tdsp_rates import BOROUGH_POPULATION, plot_rates, risk_rates
+
+borough_rates = risk_rates(data, 'BOROUGH', BOROUGH_POPULATION)
+plt.figure(figsize=(12, 7))
+plot_rates(borough_rates, 'BOROUGH')
+plt.title('Crashes per 100,000 Residents by Borough', fontsize=16)
+plt.tight_layout()
+plt.show()
+borough_rates
+
 # Creates a heatmap to determine the most dangerous intersections in the dataset.
 
 # Creates a heatmap leveraging the latitude and longitude variables to determine where the most crashes are occurring
-from folium.plugins import HeatMap
+from tdsp_maps import geocoded, heatmap, severity_map
 
 # Drops rows with missing latitude and longitude values
-data_geo = data.dropna(subset=['LATITUDE', 'LONGITUDE'])
+data_geo = geocoded(data)
 
-# Creates a base map
-m = folium.Map(location=[40.730610, -73.935242], zoom_start=10)  # Centered around NYC
-
-# Creates a heatmap
-heat_data = [[row['LATITUDE'], row['LONGITUDE']] for index, row in data_geo.iterrows()]
-HeatMap(heat_data, radius=8, max_zoom=13).add_to(m)
+# Creates the heatmap centered around NYC from crashes binned into grid cells for each range of zoom levels,
+# which also drops the (0, 0) coordinates; the page holds one weighted point per cell instead of one per crash
+m = heatmap(data_geo, radius=8, max_zoom=13)
 m.save("Heatmap.html")
 
 """
@@ -309,48 +376,22 @@ m.save("Heatmap.html")
 # Sample a subset of the data for visualization
 sample_data_severity = data_geo.sample(n=1000, random_state=42)
 
-# Creates a base map
-m_severity = folium.Map(location=[40.730610, -73.935242], zoom_start=10)
-
-# Adds crashes to the map with color coding and shape coding based on severity
-for index, row in sample_data_severity.iterrows():
-    if row['NUMBER OF PERSONS KILLED'] > 0:
-        color = "Red"  # Fatalities
-
-        folium.features.RegularPolygonMarker(
-          location=[row['LATITUDE'], row['LONGITUDE']],
-          number_of_sides=3,
-          radius=5,
-          gradient = False,
-          color=color,
-          fill=True,
-          fill_color=color
-        ).add_to(m_severity)
-
-
-    elif row['NUMBER OF PERSONS INJURED'] > 0:
-        color = "Yellow"  # Injuries
-        folium.CircleMarker(
-          location=[row['LATITUDE'], row['LONGITUDE']],
-          radius=5,
-          color=color,
-          fill=True,
-          fill_color=color
-       ).add_to(m_severity)
-    else:
-        color = "Green"  # No injuries or fatalities
-        folium.features.RegularPolygonMarker(
-          location=[row['LATITUDE'], row['LONGITUDE']],
-          number_of_sides=4,
-          radius=5,
-          gradient = False,
-          color=color,
-          fill=True,
-          fill_color=color
-        ).add_to(m_severity)
+# Creates the map with one layer per severity class, color and shape coded as before:
+# red triangles for fatalities, yellow circles for injuries, green squares for neither
+m_severity = severity_map(sample_data_severity)
+m_severity.save("severity.html")
 
+# The sample leaves out most of the fatal crashes. The tiled map holds every geocoded crash, clustered for each
+# zoom level and written as small files in severity_tiles_files/ that the page loads only while they are in view;
+# fatal crashes are clustered apart from the rest and get a marker each from street zoom on
+from tdsp_tiles import export_severity_tiles
+export_severity_tiles(data_geo, "severity_tiles.html")
 
-m_severity.save("severity.html")
+# Ranks the most dangerous intersections over every geocoded crash rather than the 1000-crash sample:
+# hotspots counts the crashes within 50 meters of each location, street_pairs groups by the named intersection
+from tdsp_intersections import dangerous_intersections
+hotspots, street_pairs = dangerous_intersections(data, n=10, radius=50, rank_by='severity')
+hotspots
 
 """
 > After looking at the severity map, the intersections that seem to be the most dangerous are FDR Drive under East 25th Street Pedestrian Bridge, West 90th Street connects with West End Avenue, and where 103rd Avenue connects with 99th Street.
@@ -364,21 +405,19 @@ m_severity.save("severity.html")
 
 # Builds a visualization, a model, and other statistical methods to gain insights into my data and to support my research question.
 
+# Precomputes crashes, injuries and fatalities by date, hour, weekday, borough, primary factor and vehicle type once,
+# so each slice of the research question is answered from the cube instead of regrouping the raw rows
+from tdsp_cube import CrashCube
+cube = CrashCube.build(data)
+crashes_by_hour_and_borough = cube.query(by=['hour', 'borough'])
+weekend_deaths_by_hour = cube.query(by=['hour'], where={'weekday': [5, 6]}, measures=['NUMBER OF PERSONS KILLED'])
+
 #Creating a chart that displays the average number of crashes per hour of the day.
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 
-# Loads the dataset
-file_path = '/content/drive/MyDrive/Motor_Vehicle_Collisions_-_Crashes_20241007.csv'
-data = pd.read_csv(file_path)
-
-# Converts 'CRASH DATE' and 'CRASH TIME' to datetime
-data['CRASH DATE'] = pd.to_datetime(data['CRASH DATE'])
-data['CRASH TIME'] = pd.to_datetime(data['CRASH TIME'], format='%H:%M')
-
-# Time of Day Analysis
-data['Hour of Day'] = data['CRASH TIME'].dt.hour
+# Reuses the dataset loaded above and the 'Hour of Day' column added by add_temporal_features
 
 # Groups by 'Hour of Day' and calculates the average number of crashes per hour
 average_crashes_per_hour = data.groupby('Hour of Day').size() / data['Hour of Day'].nunique()
@@ -417,62 +456,21 @@ plt.show()
 # Samples a subset of the data for visualization
 sample_data_severity = data_geo.sample(n=1000, random_state=42)
 
-# Creats a base map
-m_severity = folium.Map(location=[40.730610, -73.935242], zoom_start=10)
-
-# Adds crashes to the map with color coding and shape coding based on severity
-for index, row in sample_data_severity.iterrows():
-    if row['NUMBER OF PERSONS KILLED'] > 0:
-        color = "Red"  # Fatalities
-
-        folium.features.RegularPolygonMarker(
-          location=[row['LATITUDE'], row['LONGITUDE']],
-          number_of_sides=3,
-          radius=5,
-          gradient = False,
-          color=color,
-          fill=True,
-          fill_color=color
-        ).add_to(m_severity)
-
-
-    elif row['NUMBER OF PERSONS INJURED'] > 0:
-        color = "Yellow"  # Injuries
-        folium.CircleMarker(
-          location=[row['LATITUDE'], row['LONGITUDE']],
-          radius=5,
-          color=color,
-          fill=True,
-          fill_color=color
-       ).add_to(m_severity)
-    else:
-        color = "Green"  # No injuries or fatalities
-        folium.features.RegularPolygonMarker(
-          location=[row['LATITUDE'], row['LONGITUDE']],
-          number_of_sides=4,
-          radius=5,
-          gradient = False,
-          color=color,
-          fill=True,
-          fill_color=color
-        ).add_to(m_severity)
-
-
+# Creates the map with one layer per severity class, color and shape coded as before:
+# red triangles for fatalities, yellow circles for injuries, green squares for neither
+m_severity = severity_map(sample_data_severity)
 m_severity.save("severity.html")
 
 
 #Creates a heatmap leveraging the latitude and longitude variables to determine where the most crashes are occurring
-from folium.plugins import HeatMap
+from tdsp_maps import geocoded, heatmap
 
 # Drops rows with missing latitude and longitude values
-data_geo = data.dropna(subset=['LATITUDE', 'LONGITUDE'])
-
-# Creates a base map
-m = folium.Map(location=[40.730610, -73.935242], zoom_start=10)  # Centered around NYC
+data_geo = geocoded(data)
 
-# Creates a heatmap
-heat_data = [[row['LATITUDE'], row['LONGITUDE']] for index, row in data_geo.iterrows()]
-HeatMap(heat_data, radius=8, max_zoom=13).add_to(m)
+# Creates the heatmap centered around NYC from crashes binned into grid cells for each range of zoom levels,
+# which also drops the (0, 0) coordinates; the page holds one weighted point per cell instead of one per crash
+m = heatmap(data_geo, radius=8, max_zoom=13)
 
 m.save("Heatmap.html")
 
@@ -0,0 +1,315 @@
+"""Online anomaly and change-point detection over the daily and monthly crash series.
+
+Two detectors run side by side on every series, one new value at a time:
+
+* RobustZScore compares each value with the median and MAD of the recent values of the
+  same phase (the same weekday for daily series; for monthly series, SeasonalZScore first
+  divides out a seasonal factor per calendar month) and flags single outlying days or months.
+* Cusum accumulates those robust z-scores and flags sustained shifts in the level, such as
+  the drop in March 2020, with the date the shift started.
+
+Each update does a fixed amount of work that does not depend on how much history has been
+seen, and the whole state of a CrashMonitor round-trips through JSON, so a daily refresh only
+feeds the new days instead of reprocessing the full history.
+"""
+
+import bisect
+import json
+import os
+import statistics
+
+import numpy as np
+import pandas as pd
+
+from tdsp_data import write_json
+from tdsp_timeseries import TOTAL, daily_counts, resample
+
+
+# Scales the MAD to the standard deviation of a normal distribution
+MAD_SCALE = 1.4826
+
+# Granularity -> detector settings. Daily series compare each weekday with the last 8 of the
+# same weekday; monthly series take out each calendar month's seasonal factor first, so the
+# winter low is not flagged every year, and compare the result with the last 12 months
+DETECTOR_SETTINGS = {
+    'daily': {'detector': 'robust', 'window': 8, 'season': 7},
+    'monthly': {'detector': 'seasonal', 'window': 12, 'season': 12, 'years': 5},
+}
+
+FLAG_COLUMNS = ['series', 'kind', 'date', 'start', 'value', 'expected', 'magnitude', 'score']
+
+
+class RobustZScore:
+    """Rolling robust z-score: (value - median) / (1.4826 * MAD) over the last `window` values.
+
+    With `season` > 1 a separate window is kept for each phase, e.g. season=7 compares a
+    Monday only with earlier Mondays. Values are compared as rates per unit of `exposure`
+    (days in the month for monthly counts, so February is not always low). Counts are noisy
+    at least as a Poisson variable, so the scale never drops below the square root of the
+    expected count.
+    """
+
+    def __init__(self, window=8, season=1, threshold=3.5, min_periods=None):
+        self.window = window
+        self.season = season
+        self.threshold = threshold
+        self.min_periods = window // 2 if min_periods is None else min_periods
+        self.phase = 0
+        self.recent = [[] for _ in range(season)]
+        self._sorted = [[] for _ in range(season)]
+
+    def update(self, value, exposure=1.0):
+        """Adds one value; returns (expected, scale, score), or None while still warming up."""
+        recent, ordered = self.recent[self.phase], self._sorted[self.phase]
+        result = None
+        if len(recent) >= self.min_periods:
+            median = statistics.median(ordered)
+            mad = statistics.median(abs(x - median) for x in ordered)
+            expected = median * exposure
+            scale = max(MAD_SCALE * mad * exposure, np.sqrt(max(expected, 1.0)))
+            result = (expected, scale, (value - expected) / scale)
+
+        rate = value / exposure
+        recent.append(rate)
+        bisect.insort(ordered, rate)
+        if len(recent) > self.window:
+            del ordered[bisect.bisect_left(ordered, recent.pop(0))]
+        self.phase = (self.phase + 1) % self.season
+        return result
+
+    def state(self):
+        return {'detector': 'robust', 'window': self.window, 'season': self.season, 'threshold': self.threshold,
+                'min_periods': self.min_periods, 'phase': self.phase, 'recent': self.recent}
+
+    @classmethod
+    def from_state(cls, state):
+        detector = cls(state['window'], state['season'], state['threshold'], state['min_periods'])
+        detector.phase = state['phase']
+        detector.recent = [list(values) for values in state['recent']]
+        detector._sorted = [sorted(values) for values in detector.recent]
+        return detector
+
+
+class SeasonalZScore:
+    """RobustZScore over seasonally adjusted values, for monthly series.
+
+    Each phase (calendar month) has a seasonal factor: the median, over its last `years`
+    occurrences, of its rate divided by the mean rate of the `season` values up to it.
+    Values are divided by their factor before they reach a RobustZScore over the last
+    `window` adjusted values, and the expected value and scale it returns are multiplied
+    back. Nothing is scored until a phase has a factor, i.e. during the first `season` values.
+    """
+
+    def __init__(self, window=12, season=12, years=5, threshold=3.5, min_periods=None):
+        self.season = season
+        self.years = years
+        self.threshold = threshold
+        self.level = RobustZScore(window, 1, threshold, min_periods)
+        self.phase = 0
+        self.rates = []
+        self.ratios = [[] for _ in range(season)]
+
+    def update(self, value, exposure=1.0):
+        """Adds one value; returns (expected, scale, score), or None while still warming up."""
+        ratios = self.ratios[self.phase]
+        result = None
+        if ratios:
+            factor = statistics.median(ratios)
+            result = self.level.update(value / factor, exposure)
+            if result is not None:
+                expected, scale, score = result
+                result = (expected * factor, scale * factor, score)
+
+        rate = value / exposure
+        self.rates = (self.rates + [rate])[-self.season:]
+        mean = sum(self.rates) / len(self.rates)
+        if len(self.rates) == self.season and mean > 0:
+            ratios.append(rate / mean)
+            del ratios[:-self.years]
+        self.phase = (self.phase + 1) % self.season
+        return result
+
+    def state(self):
+        return {'detector': 'seasonal', 'season': self.season, 'years': self.years, 'threshold': self.threshold,
+                'phase': self.phase, 'rates': self.rates, 'ratios': self.ratios, 'level': self.level.state()}
+
+    @classmethod
+    def from_state(cls, state):
+        detector = cls(season=state['season'], years=state['years'], threshold=state['threshold'])
+        detector.level = RobustZScore.from_state(state['level'])
+        detector.phase = state['phase']
+        detector.rates = list(state['rates'])
+        detector.ratios = [list(values) for values in state['ratios']]
+        return detector
+
+
+DETECTORS = {'robust': RobustZScore, 'seasonal': SeasonalZScore}
+
+
+def detector_from_state(state):
+    # Monitors saved before SeasonalZScore existed have no 'detector' entry
+    return DETECTORS[state.get('detector', 'robust')].from_state(state)
+
+
+class Cusum:
+    """Two-sided CUSUM over standardized scores.
+
+    Scores are clipped to +-`clip` so one extreme day cannot trigger an alarm on its own;
+    `drift` is the slack subtracted per step and `threshold` the alarm level. A run raises at
+    most one alarm, reporting the date the run started and the mean deviation from the
+    expected value so far; the run ends once the sum falls back to zero.
+    """
+
+    def __init__(self, drift=0.5, threshold=8.0, clip=4.0):
+        self.drift = drift
+        self.threshold = threshold
+        self.clip = clip
+        # Per direction: cumulative sum, start date, summed deviation, length and alarm raised
+        self.runs = {'up': self._new_run(), 'down': self._new_run()}
+
+    @staticmethod
+    def _new_run():
+        return [0.0, None, 0.0, 0, False]
+
+    def update(self, date, score, deviation):
+        """Adds one standardized score; returns a list of (direction, start, magnitude) alarms."""
+        score = min(max(score, -self.clip), self.clip)
+        alarms = []
+        for direction, sign in (('up', 1), ('down', -1)):
+            run = self.runs[direction]
+            total = max(0.0, run[0] + sign * score - self.drift)
+            if total == 0.0:
+                self.runs[direction] = self._new_run()
+                continue
+            if run[1] is None:
+                run[1], run[2], run[3] = date, 0.0, 0
+            run[0] = total
+            run[2] += deviation
+            run[3] += 1
+            if total > self.threshold and not run[4]:
+                alarms.append((direction, run[1], run[2] / run[3]))
+                run[4] = True
+        return alarms
+
+    def state(self):
+        return {'drift': self.drift, 'threshold': self.threshold, 'clip': self.clip, 'runs': self.runs}
+
+    @classmethod
+    def from_state(cls, state):
+        detector = cls(state['drift'], state['threshold'], state['clip'])
+        detector.runs = {direction: list(run) for direction, run in state['runs'].items()}
+        return detector
+
+
+class SeriesMonitor:
+    """Both detectors for one series, plus the last date they have seen."""
+
+    def __init__(self, zscore, cusum, last=None):
+        self.zscore = zscore
+        self.cusum = cusum
+        self.last = last
+
+    def update(self, date, value, exposure=1.0):
+        """Feeds one value; returns the flags it raised as dicts (without the series name)."""
+        flags = []
+        result = self.zscore.update(float(value), exposure)
+        self.last = date
+        if result is None:
+            return flags
+        expected, scale, score = result
+        if abs(score) >= self.zscore.threshold:
+            flags.append({'kind': 'outlier', 'date': date, 'start': date, 'value': value,
+                          'expected': expected, 'magnitude': value - expected, 'score': score})
+        for direction, start, magnitude in self.cusum.update(date, score, value - expected):
+            flags.append({'kind': 'shift ' + direction, 'date': date, 'start': start, 'value': value,
+                          'expected': expected, 'magnitude': magnitude, 'score': score})
+        return flags
+
+    def state(self):
+        return {'zscore': self.zscore.state(), 'cusum': self.cusum.state(), 'last': self.last}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(detector_from_state(state['zscore']), Cusum.from_state(state['cusum']), state['last'])
+
+
+def crash_series(data, slices=('BOROUGH',)):
+    """Returns {name: series} with the daily and monthly totals and the same for each slice.
+
+    Names look like 'daily/ALL' or 'monthly/BOROUGH=QUEENS'. The last month is left out
+    unless its final day is in `data`, so a partial month is never flagged.
+    """
+    series = {}
+    for column in [None] + list(slices):
+        daily = daily_counts(data, column)
+        if daily.empty:
+            continue
+        monthly = resample(daily, 'monthly')
+        if daily.index[-1] != daily.index[-1] + pd.offsets.MonthEnd(0):
+            monthly = monthly.iloc[:-1]
+        for granularity, frame in (('daily', daily), ('monthly', monthly)):
+            for name in frame.columns:
+                label = TOTAL if column is None else '%s=%s' % (column, name)
+                series['%s/%s' % (granularity, label)] = frame[name]
+    return series
+
+
+class CrashMonitor:
+    """Anomaly and change-point detectors for the daily and monthly series of every slice.
+
+    update(data) only feeds the days and months after the last one each series has seen, so
+    calling it again with overlapping data is safe. `data` must hold every crash of the days
+    it covers and start on the first of a month, e.g. the months returned by
+    CrashStore.ingest loaded back with CrashStore.load(months).
+    """
+
+    def __init__(self, slices=('BOROUGH',), settings=DETECTOR_SETTINGS):
+        self.slices = list(slices)
+        self.settings = {granularity: dict(options) for granularity, options in settings.items()}
+        self.monitors = {}
+
+    def _monitor(self, name):
+        monitor = self.monitors.get(name)
+        if monitor is None:
+            options = dict(self.settings[name.split('/', 1)[0]])
+            detector = DETECTORS[options.pop('detector', 'robust')](**options)
+            monitor = self.monitors[name] = SeriesMonitor(detector, Cusum())
+        return monitor
+
+    def update(self, data):
+        """Feeds the new values in `data`; returns the raised flags as a DataFrame."""
+        flags = []
+        for name, series in crash_series(data, self.slices).items():
+            monitor = self._monitor(name)
+            if monitor.last is not None:
+                series = series[series.index > pd.Timestamp(monitor.last)]
+            monthly = name.startswith('monthly/')
+            for date, value in series.items():
+                exposure = date.days_in_month if monthly else 1.0
+                for flag in monitor.update(date.strftime('%Y-%m-%d'), int(value), exposure):
+                    flags.append(dict(flag, series=name))
+        flags = pd.DataFrame(flags, columns=FLAG_COLUMNS)
+        for column in ['date', 'start']:
+            flags[column] = pd.to_datetime(flags[column])
+        return flags
+
+    def state(self):
+        return {'slices': self.slices, 'settings': self.settings,
+                'monitors': {name: monitor.state() for name, monitor in self.monitors.items()}}
+
+    @classmethod
+    def from_state(cls, state):
+        monitor = cls(state['slices'], state['settings'])
+        monitor.monitors = {name: SeriesMonitor.from_state(series) for name, series in state['monitors'].items()}
+        return monitor
+
+    def save(self, path):
+        write_json(path, self.state())
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Loads a saved monitor, or returns a new one built with `kwargs` if there is none."""
+        if not os.path.exists(path):
+            return cls(**kwargs)
+        with open(path) as handle:
+            return cls.from_state(json.load(handle))
@@ -0,0 +1,240 @@
+"""Times every analysis stage on synthetic data of growing size and records its peak memory.
+
+    python tdsp_benchmark.py run --sizes 1M 10M 50M
+    python tdsp_benchmark.py compare benchmarks/benchmark-20241007-101500.json benchmarks/benchmark-20241014-093000.json
+
+For each size a synthetic CSV is generated once (tdsp_synthetic) and kept in --data-dir.
+The stages then run in order in a child process of their own: reading the CSV, writing and
+reading the Parquet cache, describe(), the temporal features and the compute and render
+steps of every section in tdsp_sections. Each stage records its wall and CPU time and the
+peak resident memory of the process while it ran, sampled every few milliseconds.
+
+The records are written to a JSON file in --results-dir after every stage. If a size runs
+out of memory the child is killed, the stage it was in is recorded as failed and the next
+size starts, which shows where the pipeline breaks.
+"""
+
+import argparse
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from queue import Empty
+
+import numpy as np
+import pandas as pd
+
+from tdsp_data import load_crashes, read_crashes_csv, write_json
+from tdsp_pipeline import output_name, prepare, reusable_figure
+from tdsp_profile import PeakMemory
+from tdsp_sections import SECTIONS
+from tdsp_synthetic import write_csv
+
+
+DEFAULT_SIZES = ['1M', '10M', '50M']
+
+_SUFFIXES = {'K': 10 ** 3, 'M': 10 ** 6, 'B': 10 ** 9}
+
+
+def parse_size(size):
+    """Parses '500k', '10M' or '2000000' to a number of rows."""
+    size = str(size).strip().upper()
+    if size[-1:] in _SUFFIXES:
+        return int(float(size[:-1]) * _SUFFIXES[size[-1]])
+    return int(size)
+
+
+def measure(function, *args):
+    """Runs function(*args); returns (result, {seconds, cpu_seconds, rss_mb, peak_rss_mb})."""
+    wall, cpu = time.perf_counter(), time.process_time()
+    with PeakMemory() as memory:
+        result = function(*args)
+    record = {
+        'seconds': time.perf_counter() - wall,
+        'cpu_seconds': time.process_time() - cpu,
+        'rss_mb': memory.start / 2 ** 20 if memory.start is not None else None,
+        'peak_rss_mb': memory.peak / 2 ** 20 if memory.peak is not None else None,
+    }
+    return result, record
+
+
+def _section_stage(section, output_dir):
+    def stage(state):
+        aggregate = section.compute(state['data'])
+        section.render(aggregate, os.path.join(output_dir, output_name(section)), fig=reusable_figure())
+    return stage
+
+
+def stages(csv_path, work_dir):
+    """Returns the benchmark stages as (name, function(state)) in the order they run.
+
+    `state` is a dict shared by the stages; the loading stages put the crashes in
+    state['data'] for the ones after them.
+    """
+    cache_dir = os.path.join(work_dir, 'cache')
+    output_dir = os.path.join(work_dir, 'output')
+    os.makedirs(output_dir, exist_ok=True)
+
+    def load_csv(state):
+        state['data'] = read_crashes_csv(csv_path)
+
+    def write_cache(state):
+        del state['data']
+        state['data'] = load_crashes(csv_path, cache_dir=cache_dir)
+
+    def read_cache(state):
+        del state['data']
+        state['data'] = load_crashes(csv_path, cache_dir=cache_dir)
+
+    def describe(state):
+        state['data'].describe()
+
+    def temporal_features(state):
+        prepare(state['data'])
+
+    steps = [('load_csv', load_csv), ('write_cache', write_cache), ('read_cache', read_cache),
+             ('describe', describe), ('temporal_features', temporal_features)]
+    steps += [(section.name, _section_stage(section, output_dir)) for section in SECTIONS]
+    return steps
+
+
+def _run_stages(csv_path, rows, queue):
+    import matplotlib
+    matplotlib.use('Agg')
+
+    state = {}
+    with tempfile.TemporaryDirectory(prefix='tdsp-bench-') as work_dir:
+        for name, stage in stages(csv_path, work_dir):
+            queue.put({'stage': name, 'status': 'started'})
+            try:
+                _, record = measure(stage, state)
+            except Exception as error:
+                queue.put({'stage': name, 'status': 'failed', 'error': '%s: %s' % (type(error).__name__, error)})
+                # Without the data none of the later stages can run
+                if 'data' not in state:
+                    return
+                continue
+            queue.put(dict(record, stage=name, rows=rows, status='ok'))
+
+
+def benchmark_size(rows, data_dir, seed=0):
+    """Benchmarks one size in a child process and yields a record per stage as it finishes."""
+    os.makedirs(data_dir, exist_ok=True)
+    csv_path = os.path.join(data_dir, 'synthetic-%d-%d.csv' % (rows, seed))
+    if not os.path.exists(csv_path):
+        _, record = measure(write_csv, csv_path, rows, seed)
+        yield dict(record, stage='generate', rows=rows, status='ok')
+
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    child = context.Process(target=_run_stages, args=(csv_path, rows, queue))
+    child.start()
+    running = None
+    while True:
+        try:
+            record = queue.get(timeout=1)
+        except Empty:
+            if child.is_alive():
+                continue
+            break
+        if record['status'] == 'started':
+            running = record['stage']
+            continue
+        running = None
+        yield dict(record, rows=rows)
+    child.join()
+    if running is not None:
+        # The child died inside a stage, most likely killed for running out of memory
+        yield {'stage': running, 'rows': rows, 'status': 'failed', 'error': 'exit code %s' % child.exitcode}
+
+
+def environment():
+    """Returns what the results depend on: versions, cores, memory and the git commit."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    memory = None
+    if os.path.exists('/proc/meminfo'):
+        with open('/proc/meminfo') as handle:
+            memory = int(handle.readline().split()[1]) / 2 ** 20
+    return {
+        'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+        'platform': platform.platform(), 'cpus': os.cpu_count(), 'memory_gb': memory, 'commit': commit,
+    }
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, data_dir='benchmark_data', results_dir='benchmarks', seed=0, on_record=None):
+    """Benchmarks every size in turn; returns the path of the results file."""
+    os.makedirs(results_dir, exist_ok=True)
+    started = time.strftime('%Y%m%d-%H%M%S')
+    path = os.path.join(results_dir, 'benchmark-%s.json' % started)
+    results = {'started': started, 'environment': environment(), 'records': []}
+    for size in sizes:
+        for record in benchmark_size(parse_size(size), data_dir, seed):
+            results['records'].append(record)
+            write_json(path, results)
+            if on_record is not None:
+                on_record(record)
+    return path
+
+
+def load_results(path):
+    """Returns the records of a results file as a DataFrame."""
+    results = pd.read_json(path, typ='series')
+    records = pd.DataFrame(results['records'])
+    records['run'] = os.path.splitext(os.path.basename(path))[0]
+    return records
+
+
+def compare(paths, value='seconds'):
+    """Returns `value` per (rows, stage) with one column per results file."""
+    records = pd.concat([load_results(path) for path in paths], ignore_index=True)
+    order = {name: position for position, name in enumerate(records['stage'].drop_duplicates())}
+    table = records.pivot_table(index=['rows', 'stage'], columns='run', values=value, aggfunc='last')
+    return table.sort_index(key=lambda index: index.map(order) if index.name == 'stage' else index)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the TDSP analysis on synthetic data.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help='run the benchmark')
+    run.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='rows per run, e.g. 500k 1M (default: 1M 10M 50M)')
+    run.add_argument('--data-dir', default='benchmark_data', help='where the synthetic CSVs are kept')
+    run.add_argument('--results-dir', default='benchmarks', help='where the results are written')
+    run.add_argument('--seed', type=int, default=0, help='random seed of the generator (default: 0)')
+    run.add_argument('--clean', action='store_true', help='delete the synthetic CSVs afterwards')
+    comparison = commands.add_parser('compare', help='compare results files')
+    comparison.add_argument('paths', nargs='+', help='results files written by run')
+    comparison.add_argument('--measure', default='seconds', choices=['seconds', 'cpu_seconds', 'peak_rss_mb'])
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'compare':
+        with pd.option_context('display.width', 200, 'display.max_rows', None):
+            print(compare(args.paths, args.measure).round(2))
+        return 0
+
+    def report(record):
+        if record['status'] == 'ok':
+            print('%11d %-18s %8.2f s %9.0f MB' % (record['rows'], record['stage'], record['seconds'],
+                                                   record['peak_rss_mb'] or 0))
+        else:
+            print('%11d %-18s FAILED: %s' % (record['rows'], record['stage'], record['error']))
+
+    path = run_benchmark(args.sizes, args.data_dir, args.results_dir, args.seed, on_record=report)
+    print('results written to %s' % path)
+    if args.clean:
+        shutil.rmtree(args.data_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,296 @@
+"""Maps the free-text vehicle types and contributing factors to canonical categories.
+
+The VEHICLE TYPE CODE and CONTRIBUTING FACTOR VEHICLE columns hold thousands of spellings
+of a few hundred categories ('Taxi' and 'TAXI', 'Station Wagon/Sport Utility Vehicle' and
+'SPORT UTILITY / STATION WAGON', 'AMBUL', ...). Only the distinct raw values are resolved,
+in this order:
+
+1. case, whitespace and the spacing around '/' and '-' are folded;
+2. a curated alias table maps known variants to their canonical name;
+3. values close to a known category are matched to it, by difflib similarity or, for values
+   cut off at the export's old 5-character limit such as 'AMBUL', as a prefix;
+4. frequent values left over become categories of their own, spelled as their most common
+   variant, and rare ones are matched against those as well or kept as they are.
+
+The learned raw -> canonical mapping is saved as JSON, so later runs only resolve values
+they have not seen before and apply the rest as one lookup on the categorical codes.
+"""
+
+import difflib
+import hashlib
+import json
+import os
+import re
+
+import pandas as pd
+
+from tdsp_data import FACTOR_COLUMNS, VEHICLE_COLUMNS, default_cache_dir, map_categories, write_json
+from tdsp_profile import profiled
+
+
+# Kind of category -> the columns holding it; all columns of one kind share their categories
+NORMALIZED_COLUMNS = {
+    'vehicle': VEHICLE_COLUMNS,
+    'factor': FACTOR_COLUMNS,
+}
+
+MAPPING_FILE = 'categories.json'
+
+# Bumped whenever the matching rules change, so mappings learned under the old rules are relearned
+MAPPING_VERSION = 3
+
+# Older rows of the export hold values cut off at this many characters ('AMBUL', 'UNKNO')
+TRUNCATED_LENGTH = 5
+
+# Folded variant -> canonical name
+VEHICLE_ALIASES = {
+    'station wagon/sport utility vehicle': 'Station Wagon/Sport Utility Vehicle',
+    'sport utility/station wagon': 'Station Wagon/Sport Utility Vehicle',
+    'sport utility vehicle': 'Station Wagon/Sport Utility Vehicle',
+    'station wagon': 'Station Wagon/Sport Utility Vehicle',
+    'suv': 'Station Wagon/Sport Utility Vehicle',
+    'taxi': 'Taxi',
+    'yellow taxi': 'Taxi',
+    'taxi cab': 'Taxi',
+    'cab': 'Taxi',
+    'sedan': 'Sedan',
+    '4 dr sedan': 'Sedan',
+    '2 dr sedan': 'Sedan',
+    '4dsd': 'Sedan',
+    'passenger vehicle': 'Passenger Vehicle',
+    'pick-up truck': 'Pick-up Truck',
+    'pick up truck': 'Pick-up Truck',
+    'pickup truck': 'Pick-up Truck',
+    'pickup': 'Pick-up Truck',
+    'pick': 'Pick-up Truck',
+    'box truck': 'Box Truck',
+    'box': 'Box Truck',
+    'bike': 'Bike',
+    'bicycle': 'Bike',
+    'e-bike': 'E-Bike',
+    'ebike': 'E-Bike',
+    'e-scooter': 'E-Scooter',
+    'escooter': 'E-Scooter',
+    'scooter': 'Scooter',
+    'motorscooter': 'Motorscooter',
+    'motor scooter': 'Motorscooter',
+    'moped': 'Moped',
+    'motorcycle': 'Motorcycle',
+    'motorbike': 'Motorcycle',
+    'ambulance': 'Ambulance',
+    'ambul': 'Ambulance',
+    'amb': 'Ambulance',
+    'fire truck': 'Fire Truck',
+    'firetruck': 'Fire Truck',
+    'fire': 'Fire Truck',
+    'fdny': 'Fire Truck',
+    'bus': 'Bus',
+    'school bus': 'Bus',
+    'van': 'Van',
+    'tractor truck diesel': 'Tractor Truck Diesel',
+    'tractor truck gasoline': 'Tractor Truck Gasoline',
+    'garbage or refuse': 'Garbage or Refuse',
+    'tow truck/wrecker': 'Tow Truck / Wrecker',
+    'tow truck': 'Tow Truck / Wrecker',
+    'dump': 'Dump',
+    'convertible': 'Convertible',
+    'unknown': 'Unknown',
+    'unkno': 'Unknown',
+    'unk': 'Unknown',
+}
+
+FACTOR_ALIASES = {
+    'unspecified': 'Unspecified',
+    'driver inattention/distraction': 'Driver Inattention/Distraction',
+    'failure to yield right-of-way': 'Failure to Yield Right-of-Way',
+    'following too closely': 'Following Too Closely',
+    'backing unsafely': 'Backing Unsafely',
+    'passing or lane usage improper': 'Passing or Lane Usage Improper',
+    'passing too closely': 'Passing Too Closely',
+    'unsafe lane changing': 'Unsafe Lane Changing',
+    'unsafe speed': 'Unsafe Speed',
+    'traffic control disregarded': 'Traffic Control Disregarded',
+    'driver inexperience': 'Driver Inexperience',
+    'alcohol involvement': 'Alcohol Involvement',
+    'illness': 'Illness',
+    'illnes': 'Illness',
+    'drugs (illegal)': 'Drugs (illegal)',
+    'drugs (illicit)': 'Drugs (illegal)',
+    'cell phone (hand-held)': 'Cell Phone (hand-Held)',
+    'cell phone (hands-free)': 'Cell Phone (hands-free)',
+    'reaction to uninvolved vehicle': 'Reaction to Uninvolved Vehicle',
+    'reaction to other uninvolved vehicle': 'Reaction to Uninvolved Vehicle',
+}
+
+ALIASES = {
+    'vehicle': VEHICLE_ALIASES,
+    'factor': FACTOR_ALIASES,
+}
+
+_SPACES = re.compile(r'\s+')
+_JOINERS = re.compile(r'\s*([/-])\s*')
+
+
+def fold(value):
+    """Lower-cases a value and folds whitespace, including around '/' and '-'."""
+    return _JOINERS.sub(r'\1', _SPACES.sub(' ', str(value).strip().lower()))
+
+
+def _tidy(value):
+    return _SPACES.sub(' ', str(value).strip())
+
+
+class CategoryNormalizer:
+    """Learns and applies the raw -> canonical mapping of one kind of category.
+
+    A value matches a category at a difflib similarity of at least `cutoff`, unless the two
+    differ only by a leading word ('Scooter' and 'E-Scooter'), or, when it is exactly
+    TRUNCATED_LENGTH characters long, by being a prefix of exactly one category. Unmatched
+    values seen at least `min_count` times become categories of their own; rarer ones are
+    matched again against those, or kept as they are.
+    """
+
+    def __init__(self, aliases=None, cutoff=0.85, min_count=100):
+        self.aliases = dict(aliases or {})
+        self.cutoff = cutoff
+        self.min_count = min_count
+        # Raw value -> canonical name (None for blanks)
+        self.mapping = {}
+        # Folded canonical name or alias -> canonical name
+        self.canonical = {fold(name): name for name in self.aliases.values()}
+        self.canonical.update(self.aliases)
+
+    def learn(self, counts):
+        """Resolves the raw values of `counts` (value -> count) that are not mapped yet."""
+        counts = counts[~counts.index.isin(list(self.mapping))]
+        counts = counts[counts > 0]
+        if counts.empty:
+            return self
+        keys = pd.Series([fold(raw) for raw in counts.index], index=counts.index)
+
+        unresolved = []
+        for raw, key in keys.items():
+            if not key:
+                self.mapping[raw] = None
+            elif key in self.canonical:
+                self.mapping[raw] = self.canonical[key]
+            else:
+                unresolved.append(raw)
+        if not unresolved:
+            return self
+
+        # Known categories first, so that frequent misspellings still join them
+        matched = {key: self._match(key) for key in set(keys[unresolved])}
+        for raw in unresolved:
+            if matched[keys[raw]] is not None:
+                self.mapping[raw] = matched[keys[raw]]
+        unresolved = [raw for raw in unresolved if matched[keys[raw]] is None]
+        if not unresolved:
+            return self
+
+        # Frequent keys become categories, spelled as their most common raw variant
+        grouped = pd.DataFrame({'key': keys[unresolved], 'count': counts[unresolved]})
+        totals = grouped.groupby('key')['count'].sum().sort_values(ascending=False)
+        spelling = grouped.sort_values('count', ascending=False).groupby('key').head(1)
+        spelling = {key: _tidy(raw) for raw, key in spelling['key'].items()}
+        for key in totals.index[totals >= self.min_count]:
+            self.canonical[key] = spelling[key]
+
+        for raw in unresolved:
+            key = keys[raw]
+            name = self.canonical.get(key) or self._match(key)
+            if name is None:
+                name = self.canonical[key] = spelling[key]
+            self.mapping[raw] = name
+        return self
+
+    def _match(self, key):
+        # Very short keys match almost anything, so they must be spelled out exactly
+        if len(key) < 4:
+            return None
+        for close in difflib.get_close_matches(key, list(self.canonical), n=3, cutoff=self.cutoff):
+            # 'scooter' and 'e-scooter' are different vehicles however similar they look
+            if not (close.endswith(key) or key.endswith(close)):
+                return self.canonical[close]
+        if len(key) != TRUNCATED_LENGTH:
+            return None
+        names = {name for known, name in self.canonical.items() if known.startswith(key)}
+        return names.pop() if len(names) == 1 else None
+
+    @property
+    def categories(self):
+        return sorted({name for name in self.mapping.values() if name is not None})
+
+    def codes(self, values, categories):
+        """Returns the codes of `values` in `categories` after mapping, -1 where missing."""
+        position = {name: code for code, name in enumerate(categories)}
+        return map_categories(values, lambda raw: position.get(self.mapping.get(raw), -1), -1, 'int32')
+
+    def state(self):
+        return {'mapping': self.mapping, 'canonical': self.canonical}
+
+    def restore(self, state):
+        self.mapping.update(state.get('mapping', {}))
+        self.canonical.update(state.get('canonical', {}))
+        return self
+
+
+def mapping_path(path):
+    """Returns where the learned mapping of a CSV export is kept, next to its Parquet cache."""
+    return os.path.join(default_cache_dir(path), MAPPING_FILE)
+
+
+def load_normalizers(path=None, **kwargs):
+    """Returns {kind: CategoryNormalizer}, restored from the mapping file at `path` if there is one."""
+    normalizers = {kind: CategoryNormalizer(ALIASES[kind], **kwargs) for kind in NORMALIZED_COLUMNS}
+    if path is not None and os.path.exists(path):
+        with open(path) as handle:
+            saved = json.load(handle)
+        if saved.get('version') == MAPPING_VERSION:
+            for kind, state in saved.items():
+                if kind in normalizers:
+                    normalizers[kind].restore(state)
+    return normalizers
+
+
+def mapping_digest(normalizers):
+    """Returns a short hash of the mappings of `normalizers`, for keying caches of normalized data."""
+    saved = {kind: normalizer.state() for kind, normalizer in normalizers.items()}
+    text = json.dumps(dict(saved, version=MAPPING_VERSION), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:12]
+
+
+def save_normalizers(normalizers, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    saved = {kind: normalizer.state() for kind, normalizer in normalizers.items()}
+    write_json(path, dict(saved, version=MAPPING_VERSION))
+
+
+@profiled()
+def normalize_categories(data, path=None, normalizers=None):
+    """Replaces the vehicle type and factor columns of `data` with canonical categoricals.
+
+    All five columns of a kind share one set of categories, so their codes can be compared
+    directly. The mapping is read from and written back to `path` (see mapping_path) when
+    given; it only changes when `data` holds raw values that have not been seen before.
+    Normalizing data that is already normalized leaves it unchanged.
+    """
+    normalizers = normalizers or load_normalizers(path)
+    learned = False
+    for kind, columns in NORMALIZED_COLUMNS.items():
+        normalizer = normalizers[kind]
+        columns = [column for column in columns if column in data]
+        seen = len(normalizer.mapping)
+        if columns:
+            # A value counts towards min_count over all the columns of its kind at once
+            counts = pd.concat([data[column].value_counts(sort=False) for column in columns])
+            normalizer.learn(counts.groupby(level=0, observed=True).sum())
+        learned = learned or len(normalizer.mapping) != seen
+
+        categories = normalizer.categories
+        for column in columns:
+            codes = normalizer.codes(data[column], categories)
+            data[column] = pd.Categorical.from_codes(codes, categories=categories)
+    if learned and path is not None:
+        save_normalizers(normalizers, path)
+    return data
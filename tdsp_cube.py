@@ -0,0 +1,123 @@
+"""Precomputed aggregate cube of crash, injury and fatality counts.
+
+The base of the cube sums every count column over (date, hour, borough, primary
+contributing factor, primary vehicle type), with weekday and month carried along as
+attributes of the date. Any slice or roll-up is answered from the smallest cuboid already
+computed that covers the requested dimensions; each new roll-up is kept for later queries.
+"""
+
+import os
+
+import pandas as pd
+
+from tdsp_data import COUNT_COLUMNS, write_parquet
+from tdsp_time import crash_hours
+
+
+# Dimensions of the cube; month and weekday are attributes of the date
+DIMENSIONS = ['date', 'month', 'weekday', 'hour', 'borough', 'factor', 'vehicle']
+MEASURES = ['crashes'] + COUNT_COLUMNS
+
+# Roll-ups materialized when the cube is built, for the questions asked most often
+DEFAULT_CUBOIDS = [
+    ('hour',),
+    ('hour', 'borough'),
+    ('hour', 'weekday', 'borough'),
+    ('month', 'borough'),
+    ('date',),
+    ('borough', 'factor'),
+    ('borough', 'vehicle'),
+]
+
+
+def cube_frame(data):
+    """Returns the crashes reduced to the cube dimensions and measures, one row per crash."""
+    dates = data['CRASH DATE']
+    frame = pd.DataFrame({
+        'date': dates,
+        'month': dates.dt.to_period('M'),
+        'weekday': dates.dt.dayofweek.astype('int8'),
+        'hour': crash_hours(data['CRASH TIME']).astype('int8'),
+        'borough': data['BOROUGH'],
+        'factor': data['CONTRIBUTING FACTOR VEHICLE 1'],
+        'vehicle': data['VEHICLE TYPE CODE 1'],
+        'crashes': 1,
+    })
+    for column in COUNT_COLUMNS:
+        frame[column] = data[column].fillna(0).astype('int64')
+    return frame
+
+
+def _group(frame, dims):
+    grouped = frame.groupby(list(dims), observed=True, dropna=False, sort=False)[MEASURES].sum()
+    return grouped.reset_index()
+
+
+class CrashCube:
+    """Roll-ups of crash counts over DIMENSIONS, computed once and kept in memory."""
+
+    def __init__(self, base, cuboids=DEFAULT_CUBOIDS):
+        self.cuboids = {frozenset(DIMENSIONS): base}
+        for dims in cuboids:
+            self.cuboid(dims)
+
+    @classmethod
+    def build(cls, data, cuboids=DEFAULT_CUBOIDS):
+        """Builds the cube from a crashes frame in a single grouped pass."""
+        return cls(_group(cube_frame(data), DIMENSIONS), cuboids)
+
+    @property
+    def base(self):
+        return self.cuboids[frozenset(DIMENSIONS)]
+
+    def cuboid(self, dims):
+        """Returns the roll-up over `dims`, computing it from the smallest covering cuboid."""
+        key = frozenset(dims)
+        unknown = key - set(DIMENSIONS)
+        if unknown:
+            raise KeyError('unknown cube dimensions: %s' % ', '.join(sorted(unknown)))
+        if not key:
+            # Grand totals can be summed from any cuboid
+            return min(self.cuboids.values(), key=len)
+        if key not in self.cuboids:
+            source = min((dims for dims in self.cuboids if dims >= key), key=lambda dims: len(self.cuboids[dims]))
+            self.cuboids[key] = _group(self.cuboids[source], [dim for dim in DIMENSIONS if dim in key])
+        return self.cuboids[key]
+
+    def query(self, by=(), where=None, measures=MEASURES):
+        """Sums `measures` grouped by the dimensions in `by`, after filtering with `where`.
+
+        `where` maps a dimension to a value or a list of values, e.g.
+        cube.query(by=['hour'], where={'borough': 'BROOKLYN', 'weekday': [5, 6]}).
+        With no `by` the totals are returned as a Series.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        where = where or {}
+        frame = self.cuboid(set(by) | set(where))
+        for dim, values in where.items():
+            values = list(values) if isinstance(values, (list, tuple, set)) else [values]
+            frame = frame[frame[dim].isin(_dimension_values(dim, values))]
+        measures = list(measures)
+        if not by:
+            return frame[measures].sum()
+        return frame.groupby(by, observed=True, dropna=False)[measures].sum()
+
+    def save(self, path):
+        """Writes the base cuboid to a Parquet file; the roll-ups are rebuilt on load."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        base = self.base.assign(month=self.base['month'].astype(str))
+        write_parquet(base, path)
+
+    @classmethod
+    def load(cls, path, cuboids=DEFAULT_CUBOIDS):
+        base = pd.read_parquet(path)
+        base['month'] = pd.PeriodIndex(base['month'], freq='M')
+        return cls(base, cuboids)
+
+
+def _dimension_values(dim, values):
+    if dim == 'date':
+        return pd.to_datetime(values)
+    if dim == 'month':
+        return [pd.Period(value, freq='M') for value in values]
+    return values
@@ -0,0 +1,190 @@
+"""Loads the NYC Motor Vehicle Collisions - Crashes data once, with an explicit schema and a Parquet cache."""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from tdsp_profile import profiled
+from tdsp_time import parse_dates
+
+
+# Location of the full export used throughout explorer_tdsp.py
+DATA_PATH = '/content/drive/MyDrive/Motor_Vehicle_Collisions_-_Crashes_20241007.csv'
+
+FACTOR_COLUMNS = ['CONTRIBUTING FACTOR VEHICLE %d' % i for i in range(1, 6)]
+VEHICLE_COLUMNS = ['VEHICLE TYPE CODE %d' % i for i in range(1, 6)]
+
+INJURY_COLUMNS = [
+    'NUMBER OF PERSONS INJURED',
+    'NUMBER OF PEDESTRIANS INJURED',
+    'NUMBER OF CYCLIST INJURED',
+    'NUMBER OF MOTORIST INJURED',
+]
+DEATH_COLUMNS = [
+    'NUMBER OF PERSONS KILLED',
+    'NUMBER OF PEDESTRIANS KILLED',
+    'NUMBER OF CYCLIST KILLED',
+    'NUMBER OF MOTORIST KILLED',
+]
+COUNT_COLUMNS = [column for pair in zip(INJURY_COLUMNS, DEATH_COLUMNS) for column in pair]
+
+# Column types for every column of the export. The counts are nullable because a handful of
+# rows in the export have blank injury/death counts; CRASH DATE is parsed separately on load.
+SCHEMA = {
+    'CRASH DATE': 'datetime64[ns]',
+    'CRASH TIME': 'category',
+    'BOROUGH': 'category',
+    'ZIP CODE': 'category',
+    'LATITUDE': 'float32',
+    'LONGITUDE': 'float32',
+    'LOCATION': 'string',
+    'ON STREET NAME': 'category',
+    'CROSS STREET NAME': 'category',
+    'OFF STREET NAME': 'category',
+    'COLLISION_ID': 'int64',
+}
+SCHEMA.update({column: 'UInt16' for column in INJURY_COLUMNS})
+SCHEMA.update({column: 'UInt8' for column in DEATH_COLUMNS})
+SCHEMA.update({column: 'category' for column in FACTOR_COLUMNS + VEHICLE_COLUMNS})
+
+# Bumped whenever SCHEMA or the parsing changes so that stale caches are rebuilt
+CACHE_VERSION = 3
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def csv_dtypes():
+    """Returns the read_csv dtypes of the export columns; apply_schema finishes the casts."""
+    dtype = {column: kind for column, kind in SCHEMA.items() if column != 'CRASH DATE'}
+    # Read as a categorical so that only the distinct dates are parsed
+    dtype['CRASH DATE'] = 'category'
+    # The C parser is much faster with floats than with nullable integers; apply_schema casts back
+    dtype.update({column: 'float64' for column in COUNT_COLUMNS})
+    return dtype
+
+
+@profiled()
+def read_crashes_csv(path, **kwargs):
+    """Reads the raw CSV export with the explicit schema (no dtype guessing)."""
+    data = pd.read_csv(path, dtype=csv_dtypes(), **kwargs)
+    if isinstance(data, pd.DataFrame):
+        return apply_schema(data)
+    # Chunked reads return an iterator; the schema is applied to each chunk as it is read
+    return (apply_schema(chunk) for chunk in data)
+
+
+def map_categories(values, lookup, missing, dtype=None):
+    """Returns lookup(value) for every row of a column, calling `lookup` once per distinct value.
+
+    Rows with a missing value get `missing`.
+    """
+    values = values.astype('category')
+    mapped = np.array([lookup(value) for value in values.cat.categories] + [missing], dtype=dtype)
+    # Missing values have code -1, which picks the trailing `missing`
+    return mapped[values.cat.codes.to_numpy()]
+
+
+def apply_schema(data):
+    """Brings a frame to the SCHEMA types: parses CRASH DATE and casts the other columns.
+
+    Also restores categoricals in frames built by concatenating pieces with different
+    categories, which fall back to object columns.
+    """
+    if 'CRASH DATE' in data:
+        data['CRASH DATE'] = parse_dates(data['CRASH DATE'])
+    for column, kind in SCHEMA.items():
+        if column == 'CRASH DATE' or column not in data:
+            continue
+        if kind == 'category':
+            if not isinstance(data[column].dtype, pd.CategoricalDtype):
+                data[column] = data[column].astype('category')
+        elif data[column].dtype != kind:
+            data[column] = data[column].astype(kind)
+    return data
+
+
+def file_digest(path):
+    """Returns the SHA-256 of a file, read in 1 MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(_HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def default_cache_dir(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.tdsp_cache')
+
+
+def cache_path(path, cache_dir=None):
+    """Returns the Parquet cache file for a CSV, keyed by the file's hash and mtime.
+
+    The SHA-256 is only recomputed when the size or mtime of the CSV changes; otherwise it
+    is read back from the index kept alongside the cache.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, 'index.json')
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as handle:
+            index = json.load(handle)
+
+    source = os.path.abspath(path)
+    entry = index.get(source)
+    if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_digest(path)}
+        index[source] = entry
+        write_json(index_path, index)
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    key = '%s-%d-v%d' % (entry['sha256'][:16], entry['mtime_ns'], CACHE_VERSION)
+    return os.path.join(cache_dir, '%s-%s.parquet' % (stem, key))
+
+
+@profiled()
+def load_crashes(path=DATA_PATH, columns=None, cache_dir=None, use_cache=True):
+    """Loads the crashes dataset, converting the CSV to a Parquet cache on first use.
+
+    Later calls open the cache directly, optionally reading only the given columns.
+    """
+    if not use_cache:
+        data = read_crashes_csv(path)
+        return data[columns] if columns is not None else data
+
+    cached = cache_path(path, cache_dir)
+    if not os.path.exists(cached):
+        data = read_crashes_csv(path)
+        write_parquet(data, cached)
+        _remove_stale_caches(cached)
+        return data[columns] if columns is not None else data
+    return pd.read_parquet(cached, columns=columns)
+
+
+@profiled()
+def write_parquet(data, path):
+    """Writes to a temporary file first so an interrupted run never leaves a partial file."""
+    tmp_path = path + '.tmp'
+    data.to_parquet(tmp_path, engine='pyarrow', index=False)
+    os.replace(tmp_path, path)
+
+
+def _remove_stale_caches(current):
+    # Drops caches of earlier versions of the same export once the new one is written
+    directory, name = os.path.split(current)
+    stem = name.rsplit('-', 3)[0]
+    for other in os.listdir(directory):
+        if other != name and other.endswith('.parquet') and other.rsplit('-', 3)[0] == stem:
+            os.remove(os.path.join(directory, other))
+
+
+def write_json(path, payload):
+    """Writes JSON through a temporary file, like write_parquet."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as handle:
+        json.dump(payload, handle, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
@@ -0,0 +1,198 @@
+"""Ranks the most dangerous intersections over the full geocoded dataset.
+
+Two views are offered: street-name pairs (ON STREET NAME x CROSS STREET NAME, normalized so
+that spelling variants and the order of the two streets do not matter), and spatial hotspots
+found with a KD-tree over projected crash coordinates, which also answers radius queries such
+as "all crashes within 50 m of this point".
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from tdsp_data import map_categories
+from tdsp_spatial import bin_crashes, project, severity_score, unproject, valid_coordinates
+
+
+# Street types written out in full so that '3 AVE' and '3 AVENUE' match; only the last word
+# is expanded ('ST NICHOLAS AVE')
+STREET_SUFFIXES = {
+    'AVE': 'AVENUE', 'AV': 'AVENUE', 'ST': 'STREET', 'STR': 'STREET', 'RD': 'ROAD',
+    'BLVD': 'BOULEVARD', 'PKWY': 'PARKWAY', 'PKY': 'PARKWAY', 'EXPY': 'EXPRESSWAY',
+    'EXPWY': 'EXPRESSWAY', 'HWY': 'HIGHWAY', 'PL': 'PLACE', 'DR': 'DRIVE', 'LN': 'LANE',
+    'CT': 'COURT', 'TER': 'TERRACE', 'TPKE': 'TURNPIKE', 'BR': 'BRIDGE', 'SQ': 'SQUARE',
+}
+
+# Abbreviated directions, expanded only as the first word ('E 14 ST', but 'AVENUE S')
+STREET_DIRECTIONS = {'E': 'EAST', 'W': 'WEST', 'N': 'NORTH', 'S': 'SOUTH'}
+
+_ORDINAL = re.compile(r'\b(\d+)(ST|ND|RD|TH)\b')
+_NON_WORD = re.compile(r'[^A-Z0-9 ]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_street(name):
+    """Upper-cases a street name, folds whitespace and punctuation, and expands abbreviations.
+
+    A street type is only expanded as the last word and a direction only as the first, so
+    'ST NICHOLAS AVE' becomes 'ST NICHOLAS AVENUE' and 'E 14 ST' becomes 'EAST 14 STREET'.
+    """
+    name = _SPACES.sub(' ', _NON_WORD.sub(' ', str(name).upper())).strip()
+    words = _ORDINAL.sub(r'\1', name).split(' ')
+    if len(words) > 1:
+        words[0] = STREET_DIRECTIONS.get(words[0], words[0])
+    words[-1] = STREET_SUFFIXES.get(words[-1], words[-1])
+    return ' '.join(words)
+
+
+def street_codes(names, vocabulary):
+    """Returns normalized street codes for a column, growing `vocabulary` ({name: code}).
+
+    Only the distinct raw names are normalized; -1 marks a missing name.
+    """
+    def code(raw):
+        name = normalize_street(raw)
+        return vocabulary.setdefault(name, len(vocabulary)) if name else -1
+    return map_categories(names, code, -1, 'int64')
+
+
+def _severity_columns(data):
+    injured = data['NUMBER OF PERSONS INJURED'].to_numpy(dtype='int64', na_value=0)
+    killed = data['NUMBER OF PERSONS KILLED'].to_numpy(dtype='int64', na_value=0)
+    return injured, killed
+
+
+def street_pair_keys(data):
+    """Returns an order-independent key per crash for its (on street, cross street) pair.
+
+    Also returns the list of normalized street names indexed by code. Crashes without both
+    street names get key -1.
+    """
+    vocabulary = {}
+    on = street_codes(data['ON STREET NAME'], vocabulary)
+    cross = street_codes(data['CROSS STREET NAME'], vocabulary)
+    size = max(len(vocabulary), 1)
+    low, high = np.minimum(on, cross), np.maximum(on, cross)
+    keys = np.where((low >= 0) & (low != high), low * size + high, -1)
+    names = np.array(sorted(vocabulary, key=vocabulary.get) or [''], dtype=object)
+    return keys, names, size
+
+
+def top_street_pairs(data, n=10, rank_by='crashes'):
+    """Ranks normalized ON STREET NAME / CROSS STREET NAME pairs by crashes or severity score."""
+    keys, names, size = street_pair_keys(data)
+    injured, killed = _severity_columns(data)
+    named = keys >= 0
+    pairs, inverse = np.unique(keys[named], return_inverse=True)
+    table = pd.DataFrame({
+        'ON STREET NAME': names[pairs // size],
+        'CROSS STREET NAME': names[pairs % size],
+        'crashes': np.bincount(inverse, minlength=len(pairs)),
+        'injured': np.bincount(inverse, weights=injured[named], minlength=len(pairs)).astype('int64'),
+        'killed': np.bincount(inverse, weights=killed[named], minlength=len(pairs)).astype('int64'),
+    })
+    table['severity'] = severity_score(table['crashes'], table['injured'], table['killed'])
+    return _rank(table, rank_by, n)
+
+
+def _rank(table, rank_by, n):
+    if rank_by not in ('crashes', 'severity'):
+        raise ValueError("rank_by must be 'crashes' or 'severity', not %r" % (rank_by,))
+    other = 'severity' if rank_by == 'crashes' else 'crashes'
+    table = table.sort_values([rank_by, other], ascending=False, kind='stable')
+    return table.head(n).reset_index(drop=True)
+
+
+class CrashIndex:
+    """KD-tree over the projected coordinates of every crash with a valid location."""
+
+    def __init__(self, data):
+        latitude = data['LATITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+        longitude = data['LONGITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+        self.valid = valid_coordinates(latitude, longitude)
+        self.rows = np.flatnonzero(self.valid)
+        self.points = np.column_stack(project(latitude[self.valid], longitude[self.valid]))
+        self.tree = cKDTree(self.points)
+        self.data = data
+        injured, killed = _severity_columns(data)
+        self.injured = injured[self.valid]
+        self.killed = killed[self.valid]
+        self._pair_keys = None
+
+    def within(self, latitude, longitude, radius=50.0):
+        """Returns the positions (in the original frame) of crashes within `radius` meters."""
+        x, y = project(latitude, longitude)
+        return self.rows[np.sort(np.asarray(self.tree.query_ball_point([x, y], radius), dtype=np.intp))]
+
+    def crashes_within(self, latitude, longitude, radius=50.0):
+        """Returns the crashes within `radius` meters of a point as a DataFrame."""
+        return self.data.iloc[self.within(latitude, longitude, radius)]
+
+    def hotspots(self, radius=50.0, n=10, rank_by='crashes', candidates=50):
+        """Ranks locations by the crashes within `radius` meters of them.
+
+        Crashes are first binned into cells of `radius` meters; the centroids of the busiest
+        `candidates * n` cells are then scored with exact radius queries on the tree. A
+        location is skipped when it lies within `radius` of one already ranked higher.
+        """
+        if not len(self.points):
+            return pd.DataFrame(columns=['LATITUDE', 'LONGITUDE', 'intersection', 'crashes', 'injured', 'killed', 'severity'])
+        cells = bin_crashes(self.data, cell_size=radius)
+        if rank_by == 'severity':
+            cells = cells.assign(severity=severity_score(cells['crashes'], cells['injured'], cells['killed']))
+            cells = cells.sort_values('severity', ascending=False, kind='stable')
+        cells = cells.head(candidates * n)
+
+        # Moves each candidate to the centroid of the crashes around its cell center
+        centers = np.column_stack(project(cells['LATITUDE'].to_numpy(), cells['LONGITUDE'].to_numpy()))
+        neighbours = self.tree.query_ball_point(centers, radius)
+        centroids = np.array([
+            self.points[found].mean(axis=0) if found else center
+            for center, found in zip(centers, neighbours)
+        ])
+        members = self.tree.query_ball_point(centroids, radius)
+
+        table = pd.DataFrame({
+            'x': centroids[:, 0],
+            'y': centroids[:, 1],
+            'crashes': [len(found) for found in members],
+            'injured': [int(self.injured[found].sum()) for found in members],
+            'killed': [int(self.killed[found].sum()) for found in members],
+        })
+        table['severity'] = severity_score(table['crashes'], table['injured'], table['killed'])
+        table['members'] = members
+        table = _rank(table, rank_by, len(table))
+
+        chosen = []
+        for row in table.itertuples():
+            if len(chosen) == n:
+                break
+            if all(np.hypot(row.x - table.at[i, 'x'], row.y - table.at[i, 'y']) > radius for i in chosen):
+                chosen.append(row.Index)
+        table = table.loc[chosen].reset_index(drop=True)
+
+        table['LATITUDE'], table['LONGITUDE'] = unproject(table['x'].to_numpy(), table['y'].to_numpy())
+        table['intersection'] = [self._label(found) for found in table['members']]
+        columns = ['LATITUDE', 'LONGITUDE', 'intersection', 'crashes', 'injured', 'killed', 'severity']
+        return table[columns]
+
+    def _label(self, found):
+        # Names a hotspot after the most common street pair among its crashes
+        if self._pair_keys is None:
+            keys, names, size = street_pair_keys(self.data)
+            self._pair_keys = (keys[self.valid], names, size)
+        keys, names, size = self._pair_keys
+        keys = keys[found]
+        keys = keys[keys >= 0]
+        if not len(keys):
+            return None
+        values, counts = np.unique(keys, return_counts=True)
+        key = values[counts.argmax()]
+        return '%s & %s' % (names[key // size], names[key % size])
+
+
+def dangerous_intersections(data, n=10, radius=50.0, rank_by='crashes'):
+    """Returns the top `n` spatial hotspots and the top `n` named street pairs."""
+    return CrashIndex(data).hotspots(radius=radius, n=n, rank_by=rank_by), top_street_pairs(data, n=n, rank_by=rank_by)
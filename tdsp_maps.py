@@ -0,0 +1,221 @@
+"""Vectorized construction of the crash heatmap and severity map.
+
+Points are taken straight from the NumPy columns instead of iterating over rows, and each
+severity class is written as a single GeoJSON layer rather than one folium object per crash.
+"""
+
+import folium
+import numpy as np
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.features import RegularPolygonMarker
+from folium.map import Layer
+from folium.plugins import HeatMap
+from jinja2 import Template
+
+from tdsp_profile import profiled
+from tdsp_spatial import ZOOM_LEVELS, bin_levels, cell_weights, valid_coordinates
+
+
+NYC_CENTER = [40.730610, -73.935242]
+
+# Decimal places kept for coordinates written to the HTML (about 10 cm)
+COORDINATE_PRECISION = 6
+
+# Colour and shape of each severity class, as in the original severity map:
+# red triangles for fatalities, yellow circles for injuries, green squares otherwise
+SEVERITY_STYLES = {
+    'killed': {'color': 'Red', 'number_of_sides': 3},
+    'injured': {'color': 'Yellow', 'number_of_sides': None},
+    'none': {'color': 'Green', 'number_of_sides': 4},
+}
+
+
+def geocoded(data):
+    """Drops rows with missing latitude and longitude values."""
+    return data.dropna(subset=['LATITUDE', 'LONGITUDE'])
+
+
+def coordinates(data):
+    """Returns the latitude and longitude columns as float64 arrays."""
+    latitude = data['LATITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+    longitude = data['LONGITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+    return latitude, longitude
+
+
+def heat_points(data, weights=None):
+    """Returns an (n, 2) array of [lat, lon] points, or (n, 3) with a weight column."""
+    latitude, longitude = coordinates(data)
+    columns = [latitude, longitude]
+    if weights is not None:
+        columns.append(np.asarray(weights, dtype='float64'))
+    return np.column_stack(columns)
+
+
+def severity_classes(data):
+    """Returns boolean masks for the 'killed', 'injured' and 'none' severity classes.
+
+    A crash with any fatality is 'killed' even if it also had injuries, as in the original loop.
+    """
+    killed = data['NUMBER OF PERSONS KILLED'].to_numpy(dtype='int64', na_value=0) > 0
+    injured = data['NUMBER OF PERSONS INJURED'].to_numpy(dtype='int64', na_value=0) > 0
+    return {
+        'killed': killed,
+        'injured': injured & ~killed,
+        'none': ~(injured | killed),
+    }
+
+
+def multipoint(latitude, longitude):
+    """Returns a GeoJSON FeatureCollection holding all points as a single MultiPoint feature."""
+    points = np.column_stack([longitude, latitude]).round(COORDINATE_PRECISION)
+    return {
+        'type': 'FeatureCollection',
+        'features': [{
+            'type': 'Feature',
+            'properties': {},
+            'geometry': {'type': 'MultiPoint', 'coordinates': points.tolist()},
+        }],
+    }
+
+
+class FastHeatMap(HeatMap):
+    """HeatMap that takes its points as a NumPy array.
+
+    folium's HeatMap validates every point in a Python loop; here the NaN check and the
+    conversion to nested lists are done on the whole array at once.
+    """
+
+    def __init__(self, points, **kwargs):
+        super().__init__([], **kwargs)
+        points = np.asarray(points, dtype='float64')
+        if np.isnan(points).any():
+            raise ValueError('data may not contain NaNs.')
+        self.data = points.round(COORDINATE_PRECISION).tolist()
+
+
+class PointLayer(JSCSSMixin, Layer):
+    """Draws every point of a GeoJSON layer with the same circle or regular polygon marker."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJSON({{ this.data|tojson }}, {
+                pointToLayer: function (feature, latlng) {
+                    {%- if this.options.numberOfSides %}
+                    return new L.RegularPolygonMarker(latlng, {{ this.options|tojson }});
+                    {%- else %}
+                    return L.circleMarker(latlng, {{ this.options|tojson }});
+                    {%- endif %}
+                }
+            });
+        {% endmacro %}
+    """)
+
+    default_js = RegularPolygonMarker.default_js
+
+    def __init__(self, data, color, number_of_sides=None, radius=5, name=None, **kwargs):
+        super().__init__(name=name, **kwargs)
+        self._name = 'PointLayer'
+        self.data = data
+        self.options = {
+            'radius': radius,
+            'color': color,
+            'fill': True,
+            'fillColor': color,
+            'gradient': False,
+        }
+        if number_of_sides:
+            self.options['numberOfSides'] = number_of_sides
+
+
+def severity_layers(data, radius=5):
+    """Returns one PointLayer per severity class containing all of its crashes."""
+    latitude, longitude = coordinates(data)
+    layers = []
+    for severity, mask in severity_classes(data).items():
+        style = SEVERITY_STYLES[severity]
+        layers.append(PointLayer(
+            multipoint(latitude[mask], longitude[mask]),
+            color=style['color'],
+            number_of_sides=style['number_of_sides'],
+            radius=radius,
+            name=severity,
+        ))
+    return layers
+
+
+class ZoomSwitch(MacroElement):
+    """Shows each layer only while the map zoom is within its [min zoom, max zoom] range."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            (function () {
+                var map = {{ this._parent.get_name() }};
+                var levels = [
+                    {%- for layer, low, high in this.levels %}
+                    [{{ layer.get_name() }}, {{ low }}, {{ high }}],
+                    {%- endfor %}
+                ];
+                function update() {
+                    var zoom = map.getZoom();
+                    levels.forEach(function (level) {
+                        var visible = zoom >= level[1] && zoom <= level[2];
+                        if (visible && !map.hasLayer(level[0])) { map.addLayer(level[0]); }
+                        if (!visible && map.hasLayer(level[0])) { map.removeLayer(level[0]); }
+                    });
+                }
+                map.on('zoomend', update);
+                update();
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, levels):
+        super().__init__()
+        self._name = 'ZoomSwitch'
+        self.levels = levels
+
+
+def heatmap(data, radius=8, max_zoom=13, zoom_start=10, levels=ZOOM_LEVELS, kind='grid', weight='crashes'):
+    """Builds the crash heatmap for `data`.
+
+    By default the crashes are pre-aggregated into grid (or 'hex') cells for each range of
+    zoom levels, so the page holds one weighted point per cell instead of one per crash.
+    `weight` is 'crashes', 'injured', 'killed' or 'severity'. With levels=None every valid
+    crash is written as its own point.
+    """
+    if levels is None:
+        m = folium.Map(location=NYC_CENTER, zoom_start=zoom_start)
+        points = heat_points(data)
+        FastHeatMap(points[valid_coordinates(points[:, 0], points[:, 1])], radius=radius, max_zoom=max_zoom).add_to(m)
+        return m
+
+    return cells_heatmap(bin_levels(data, levels, kind), radius, max_zoom, zoom_start, weight)
+
+
+@profiled()
+def cells_heatmap(levels, radius=8, max_zoom=13, zoom_start=10, weight='crashes'):
+    """Builds the heatmap from binned cells, as returned by tdsp_spatial.bin_levels."""
+    m = folium.Map(location=NYC_CENTER, zoom_start=zoom_start)
+    switch = []
+    for (low, high), cells in levels.items():
+        weights = cell_weights(cells, weight)
+        if len(weights) and weights.max() > 0:
+            weights = weights / weights.max()
+        layer = FastHeatMap(heat_points(cells, weights), radius=radius, max_zoom=max_zoom)
+        layer.add_to(m)
+        switch.append((layer, low, high))
+    ZoomSwitch(switch).add_to(m)
+    return m
+
+
+@profiled()
+def severity_map(data, zoom_start=10, radius=5):
+    """Builds the severity map with one layer per severity class.
+
+    The markers are drawn on a canvas, which keeps the page responsive with many points.
+    """
+    m = folium.Map(location=NYC_CENTER, zoom_start=zoom_start, prefer_canvas=True)
+    for layer in severity_layers(geocoded(data), radius=radius):
+        layer.add_to(m)
+    return m
@@ -0,0 +1,171 @@
+"""Runs the independent analysis sections in parallel on a process pool.
+
+The loaded columns are written once to an uncompressed Arrow IPC file. Every worker
+memory-maps that file and reads only the columns its section declares, so the data is shared
+through the page cache instead of being pickled to each process. Each section renders its
+chart, table or map in the worker as soon as it is computed.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import pyarrow as pa
+
+from tdsp_data import write_json
+from tdsp_profile import PROFILER
+from tdsp_sections import SECTIONS
+from tdsp_time import add_temporal_features
+
+
+def share_columns(data, path, columns=None):
+    """Writes `columns` of `data` (all by default) to an Arrow IPC file for the workers."""
+    columns = list(data.columns) if columns is None else [column for column in data.columns if column in set(columns)]
+    table = pa.Table.from_pandas(data[columns], preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+def read_shared(path, columns=None):
+    """Memory-maps the shared Arrow file and returns the requested columns as a DataFrame.
+
+    Numeric columns without nulls are handed to pandas without copying.
+    """
+    # The map is left open: the returned columns may point straight into it
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True)
+
+
+MANIFEST = 'manifest.json'
+
+# One figure per process, cleared and reused by every chart the process renders
+_figure = None
+
+
+def reusable_figure():
+    global _figure
+    if _figure is None or not plt.fignum_exists(_figure.number):
+        _figure = plt.figure()
+    return _figure
+
+
+def aggregate_digest(aggregate):
+    """Returns a SHA-256 over the values, labels and types of a section's aggregate."""
+    digest = hashlib.sha256()
+    if isinstance(aggregate, dict):
+        for key in sorted(aggregate, key=repr):
+            digest.update(repr(key).encode())
+            digest.update(aggregate_digest(aggregate[key]).encode())
+    elif isinstance(aggregate, (pd.Series, pd.DataFrame)):
+        frame = aggregate.to_frame() if isinstance(aggregate, pd.Series) else aggregate
+        digest.update(repr(list(frame.columns)).encode())
+        digest.update(repr(list(frame.dtypes.astype(str))).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    else:
+        digest.update(repr(aggregate).encode())
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def output_name(section, image_format='png'):
+    """Returns the file a section writes, with charts in `image_format` ('png' or 'svg')."""
+    stem, extension = os.path.splitext(section.output)
+    return stem + '.' + image_format if extension == '.png' else section.output
+
+
+def run_section(section, shared_path, output_dir, image_format='png', previous_digest=None):
+    """Computes and renders one section; returns a dict describing what was done.
+
+    Rendering is skipped when the aggregate's digest matches `previous_digest` and the
+    output file from that run is still there.
+    """
+    start = time.perf_counter()
+    plt.switch_backend('Agg')
+    with PROFILER.stage(section.name):
+        with PROFILER.stage('read_shared') as current:
+            data = read_shared(shared_path, section.inputs)
+            current.rows = len(data)
+        with PROFILER.stage('compute', rows=len(data)):
+            aggregate = section.compute(data)
+        digest = aggregate_digest(aggregate)
+        path = os.path.join(output_dir, output_name(section, image_format))
+        rendered = digest != previous_digest or not os.path.exists(path)
+        if rendered:
+            with PROFILER.stage('render') as current:
+                section.render(aggregate, path, fig=reusable_figure())
+                current.output(path)
+    return {'name': section.name, 'output': path, 'digest': digest, 'rendered': rendered,
+            'seconds': time.perf_counter() - start}
+
+
+def _run_section_in_worker(profile, *args):
+    # A forked worker inherits the parent's records; it starts afresh and sends its own back
+    PROFILER.reset(enabled=profile)
+    result = run_section(*args)
+    result['stages'] = PROFILER.drain()
+    return result
+
+
+def prepare(data):
+    """Adds the temporal columns the sections read, if they are not there yet."""
+    if 'Hour of Day' not in data or 'Month' not in data:
+        add_temporal_features(data)
+    return data
+
+
+def run(data, output_dir='output', sections=SECTIONS, workers=None, image_format='png', force=False, on_finish=None):
+    """Runs `sections` over `data` on `workers` processes (all cores by default).
+
+    With workers=1 the sections run one after another in this process. Charts whose
+    aggregate is unchanged since the last run into `output_dir` are not redrawn unless
+    `force` is set. `on_finish(result)` is called in this process as each section finishes.
+    Returns {name: result}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    prepare(data)
+    manifest = {} if force else load_manifest(output_dir)
+    columns = set()
+    for section in sections:
+        columns.update(data.columns if section.inputs is None else section.inputs)
+
+    results = {}
+    # Stages recorded in worker processes are nested under the stage that called run()
+    prefix = PROFILER.path
+
+    def finished(result):
+        PROFILER.extend(result.pop('stages', []), prefix)
+        results[result['name']] = result
+        manifest[result['name']] = {'digest': result['digest'], 'output': os.path.basename(result['output'])}
+        write_json(os.path.join(output_dir, MANIFEST), manifest)
+        if on_finish is not None:
+            on_finish(result)
+
+    with tempfile.TemporaryDirectory(prefix='tdsp-') as tmp:
+        shared_path = share_columns(data, os.path.join(tmp, 'crashes.arrow'), columns)
+        jobs = [(section, shared_path, output_dir, image_format, manifest.get(section.name, {}).get('digest'))
+                for section in sections]
+        if workers == 1:
+            for job in jobs:
+                finished(run_section(*job))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_run_section_in_worker, PROFILER.enabled, *job) for job in jobs]
+                for future in as_completed(futures):
+                    finished(future.result())
+    return results
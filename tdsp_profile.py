@@ -0,0 +1,308 @@
+"""Per-stage instrumentation: wall and CPU time, peak memory, rows and output size.
+
+Stages are marked with the `stage` context manager or the `profiled` decorator. While
+profiling is off (the default) both reduce to a single attribute check, so they can stay
+in the code. Turned on, every stage records
+
+    name, path (the enclosing stages joined by ';'), wall_seconds, cpu_seconds,
+    peak_rss_mb, rows and output_bytes
+
+and the run can be written as a JSON report, as folded stacks for flamegraph.pl or
+speedscope (one line per stage path with its own time in microseconds), and optionally as a
+cProfile dump of every Python function for snakeviz and similar viewers.
+
+    TDSP_PROFILE=timings.json python explorer_tdsp.py
+    python tdsp_report.py crashes.csv --profile timings.json --flamegraph timings.folded
+"""
+
+import atexit
+import cProfile
+import functools
+import inspect
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss():
+    """Returns the resident memory of this process in bytes, or None where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+class PeakMemory:
+    """Samples the resident memory of this process on a thread while the block runs.
+
+        with PeakMemory() as memory:
+            ...
+        memory.peak, memory.start
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def __enter__(self):
+        self.start = self.peak = current_rss()
+        if self.start is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak = max(self.peak, current_rss())
+
+
+def _rows(value):
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+class _NullStage:
+    """What `stage` returns while profiling is off."""
+
+    rows = None
+    output_bytes = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def output(self, path):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, profiler, name, rows):
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows
+        self.output_bytes = None
+
+    def output(self, path):
+        """Adds the size of a file the stage wrote to its output_bytes."""
+        if os.path.exists(path):
+            self.output_bytes = (self.output_bytes or 0) + os.path.getsize(path)
+
+    def __enter__(self):
+        self.profiler._stack.append(self.name)
+        self.path = ';'.join(self.profiler._stack)
+        self._memory = PeakMemory().__enter__()
+        self._wall, self._cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall, cpu = time.perf_counter() - self._wall, time.process_time() - self._cpu
+        self._memory.__exit__(*exc_info)
+        self.profiler._stack.pop()
+        self.profiler.records.append({
+            'name': self.name,
+            'path': self.path,
+            'wall_seconds': wall,
+            'cpu_seconds': cpu,
+            'peak_rss_mb': self._memory.peak / 2 ** 20 if self._memory.peak is not None else None,
+            'rows': self.rows,
+            'output_bytes': self.output_bytes,
+            'pid': os.getpid(),
+            'failed': exc_info[0] is not None,
+        })
+        return False
+
+
+class Profiler:
+    """Collects stage records for one process; PROFILER is the one the modules use."""
+
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._stack = []
+        self._python = None
+
+    def enable(self, python_profile=False):
+        """Starts recording stages, and every Python call too with `python_profile`."""
+        self.enabled = True
+        if python_profile and self._python is None:
+            self._python = cProfile.Profile()
+            self._python.enable()
+        return self
+
+    def disable(self):
+        self.enabled = False
+        if self._python is not None:
+            self._python.disable()
+
+    def reset(self, enabled=False):
+        """Forgets every record and the Python profile, and sets whether stages are recorded."""
+        self.disable()
+        self._python = None
+        self.records = []
+        self._stack = []
+        self.enabled = enabled
+
+    def stage(self, name, rows=None):
+        """Returns a context manager that records the enclosed block as stage `name`.
+
+        Set `.rows` on it or call `.output(path)` inside the block to record how many rows
+        were processed and how large the written output is.
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, rows)
+
+    @property
+    def path(self):
+        return ';'.join(self._stack)
+
+    def drain(self):
+        """Returns the records so far and forgets them, e.g. to send them from a worker."""
+        records, self.records = self.records, []
+        return records
+
+    def extend(self, records, prefix=None):
+        """Adds records from another process, nested under `prefix` (the current stage by default)."""
+        prefix = self.path if prefix is None else prefix
+        for record in records:
+            path = '%s;%s' % (prefix, record['path']) if prefix else record['path']
+            self.records.append(dict(record, path=path))
+
+    def report(self):
+        """Returns {'stages': every record, 'totals': the records summed per stage name}."""
+        records = pd.DataFrame(self.records, columns=['name', 'wall_seconds', 'cpu_seconds', 'rows', 'output_bytes'])
+        grouped = records.groupby('name', sort=False)
+        totals = grouped[['wall_seconds', 'cpu_seconds']].sum()
+        totals.insert(0, 'calls', grouped.size())
+        # Left empty, rather than 0, for stages that never record rows or output
+        for column in ['rows', 'output_bytes']:
+            totals[column] = grouped[column].sum(min_count=1).astype('Int64')
+        totals = totals.sort_values('wall_seconds', ascending=False).reset_index().astype(object)
+        return {'stages': self.records, 'totals': totals.where(totals.notna(), None).to_dict(orient='records')}
+
+    def folded(self):
+        """Returns folded stacks, 'outer;inner <microseconds>', of each stage's own wall time.
+
+        Stages that ran in parallel worker processes can add up to more than the stage around
+        them, whose own time is then shown as 0.
+        """
+        own = {}
+        for record in self.records:
+            own[record['path']] = own.get(record['path'], 0.0) + record['wall_seconds']
+        for record in self.records:
+            parent = record['path'].rpartition(';')[0]
+            if parent in own:
+                own[parent] -= record['wall_seconds']
+        return ''.join('%s %d\n' % (path, max(seconds, 0.0) * 1e6) for path, seconds in own.items())
+
+    def write_report(self, path):
+        from tdsp_data import write_json
+
+        write_json(path, self.report())
+
+    def write_folded(self, path):
+        with open(path, 'w') as handle:
+            handle.write(self.folded())
+
+    def write_python_profile(self, path):
+        """Writes the cProfile data gathered since enable(python_profile=True) in pstats format."""
+        if self._python is not None:
+            self._python.dump_stats(path)
+
+
+PROFILER = Profiler()
+
+
+def stage(name, rows=None):
+    """PROFILER.stage: records the enclosed block when profiling is on."""
+    return PROFILER.stage(name, rows)
+
+
+_DONE = object()
+
+
+def _profiled_iteration(label, items):
+    """Yields from the generator `items`, recording the work of each step as a call of `label`."""
+    try:
+        while True:
+            with PROFILER.stage(label) as current:
+                item = next(items, _DONE)
+                current.rows = _rows(item)
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        items.close()
+
+
+def profiled(name=None):
+    """Decorates a function to run as a stage, with rows taken from its DataFrame in or out.
+
+    When the function returns a generator, such as a chunked read, the work done to produce
+    each item is recorded as a further call of the stage, nested in whichever stage draws it.
+    """
+    def decorate(function):
+        label = name or function.__name__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not PROFILER.enabled:
+                return function(*args, **kwargs)
+            with PROFILER.stage(label) as current:
+                result = function(*args, **kwargs)
+                current.rows = _rows(result)
+                if current.rows is None and args and not inspect.isgenerator(result):
+                    current.rows = _rows(args[0])
+            if inspect.isgenerator(result):
+                return _profiled_iteration(label, result)
+            return result
+        return wrapper
+    return decorate
+
+
+def enable(report=None, flamegraph=None, python_profile=None):
+    """Turns profiling on and writes the requested files when the process exits."""
+    PROFILER.enable(python_profile=python_profile is not None)
+
+    def write():
+        PROFILER.disable()
+        if report:
+            PROFILER.write_report(report)
+        if flamegraph:
+            PROFILER.write_folded(flamegraph)
+        if python_profile:
+            PROFILER.write_python_profile(python_profile)
+
+    atexit.register(write)
+    return PROFILER
+
+
+def enable_from_env():
+    """Turns profiling on if TDSP_PROFILE names a report file.
+
+    TDSP_PROFILE_FLAMEGRAPH and TDSP_PROFILE_PYTHON optionally name the folded-stacks and
+    cProfile files.
+    """
+    report = os.environ.get('TDSP_PROFILE')
+    if report:
+        enable(report, os.environ.get('TDSP_PROFILE_FLAMEGRAPH'), os.environ.get('TDSP_PROFILE_PYTHON'))
+    return PROFILER
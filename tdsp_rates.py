@@ -0,0 +1,188 @@
+"""Crash, injury and fatality rates per unit of exposure, with confidence intervals.
+
+Raw counts favour large places and common vehicles: Brooklyn leads the borough chart partly
+because more people live there. Here the counts are divided by an exposure, such as
+residents per borough, vehicles registered per type or traffic volume per ZIP code, read
+from a local table with one row per key. The counts are grouped over one or more columns
+in a single groupby, and each group looks up its exposure by the value of the exposure's
+key column through an index, so any number of slices is handled at once:
+
+    rates = risk_rates(data, 'BOROUGH', BOROUGH_POPULATION)
+    rates = risk_rates(data, ['BOROUGH', 'VEHICLE TYPE CODE 1'], BOROUGH_POPULATION)
+    rates = risk_rates(data, 'ZIP CODE', load_exposure('zip_volumes.csv', 'ZIP CODE', 'vehicles'), per=1e6)
+
+Each measure gets its rate per `per` units of exposure and an exact Poisson confidence
+interval. Injuries and deaths come in clusters (one crash can hurt several people), so their
+intervals are somewhat too narrow.
+
+cached_rates keeps the grouped counts of a CSV export in a Parquet file beside the crash
+cache, keyed by the export's hash like tdsp_data.cache_path and, for vehicle types and
+factors, by the category mapping they were normalized with, so the rates can be redrawn
+against another exposure table without reading the crashes again.
+"""
+
+import os
+import re
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from scipy import stats
+
+from tdsp_categories import (NORMALIZED_COLUMNS, fold, load_normalizers, mapping_digest, mapping_path,
+                             normalize_categories)
+from tdsp_data import DATA_PATH, cache_path, load_crashes, map_categories, write_parquet
+
+
+# Crash measures and the column each sums; 'crashes' counts rows
+MEASURES = {
+    'crashes': None,
+    'injured': 'NUMBER OF PERSONS INJURED',
+    'killed': 'NUMBER OF PERSONS KILLED',
+}
+
+# 2020 Census population of each borough
+BOROUGH_POPULATION = pd.Series({
+    'bronx': 1472654,
+    'brooklyn': 2736074,
+    'manhattan': 1694251,
+    'queens': 2405464,
+    'staten island': 495747,
+}, name='population').rename_axis('BOROUGH')
+
+# Bumped whenever the layout of the cached counts changes
+RATES_VERSION = 1
+
+NORMALIZED = {column for columns in NORMALIZED_COLUMNS.values() for column in columns}
+
+_ZIP_CODE = re.compile(r'^\s*(\d{1,5})(\.0*)?\s*$')
+
+
+def normalize_key(value, column):
+    """Returns the join key of one value of `column`: a five-digit ZIP code, else fold(value)."""
+    if pd.isna(value):
+        return None
+    if column == 'ZIP CODE':
+        match = _ZIP_CODE.match(str(value))
+        return match.group(1).zfill(5) if match else None
+    return fold(value)
+
+
+def join_keys(values, column):
+    """Returns the join keys of a column, normalizing each distinct value once."""
+    keys = map_categories(values, lambda value: normalize_key(value, column), None, object)
+    return pd.Series(keys, index=values.index, name=column)
+
+
+def load_exposure(path, key, value):
+    """Reads an exposure table from CSV: a `key` column (e.g. 'ZIP CODE') and a `value` column.
+
+    Rows sharing a key after normalization are summed. Returns a Series indexed by join key.
+    """
+    table = pd.read_csv(path, usecols=[key, value], dtype={key: 'string'})
+    keys = join_keys(table[key], key)
+    exposure = table[value].groupby(keys.to_numpy(), dropna=True).sum()
+    return exposure.rename(value).rename_axis(key)
+
+
+def crash_counts(data, by):
+    """Sums MEASURES over the groups of the `by` columns; rows with a missing key are left out."""
+    by = [by] if isinstance(by, str) else list(by)
+    frame = pd.DataFrame({column: join_keys(data[column], column) for column in by})
+    for measure, column in MEASURES.items():
+        frame[measure] = 1 if column is None else data[column].fillna(0).astype('int64')
+    counts = frame.groupby(by, dropna=True, sort=True)[list(MEASURES)].sum()
+    return counts.reset_index()
+
+
+def poisson_interval(counts, confidence=0.95):
+    """Returns the exact (Garwood) lower and upper bounds of the mean of Poisson counts."""
+    counts = np.asarray(counts, dtype='float64')
+    alpha = 1 - confidence
+    with np.errstate(invalid='ignore'):
+        lower = np.where(counts > 0, stats.chi2.ppf(alpha / 2, 2 * counts) / 2, 0.0)
+    upper = stats.chi2.ppf(1 - alpha / 2, 2 * counts + 2) / 2
+    return lower, upper
+
+
+def add_rates(counts, exposure, per=100000, confidence=0.95):
+    """Joins `exposure` onto grouped counts and adds a rate and interval for each measure.
+
+    The exposure Series is matched on the count column named like its index (e.g.
+    'BOROUGH'). Groups without exposure get missing rates.
+    """
+    key = exposure.index.name
+    if key not in counts:
+        raise ValueError('the counts are not grouped by %r, the key of the exposure' % (key,))
+    positions = exposure.index.get_indexer(counts[key])
+    values = np.where(positions >= 0, exposure.to_numpy(dtype='float64')[positions], np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.where(values > 0, per / values, np.nan)
+
+    rates = counts.copy()
+    rates['exposure'] = values
+    for measure in MEASURES:
+        lower, upper = poisson_interval(rates[measure], confidence)
+        rates[measure + '_rate'] = rates[measure] * scale
+        rates[measure + '_low'] = lower * scale
+        rates[measure + '_high'] = upper * scale
+    return rates
+
+
+def risk_rates(data, by, exposure, per=100000, confidence=0.95):
+    """Returns the counts of `data` grouped by `by` with their rates per `per` units of exposure."""
+    return add_rates(crash_counts(data, by), exposure, per, confidence)
+
+
+def rates_cache_path(path, by, cache_dir=None, normalizers=None):
+    """Returns the Parquet file holding the counts of the export at `path` grouped by `by`.
+
+    Counts grouped by a vehicle type or factor column depend on the category mapping too, so
+    their file name also holds the mapping_digest of `normalizers` (by default the mapping
+    kept beside the export).
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    directory, crashes = os.path.split(cache_path(path, cache_dir))
+    slug = '+'.join(re.sub(r'\W+', '_', column.lower()) for column in by)
+    if NORMALIZED.intersection(by):
+        slug += '-m' + mapping_digest(normalizers or load_normalizers(mapping_path(path)))
+    return os.path.join(directory, 'rates-%s-%s-r%d.parquet' % (os.path.splitext(crashes)[0], slug, RATES_VERSION))
+
+
+def cached_counts(path=DATA_PATH, by='BOROUGH', cache_dir=None):
+    """Returns crash_counts for the export at `path`, from the cache when it is up to date.
+
+    Only the `by` columns and the measures are read. Vehicle types and factors are
+    normalized with the category mapping kept beside the export, as in the explorer.
+    """
+    by = [by] if isinstance(by, str) else list(by)
+    normalizers = load_normalizers(mapping_path(path))
+    cached = rates_cache_path(path, by, cache_dir, normalizers)
+    if os.path.exists(cached):
+        return pd.read_parquet(cached)
+    columns = by + [column for column in MEASURES.values() if column is not None]
+    data = load_crashes(path, columns=columns, cache_dir=cache_dir)
+    data = normalize_categories(data, normalizers=normalizers)
+    counts = crash_counts(data, by)
+    write_parquet(counts, cached)
+    return counts
+
+
+def cached_rates(path=DATA_PATH, by='BOROUGH', exposure=BOROUGH_POPULATION, per=100000, confidence=0.95,
+                 cache_dir=None):
+    """risk_rates for the export at `path`, with the grouped counts cached (see cached_counts)."""
+    return add_rates(cached_counts(path, by, cache_dir), exposure, per, confidence)
+
+
+def plot_rates(rates, key, measure='crashes', per=100000, ax=None, palette='viridis'):
+    """Draws the rate of `measure` for each value of `key` as bars with their confidence intervals."""
+    ax = ax or plt.gca()
+    rates = rates.dropna(subset=[measure + '_rate'])
+    labels = rates[key].astype(str).str.title()
+    errors = [rates[measure + '_rate'] - rates[measure + '_low'], rates[measure + '_high'] - rates[measure + '_rate']]
+    colors = sns.color_palette(palette, len(rates))
+    ax.bar(labels, rates[measure + '_rate'], yerr=errors, color=colors, capsize=4)
+    ax.set_xlabel(key.title())
+    ax.set_ylabel('%s per %s' % (measure.title(), format(int(per), ',')))
+    return ax
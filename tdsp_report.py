@@ -0,0 +1,70 @@
+"""Headless batch report: runs the full analysis on a local export and writes every output.
+
+    python tdsp_report.py Motor_Vehicle_Collisions_-_Crashes.csv --output-dir report
+
+Charts are drawn with the non-interactive Agg backend straight to PNG (or SVG), next to
+missing_values.csv, Heatmap.html, severity.html and severity_tiles.html. Charts whose aggregates have not
+changed since the last run into the same directory are not redrawn.
+"""
+
+import argparse
+import sys
+import time
+
+import matplotlib
+
+matplotlib.use('Agg')
+
+from tdsp_categories import mapping_path, normalize_categories  # noqa: E402
+from tdsp_data import load_crashes  # noqa: E402
+from tdsp_pipeline import run  # noqa: E402
+from tdsp_profile import enable, stage  # noqa: E402
+from tdsp_sections import SECTIONS  # noqa: E402
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Render the TDSP crash analysis without a display.')
+    parser.add_argument('path', help='local CSV export of the Motor Vehicle Collisions - Crashes dataset')
+    parser.add_argument('--output-dir', default='report', help='directory for charts, tables and maps (default: report)')
+    parser.add_argument('--format', dest='image_format', choices=['png', 'svg'], default='png',
+                        help='image format of the charts (default: png)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes; 1 runs everything in this process (default: all cores)')
+    parser.add_argument('--sections', nargs='+', choices=[section.name for section in SECTIONS],
+                        help='only run these sections')
+    parser.add_argument('--force', action='store_true', help='redraw every output even if its data is unchanged')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='read the CSV directly instead of through the Parquet cache')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='write the time, CPU, peak memory, rows and output size of every stage to this JSON file')
+    parser.add_argument('--flamegraph', metavar='PATH',
+                        help='write the stage timings as folded stacks for flamegraph.pl or speedscope')
+    parser.add_argument('--python-profile', metavar='PATH',
+                        help='also profile every Python call in this process and write it in pstats format')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sections = [section for section in SECTIONS if not args.sections or section.name in args.sections]
+    if args.profile or args.flamegraph or args.python_profile:
+        enable(args.profile, args.flamegraph, args.python_profile)
+
+    start = time.perf_counter()
+    data = load_crashes(args.path, use_cache=args.use_cache)
+    normalize_categories(data, mapping_path(args.path))
+    print('loaded %d crashes in %.1f s' % (len(data), time.perf_counter() - start))
+
+    def report(result):
+        status = 'wrote' if result['rendered'] else 'unchanged'
+        print('%-18s %-9s %-40s %6.1f s' % (result['name'], status, result['output'], result['seconds']))
+
+    with stage('sections'):
+        run(data, args.output_dir, sections, workers=args.workers, image_format=args.image_format,
+            force=args.force, on_finish=report)
+    print('done in %.1f s' % (time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
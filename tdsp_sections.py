@@ -0,0 +1,241 @@
+"""The analysis sections of explorer_tdsp.py as separate compute and render steps.
+
+Each section's compute step reduces the crashes to a small aggregate, reading only the
+columns listed in its Section entry, and its render step draws that aggregate to a file.
+Keeping the two apart lets the pipeline run sections in parallel and skip drawing when an
+aggregate has not changed.
+"""
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+
+from tdsp_data import FACTOR_COLUMNS, SCHEMA, VEHICLE_COLUMNS
+from tdsp_maps import cells_heatmap, severity_map
+from tdsp_rates import BOROUGH_POPULATION, MEASURES, plot_rates, risk_rates
+from tdsp_spatial import ZOOM_LEVELS, bin_levels
+from tdsp_tiles import cluster_tiles, save_tiled_map
+from tdsp_timeseries import TOTAL, daily_counts, stl_components
+
+
+class Section:
+    """A named analysis step: the columns it reads, how it computes and how it renders."""
+
+    def __init__(self, name, inputs, compute, render, output):
+        self.name = name
+        self.inputs = list(inputs) if inputs is not None else None
+        self.compute = compute
+        self.render = render
+        self.output = output
+
+    def __repr__(self):
+        return 'Section(%r)' % self.name
+
+
+CRASH_TYPE_COLUMNS = {
+    'Pedestrian Injuries': 'NUMBER OF PEDESTRIANS INJURED',
+    'Cyclist Injuries': 'NUMBER OF CYCLIST INJURED',
+    'Motorist Injuries': 'NUMBER OF MOTORIST INJURED',
+    'Pedestrian Deaths': 'NUMBER OF PEDESTRIANS KILLED',
+    'Cyclist Deaths': 'NUMBER OF CYCLIST KILLED',
+    'Motorist Deaths': 'NUMBER OF MOTORIST KILLED',
+}
+
+
+def bar_chart(fig, x, y, title, xlabel, ylabel, palette, rotation=45, ha='right', title_size=16, label_size=14):
+    """Draws a seaborn bar chart on `fig`, which is cleared first so it can be reused."""
+    fig.clf()
+    ax = fig.add_subplot()
+    if palette is None:
+        sns.barplot(x=x, y=y, ax=ax)
+    else:
+        sns.barplot(x=x, y=y, hue=x, palette=palette, legend=False, ax=ax)
+    ax.set_title(title, fontsize=title_size)
+    ax.set_xlabel(xlabel, fontsize=label_size)
+    ax.set_ylabel(ylabel, fontsize=label_size)
+    if rotation:
+        plt.setp(ax.get_xticklabels(), rotation=rotation, ha=ha)
+    fig.tight_layout()
+    return ax
+
+
+def new_figure(fig, figsize):
+    """Returns `fig` cleared and resized, or a new figure when `fig` is None."""
+    if fig is None:
+        return plt.figure(figsize=figsize)
+    fig.clf()
+    fig.set_size_inches(figsize)
+    return fig
+
+
+# Missing values
+
+def compute_missing_values(data):
+    missing_values = pd.isnull(data).sum()
+    missing_values_percentage = (missing_values / len(data)) * 100
+    missing_data = pd.DataFrame({'Missing Values': missing_values, 'Percentage (%)': missing_values_percentage})
+    return missing_data.sort_values(by='Percentage (%)', ascending=False)
+
+
+def render_table(table, path, fig=None):
+    table.to_csv(path)
+
+
+# Top contributing factors and vehicle types
+
+def compute_top_factors(data):
+    return data['CONTRIBUTING FACTOR VEHICLE 1'].value_counts().head(10)
+
+
+def render_top_factors(top_factors, path, fig=None):
+    fig = new_figure(fig, (12, 7))
+    bar_chart(fig, top_factors.index.astype(str), top_factors.values, 'Top 10 Contributing Factors to crashes',
+              'Contributing Factor', 'Number of crashes', 'magma')
+    fig.savefig(path)
+
+
+def compute_top_vehicle_types(data):
+    return data['VEHICLE TYPE CODE 1'].value_counts().head(10)
+
+
+def render_top_vehicle_types(top_vehicle_types, path, fig=None):
+    fig = new_figure(fig, (12, 7))
+    bar_chart(fig, top_vehicle_types.index.astype(str), top_vehicle_types.values, 'Top 10 Vehicle Types Involved in crashes',
+              'Vehicle Type', 'Number of crashes', 'cividis')
+    fig.savefig(path)
+
+
+# Types of crashes
+
+def compute_crash_types(data):
+    return pd.Series({label: int(data[column].sum()) for label, column in CRASH_TYPE_COLUMNS.items()}, name='Count')
+
+
+def render_crash_types(crash_types, path, fig=None):
+    fig = new_figure(fig, (12, 7))
+    ax = fig.add_subplot()
+    sns.barplot(x=crash_types.values, y=crash_types.index, hue=crash_types.index, palette='mako', legend=False, ax=ax)
+    ax.set_title('Types of crashes and Their Frequencies')
+    ax.set_xlabel('Count')
+    ax.set_ylabel('Type of crash')
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+# Time of day, month and daily series
+
+def compute_hourly(data):
+    counts = data.groupby('Hour of Day').size()
+    return counts / data['Hour of Day'].nunique()
+
+
+def render_hourly(average_crashes_per_hour, path, fig=None):
+    fig = new_figure(fig, (12, 6))
+    ax = bar_chart(fig, average_crashes_per_hour.index, average_crashes_per_hour.values,
+                   'Average Number of crashes per Hour of Day', 'Hour of Day', 'Average Number of crashes',
+                   None, rotation=0, title_size=None, label_size=None)
+    ax.set_xticks(range(0, 24))
+    fig.savefig(path)
+
+
+def compute_monthly(data):
+    return data.groupby('Month').size()
+
+
+def render_monthly(monthly_crashes, path, fig=None):
+    fig = new_figure(fig, (15, 7))
+    ax = fig.add_subplot()
+    monthly_crashes.plot(ax=ax)
+    ax.set_title('Number of Crashes per Month', fontsize=16)
+    ax.set_xlabel('Date', fontsize=14)
+    ax.set_ylabel('Number of Crashes', fontsize=14)
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def compute_decomposition(data, period=365):
+    return stl_components(daily_counts(data)[TOTAL], period)
+
+
+def render_decomposition(components, path, fig=None):
+    fig = new_figure(fig, (15, 18))
+    axes = fig.subplots(4, 1)
+    axes[0].plot(components['observed'], label='Daily crashes')
+    axes[0].set_title('Daily Motor Vehicle Collisions in NYC')
+    axes[0].set_xlabel('Date')
+    axes[0].set_ylabel('Number of Crashes')
+    axes[0].legend()
+    for ax, column, title in zip(axes[1:], ['trend', 'seasonal', 'resid'], ['Trend', 'Seasonal', 'Residuals']):
+        components[column].plot(ax=ax)
+        ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+# Boroughs
+
+def compute_boroughs(data):
+    return data['BOROUGH'].value_counts()
+
+
+def render_boroughs(borough_count, path, fig=None):
+    fig = new_figure(fig, (12, 7))
+    bar_chart(fig, borough_count.index.astype(str), borough_count.values, 'Distribution of Crashes by Borough',
+              'Borough', 'Number of Crashes', 'viridis', ha='center')
+    fig.savefig(path)
+
+
+def compute_borough_rates(data):
+    return risk_rates(data, 'BOROUGH', BOROUGH_POPULATION)
+
+
+def render_borough_rates(rates, path, fig=None):
+    fig = new_figure(fig, (15, 6))
+    for ax, measure in zip(fig.subplots(1, len(MEASURES)), MEASURES):
+        plot_rates(rates, 'BOROUGH', measure, ax=ax)
+    fig.suptitle('Crashes, Injuries and Deaths per 100,000 Residents by Borough (95% intervals)', fontsize=16)
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+# Maps
+
+def compute_heatmap(data):
+    return bin_levels(data, ZOOM_LEVELS)
+
+
+def render_heatmap(levels, path, fig=None):
+    cells_heatmap(levels).save(path)
+
+
+def compute_severity_sample(data, n=1000, random_state=42):
+    data_geo = data.dropna(subset=['LATITUDE', 'LONGITUDE'])
+    return data_geo.sample(n=min(n, len(data_geo)), random_state=random_state)
+
+
+def render_severity_map(sample, path, fig=None):
+    severity_map(sample).save(path)
+
+
+def render_severity_tiles(clusters, path, fig=None):
+    save_tiled_map(clusters, path)
+
+
+GEO_COLUMNS = ['LATITUDE', 'LONGITUDE', 'NUMBER OF PERSONS INJURED', 'NUMBER OF PERSONS KILLED']
+
+SECTIONS = [
+    Section('missing_values', SCHEMA, compute_missing_values, render_table, 'missing_values.csv'),
+    Section('top_factors', FACTOR_COLUMNS[:1], compute_top_factors, render_top_factors, 'top_factors.png'),
+    Section('top_vehicle_types', VEHICLE_COLUMNS[:1], compute_top_vehicle_types, render_top_vehicle_types,
+            'top_vehicle_types.png'),
+    Section('crash_types', CRASH_TYPE_COLUMNS.values(), compute_crash_types, render_crash_types, 'crash_types.png'),
+    Section('hourly', ['Hour of Day'], compute_hourly, render_hourly, 'hourly.png'),
+    Section('monthly', ['Month'], compute_monthly, render_monthly, 'monthly.png'),
+    Section('decomposition', ['CRASH DATE'], compute_decomposition, render_decomposition, 'decomposition.png'),
+    Section('boroughs', ['BOROUGH'], compute_boroughs, render_boroughs, 'boroughs.png'),
+    Section('borough_rates', ['BOROUGH'] + [column for column in MEASURES.values() if column], compute_borough_rates,
+            render_borough_rates, 'borough_rates.png'),
+    Section('heatmap', GEO_COLUMNS, compute_heatmap, render_heatmap, 'Heatmap.html'),
+    Section('severity_map', GEO_COLUMNS, compute_severity_sample, render_severity_map, 'severity.html'),
+    Section('severity_tiles', GEO_COLUMNS, cluster_tiles, render_severity_tiles, 'severity_tiles.html'),
+]
@@ -0,0 +1,379 @@
+"""Where the crashes come from: a local CSV export or the NYC OpenData SODA API.
+
+Both sources yield pages of crashes in the SCHEMA types, optionally restricted to a CRASH
+DATE range, and CrashStore.pull writes each page into the month-partitioned store as it
+arrives:
+
+    store = CrashStore('store')
+    store.pull(LocalFileSource('Motor_Vehicle_Collisions_-_Crashes.csv'))
+    store.pull(SodaSource(), since=incremental_since(store))
+
+SodaSource pages through the dataset ordered by crash date with $limit/$offset, fetching
+several pages at once over kept-alive connections and retrying throttled or failed requests
+with exponential backoff, so a full pull is limited by bandwidth rather than by round trips.
+A $where filter on crash_date keeps incremental refreshes down to the new rows.
+
+MockSodaServer serves a DataFrame through the same query parameters on localhost, for tests
+and for trying the pipeline offline:
+
+    python tdsp_sources.py mock Motor_Vehicle_Collisions_-_Crashes.csv --port 8000
+    python tdsp_sources.py pull store --url http://127.0.0.1:8000
+"""
+
+import abc
+import argparse
+import collections
+import io
+import json
+import re
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from tdsp_data import DATA_PATH, SCHEMA, apply_schema, csv_dtypes, read_crashes_csv
+from tdsp_store import UNKNOWN_MONTH
+from tdsp_stream import DEFAULT_CHUNKSIZE
+from tdsp_time import parse_dates
+
+
+SODA_URL = 'https://data.cityofnewyork.us'
+DATASET_ID = 'h9gi-nx95'
+
+# Export column -> SODA field name (the API spells the first two vehicle type fields differently)
+API_FIELDS = {column: column.lower().replace(' ', '_') for column in SCHEMA}
+API_FIELDS.update({
+    'VEHICLE TYPE CODE 1': 'vehicle_type_code1',
+    'VEHICLE TYPE CODE 2': 'vehicle_type_code2',
+})
+EXPORT_COLUMNS = {field: column for column, field in API_FIELDS.items()}
+
+SODA_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+PAGE_ORDER = 'crash_date, collision_id'
+
+# Responses worth retrying: throttling and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Late reports and corrections keep arriving for recent weeks, so they are pulled again
+LOOKBACK_DAYS = 30
+
+
+def _date_range(data, since=None, until=None):
+    keep = pd.Series(True, index=data.index)
+    if since is not None:
+        keep &= data['CRASH DATE'] >= pd.Timestamp(since)
+    if until is not None:
+        keep &= data['CRASH DATE'] < pd.Timestamp(until)
+    return data[keep.to_numpy()]
+
+
+class DataSource(abc.ABC):
+    """Yields pages of crashes in the SCHEMA types, with CRASH DATE in [since, until)."""
+
+    @abc.abstractmethod
+    def pages(self, since=None, until=None):
+        """Yields DataFrames of crashes, ideally ordered by CRASH DATE."""
+
+    def load(self, since=None, until=None):
+        """Returns every page as one DataFrame."""
+        pages = list(self.pages(since, until))
+        if not pages:
+            return apply_schema(pd.DataFrame({column: pd.Series(dtype=object) for column in SCHEMA}))
+        return apply_schema(pd.concat(pages, ignore_index=True))
+
+
+class LocalFileSource(DataSource):
+    """A CSV export on disk, read `chunksize` rows at a time."""
+
+    def __init__(self, path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE):
+        self.path = path
+        self.chunksize = chunksize
+
+    def pages(self, since=None, until=None):
+        for chunk in read_crashes_csv(self.path, chunksize=self.chunksize):
+            chunk = _date_range(chunk, since, until)
+            if not chunk.empty:
+                yield chunk
+
+
+def soda_where(since=None, until=None):
+    """Returns the $where clause for crash dates in [since, until), or None for all rows."""
+    clauses = []
+    if since is not None:
+        clauses.append("crash_date >= '%s'" % pd.Timestamp(since).strftime('%Y-%m-%dT%H:%M:%S'))
+    if until is not None:
+        clauses.append("crash_date < '%s'" % pd.Timestamp(until).strftime('%Y-%m-%dT%H:%M:%S'))
+    return ' AND '.join(clauses) or None
+
+
+def read_soda_csv(content):
+    """Parses one page of SODA CSV output into the export columns and SCHEMA types."""
+    dtype = {API_FIELDS[column]: kind for column, kind in csv_dtypes().items()}
+    page = pd.read_csv(io.BytesIO(content), dtype=dtype).rename(columns=EXPORT_COLUMNS)
+    page['CRASH DATE'] = parse_dates(page['CRASH DATE'], SODA_DATE_FORMAT)
+    return apply_schema(page)
+
+
+class SodaSource(DataSource):
+    """The crashes dataset on a Socrata SODA endpoint, fetched in pages of `page_size` rows.
+
+    Up to `workers` pages are in flight at once, each worker thread keeping its own
+    kept-alive session. Pages are yielded in order, and at most twice `workers` fetched pages
+    wait to be consumed, so memory stays bounded on a full pull. Failed requests are retried
+    `retries` times, waiting `backoff` * 2 ** attempt seconds (or the server's Retry-After).
+    """
+
+    def __init__(self, base_url=SODA_URL, dataset=DATASET_ID, app_token=None, page_size=50000, workers=8,
+                 retries=5, backoff=0.5, timeout=120):
+        self.url = '%s/resource/%s' % (base_url.rstrip('/'), dataset)
+        self.app_token = app_token
+        self.page_size = page_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount('http://', HTTPAdapter(pool_maxsize=1, max_retries=0))
+            session.mount('https://', HTTPAdapter(pool_maxsize=1, max_retries=0))
+            if self.app_token:
+                session.headers['X-App-Token'] = self.app_token
+        return session
+
+    def _get(self, suffix, params):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self._session().get(self.url + suffix, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == self.retries:
+                    response.raise_for_status()
+                    return response
+                retry_after = response.headers.get('Retry-After', '')
+                delay = float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt
+            time.sleep(delay)
+
+    def _params(self, since, until, **params):
+        where = soda_where(since, until)
+        if where is not None:
+            params['$where'] = where
+        return params
+
+    def count(self, since=None, until=None):
+        """Returns the number of crashes in the date range."""
+        response = self._get('.json', self._params(since, until, **{'$select': 'count(*) AS count'}))
+        return int(response.json()[0]['count'])
+
+    def fetch_page(self, offset, since=None, until=None):
+        params = self._params(since, until, **{
+            '$select': ', '.join(API_FIELDS.values()),
+            '$order': PAGE_ORDER,
+            '$limit': self.page_size,
+            '$offset': offset,
+        })
+        return read_soda_csv(self._get('.csv', params).content)
+
+    def pages(self, since=None, until=None):
+        offsets = range(0, self.count(since, until), self.page_size)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = collections.deque()
+            for offset in offsets:
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(self.fetch_page, offset, since, until))
+            while pending:
+                yield pending.popleft().result()
+
+
+def incremental_since(store, lookback_days=LOOKBACK_DAYS):
+    """Returns the first date to pull into `store`: its last crash date minus `lookback_days`.
+
+    Returns None (pull everything) when the store holds no dated crashes.
+    """
+    months = [month for month in store.months() if month != UNKNOWN_MONTH]
+    if not months:
+        return None
+    last = store.load([months[-1]], columns=['CRASH DATE'])['CRASH DATE'].max()
+    return last.normalize() - pd.Timedelta(days=lookback_days)
+
+
+# Local stand-in for the SODA API
+
+_CONDITION = re.compile(r"^\s*(\w+)\s*(>=|<=|>|<|=)\s*'([^']*)'\s*$")
+_COMPARE = {
+    '>=': lambda a, b: a >= b, '<=': lambda a, b: a <= b, '>': lambda a, b: a > b,
+    '<': lambda a, b: a < b, '=': lambda a, b: a == b,
+}
+
+
+class MockSodaServer:
+    """Serves a crashes DataFrame like the SODA API does, on localhost.
+
+    Supports what SodaSource sends: $select of fields or count(*), $where with comparisons
+    joined by AND, $order, $limit and $offset. `latency` seconds are added to every response,
+    and with `fail_every` set every n-th request answers 503 instead, to exercise retries.
+
+        with MockSodaServer(data) as server:
+            SodaSource(server.url).load()
+    """
+
+    def __init__(self, data, dataset=DATASET_ID, host='127.0.0.1', port=0, latency=0.0, fail_every=None):
+        rows = data[[column for column in API_FIELDS if column in data]].rename(columns=API_FIELDS)
+        rows['crash_date'] = rows['crash_date'].dt.strftime('%Y-%m-%dT%H:%M:%S.000')
+        self.rows = rows
+        self.dataset = dataset
+        self.latency = latency
+        self.fail_every = fail_every
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._sorted = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _ordered(self, order):
+        # Sorting the whole frame is the slow part of a request, so each order is sorted once
+        with self._lock:
+            if order not in self._sorted:
+                fields = [field.strip() for field in order.split(',')]
+                self._sorted[order] = self.rows.sort_values(fields, kind='stable')
+            return self._sorted[order]
+
+    def _where(self, rows, where):
+        if not where:
+            return rows
+        keep = pd.Series(True, index=rows.index)
+        for condition in re.split(r'\s+AND\s+', where, flags=re.IGNORECASE):
+            field, operator, value = _CONDITION.match(condition).groups()
+            keep &= _COMPARE[operator](rows[field].astype(str), value)
+        return rows[keep]
+
+    def query(self, params):
+        order = params.get('$order')
+        rows = self._where(self._ordered(order) if order else self.rows, params.get('$where'))
+        offset = int(params.get('$offset', 0))
+        # SODA returns 1,000 rows when no $limit is given
+        limit = int(params.get('$limit', 1000))
+        return rows.iloc[offset:offset + limit]
+
+    def _respond(self, path, params):
+        with self._lock:
+            self.requests += 1
+            number = self.requests
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_every and number % self.fail_every == 0:
+            return 503, 'text/plain', b'busy'
+        resource, _, extension = path.rpartition('/')[2].partition('.')
+        if path.rpartition('/')[0] != '/resource' or resource != self.dataset:
+            return 404, 'text/plain', b'not found'
+        select = params.get('$select', '')
+        if select.lower().startswith('count(*)'):
+            rows = self._where(self.rows, params.get('$where'))
+            return 200, 'application/json', json.dumps([{'count': str(len(rows))}]).encode()
+        rows = self.query(params)
+        if select:
+            rows = rows[[field.strip() for field in select.split(',')]]
+        if extension == 'json':
+            return 200, 'application/json', rows.to_json(orient='records').encode()
+        return 200, 'text/csv', rows.to_csv(index=False).encode()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                status, content_type, body = server._respond(url.path, params)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Pull crashes into a store, or serve a local SODA stand-in.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pull = commands.add_parser('pull', help='pull new crashes from the SODA API into a CrashStore')
+    pull.add_argument('store', help='directory of the CrashStore')
+    pull.add_argument('--url', default=SODA_URL, help='SODA base URL (default: %(default)s)')
+    pull.add_argument('--app-token', help='Socrata app token, for higher rate limits')
+    pull.add_argument('--since', help='first crash date to pull (default: %d days before the last one stored)'
+                      % LOOKBACK_DAYS)
+    pull.add_argument('--page-size', type=int, default=50000, help='rows per request (default: %(default)s)')
+    pull.add_argument('--workers', type=int, default=8, help='requests in flight (default: %(default)s)')
+
+    mock = commands.add_parser('mock', help='serve a local CSV export through a SODA-compatible API')
+    mock.add_argument('path', help='local CSV export of the crashes dataset')
+    mock.add_argument('--port', type=int, default=8000, help='port to listen on (default: %(default)s)')
+    mock.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    from tdsp_store import CrashStore
+
+    args = parse_args(argv)
+    if args.command == 'mock':
+        server = MockSodaServer(read_crashes_csv(args.path), port=args.port, latency=args.latency)
+        print('serving %s at %s/resource/%s.csv' % (args.path, server.url, DATASET_ID))
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            server.stop()
+        return 0
+
+    store = CrashStore(args.store)
+    since = args.since or incremental_since(store)
+    source = SodaSource(args.url, app_token=args.app_token, page_size=args.page_size, workers=args.workers)
+    start = time.perf_counter()
+    months = store.pull(source, since=since)
+    print('rewrote %d months in %.1f s' % (len(months), time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Spatial pre-aggregation of crashes into square grid or hexagonal cells.
+
+Coordinates are projected onto a local flat plane around NYC (accurate to well under a
+percent across the five boroughs), binned into cells of a given size in meters, and each
+cell keeps its crash, injury and fatality totals.
+"""
+
+import numpy as np
+import pandas as pd
+
+from tdsp_profile import profiled
+
+
+# Rough bounding box of the five boroughs; points outside it, including the (0, 0)
+# placeholders noted in the describe() commentary, are treated as bad coordinates
+NYC_BOUNDS = {'south': 40.45, 'north': 40.95, 'west': -74.30, 'east': -73.65}
+
+ORIGIN = (40.730610, -73.935242)
+METERS_PER_DEGREE_LAT = 110574.0
+METERS_PER_DEGREE_LON = 111320.0 * np.cos(np.radians(ORIGIN[0]))
+
+# Weights of the 'severity' score: each crash counts once, plus extra for every person hurt
+INJURY_WEIGHT = 3.0
+DEATH_WEIGHT = 10.0
+
+# (min zoom, max zoom, cell size in meters) used for the heatmap at each range of zoom levels
+ZOOM_LEVELS = [
+    (0, 11, 600.0),
+    (12, 13, 150.0),
+    (14, 18, 40.0),
+]
+
+_KEY_OFFSET = 1 << 20
+
+
+def valid_coordinates(latitude, longitude):
+    """Returns a mask of points that are present and fall inside NYC_BOUNDS."""
+    with np.errstate(invalid='ignore'):
+        return (
+            (latitude >= NYC_BOUNDS['south']) & (latitude <= NYC_BOUNDS['north'])
+            & (longitude >= NYC_BOUNDS['west']) & (longitude <= NYC_BOUNDS['east'])
+        )
+
+
+def project(latitude, longitude):
+    """Projects degrees to x/y meters east and north of ORIGIN."""
+    x = (np.asarray(longitude, dtype='float64') - ORIGIN[1]) * METERS_PER_DEGREE_LON
+    y = (np.asarray(latitude, dtype='float64') - ORIGIN[0]) * METERS_PER_DEGREE_LAT
+    return x, y
+
+
+def unproject(x, y):
+    """Inverse of project(); returns latitude and longitude."""
+    return y / METERS_PER_DEGREE_LAT + ORIGIN[0], x / METERS_PER_DEGREE_LON + ORIGIN[1]
+
+
+def grid_cells(x, y, size):
+    """Returns the integer (column, row) of the square cell of side `size` holding each point."""
+    return np.floor(x / size).astype('int64'), np.floor(y / size).astype('int64')
+
+
+def grid_centers(i, j, size):
+    return (i + 0.5) * size, (j + 0.5) * size
+
+
+def hex_cells(x, y, size):
+    """Returns the axial (q, r) coordinates of the pointy-top hexagon holding each point.
+
+    `size` is the distance from a hexagon's center to its corners.
+    """
+    q = (np.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    # Cube rounding: round all three cube coordinates, then fix the one that moved the most
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype('int64'), rr.astype('int64')
+
+
+def hex_centers(q, r, size):
+    return size * np.sqrt(3) * (q + r / 2), size * 1.5 * r
+
+
+def cell_keys(i, j):
+    """Packs two integer cell coordinates into one int64 key."""
+    return (i + _KEY_OFFSET) * (2 * _KEY_OFFSET) + (j + _KEY_OFFSET)
+
+
+def split_keys(keys):
+    return keys // (2 * _KEY_OFFSET) - _KEY_OFFSET, keys % (2 * _KEY_OFFSET) - _KEY_OFFSET
+
+
+def bin_crashes(data, cell_size=150.0, kind='grid'):
+    """Bins the crashes of `data` into cells of `cell_size` meters.
+
+    Rows with missing or out-of-bounds coordinates are dropped in the same pass. Returns one
+    row per non-empty cell with its center and its crash, injury and fatality totals,
+    busiest cells first.
+    """
+    if kind not in ('grid', 'hex'):
+        raise ValueError("kind must be 'grid' or 'hex', not %r" % (kind,))
+    latitude = data['LATITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+    longitude = data['LONGITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+    valid = valid_coordinates(latitude, longitude)
+    x, y = project(latitude[valid], longitude[valid])
+
+    cells, centers = (grid_cells, grid_centers) if kind == 'grid' else (hex_cells, hex_centers)
+    keys, inverse = np.unique(cell_keys(*cells(x, y, cell_size)), return_inverse=True)
+    injured = data['NUMBER OF PERSONS INJURED'].to_numpy(dtype='int64', na_value=0)[valid]
+    killed = data['NUMBER OF PERSONS KILLED'].to_numpy(dtype='int64', na_value=0)[valid]
+
+    center_lat, center_lon = unproject(*centers(*split_keys(keys), cell_size))
+    cells = pd.DataFrame({
+        'LATITUDE': center_lat,
+        'LONGITUDE': center_lon,
+        'crashes': np.bincount(inverse, minlength=len(keys)),
+        'injured': np.bincount(inverse, weights=injured, minlength=len(keys)).astype('int64'),
+        'killed': np.bincount(inverse, weights=killed, minlength=len(keys)).astype('int64'),
+    })
+    return cells.sort_values('crashes', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def severity_score(crashes, injured, killed):
+    """Crash count weighted by the number of people injured and killed."""
+    return crashes + INJURY_WEIGHT * injured + DEATH_WEIGHT * killed
+
+
+def cell_weights(cells, weight='crashes'):
+    """Returns the weight of each cell: 'crashes', 'injured', 'killed' or 'severity'."""
+    if weight == 'severity':
+        return severity_score(cells['crashes'], cells['injured'], cells['killed']).to_numpy(dtype='float64')
+    if weight not in ('crashes', 'injured', 'killed'):
+        raise ValueError('unknown weight %r' % (weight,))
+    return cells[weight].to_numpy(dtype='float64')
+
+
+@profiled()
+def bin_levels(data, levels=ZOOM_LEVELS, kind='grid'):
+    """Returns {(min zoom, max zoom): cells} with one binning per entry of `levels`."""
+    return {(low, high): bin_crashes(data, size, kind) for low, high, size in levels}
@@ -0,0 +1,281 @@
+"""Partitioned crash store with incremental daily refresh.
+
+Crashes are kept in one Parquet file per CRASH DATE month, and those without a CRASH DATE
+in an 'unknown' partition. A small index records the month and a content hash of every
+COLLISION_ID, so a new export is compared against it and only new or changed records are
+written, touching only the months they fall in. Per-month aggregates are stored next to the
+partitions and combined on read.
+
+    root/
+        index.parquet                  COLLISION_ID, month, row hash
+        partitions/2024-09.parquet     crashes of one month
+        partitions/unknown.parquet     crashes without a CRASH DATE
+        aggregates/2024-09.parquet     counts of one month (kind, key, count)
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from tdsp_data import SCHEMA, apply_schema, read_crashes_csv, write_parquet
+from tdsp_stream import DEFAULT_CHUNKSIZE
+from tdsp_time import crash_hours
+
+
+# Aggregates kept per partition, as (kind, column they count)
+AGGREGATE_COLUMNS = {
+    'borough': 'BOROUGH',
+    'factor': 'CONTRIBUTING FACTOR VEHICLE 1',
+    'vehicle': 'VEHICLE TYPE CODE 1',
+}
+
+# Partition of the crashes without a CRASH DATE; sorts after every month
+UNKNOWN_MONTH = 'unknown'
+
+# Rows CrashStore.pull keeps in memory before writing every month it has pending
+PULL_BUFFER_ROWS = 1000000
+
+
+def row_hashes(data):
+    """Returns a uint64 content hash per row, over the SCHEMA columns."""
+    columns = [column for column in SCHEMA if column in data]
+    return pd.util.hash_pandas_object(data[columns], index=False).to_numpy()
+
+
+def month_keys(dates):
+    """Returns the partition of each date: its 'YYYY-MM' month, or UNKNOWN_MONTH where it is missing."""
+    keys = dates.dt.strftime('%Y-%m').to_numpy(dtype=object)
+    keys[dates.isna().to_numpy()] = UNKNOWN_MONTH
+    return keys
+
+
+class _Batch:
+    """Rows staged for writing per month, with the ids each month's partition must drop."""
+
+    def __init__(self):
+        self.frames = {}
+        self.replaced = {}
+        self.rows = 0
+
+    @property
+    def dirty(self):
+        """The months whose partitions must be rewritten."""
+        return set(self.replaced)
+
+    def add(self, data, months, previous):
+        """Queues the rows of `data` for `months`; `previous` is each record's stored month or None."""
+        for month, rows in data.groupby(months, sort=False):
+            self.frames.setdefault(month, []).append(rows)
+        self.rows += len(data)
+        # A record is dropped from the month it was stored in and from the one it goes to
+        ids = data['COLLISION_ID'].to_numpy()
+        moved = pd.notna(previous)
+        keys = np.concatenate([months, previous[moved]])
+        for month, month_ids in pd.Series(np.concatenate([ids, ids[moved]])).groupby(keys, sort=False):
+            self.replaced.setdefault(month, []).append(month_ids.to_numpy())
+
+    def pop(self, month):
+        """Returns the rows queued for `month` (None if there are none) and the ids it must drop."""
+        frames = self.frames.pop(month, [])
+        replaced = np.concatenate(self.replaced.pop(month))
+        self.rows -= sum(len(frame) for frame in frames)
+        return (pd.concat(frames, ignore_index=True) if frames else None), replaced
+
+
+class CrashStore:
+    """Crashes partitioned by month, with an index on COLLISION_ID."""
+
+    def __init__(self, root):
+        self.root = root
+        self.partition_dir = os.path.join(root, 'partitions')
+        self.aggregate_dir = os.path.join(root, 'aggregates')
+        self.index_path = os.path.join(root, 'index.parquet')
+        os.makedirs(self.partition_dir, exist_ok=True)
+        os.makedirs(self.aggregate_dir, exist_ok=True)
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            if os.path.exists(self.index_path):
+                self._index = pd.read_parquet(self.index_path).set_index('COLLISION_ID')
+            else:
+                self._index = pd.DataFrame(
+                    {'month': pd.Series(dtype=object), 'hash': pd.Series(dtype='uint64')},
+                    index=pd.Index([], dtype='int64', name='COLLISION_ID'),
+                )
+        return self._index
+
+    def months(self):
+        return sorted(name[:-len('.parquet')] for name in os.listdir(self.partition_dir) if name.endswith('.parquet'))
+
+    def partition_path(self, month):
+        return os.path.join(self.partition_dir, '%s.parquet' % month)
+
+    def aggregate_path(self, month):
+        return os.path.join(self.aggregate_dir, '%s.parquet' % month)
+
+    def changes(self, data):
+        """Returns the rows of `data` that are new or differ from the stored record.
+
+        Duplicate COLLISION_IDs within `data` keep their last occurrence.
+        """
+        data = data.drop_duplicates('COLLISION_ID', keep='last')
+        hashes = row_hashes(data)
+        positions = self.index.index.get_indexer(data['COLLISION_ID'].to_numpy())
+        known = positions >= 0
+        changed = ~known
+        changed[known] = self.index['hash'].to_numpy()[positions[known]] != hashes[known]
+        return data[changed]
+
+    def ingest(self, data):
+        """Writes new or changed records and returns the list of months that were rewritten."""
+        batch = _Batch()
+        self._stage(data, batch)
+        affected = self._flush(batch, batch.dirty)
+        if affected:
+            self._write_index()
+        return affected
+
+    def _stage(self, data, batch):
+        """Records the new or changed rows of `data` in the index and queues them in `batch`.
+
+        Nothing is written to disk; the index is only changed in memory.
+        """
+        data = self.changes(data)
+        if data.empty:
+            return
+        months = month_keys(data['CRASH DATE'])
+        ids = data['COLLISION_ID'].to_numpy()
+        # A changed record may have moved to another month; its old partition is rewritten too
+        batch.add(data, months, self.index['month'].reindex(ids).to_numpy())
+
+        updates = pd.DataFrame({'month': months, 'hash': row_hashes(data)}, index=pd.Index(ids, name='COLLISION_ID'))
+        self._index = pd.concat([self.index.drop(ids, errors='ignore'), updates]).sort_index()
+
+    def _flush(self, batch, months):
+        """Rewrites the given months of `batch` and returns them sorted."""
+        months = sorted(set(months) & batch.dirty)
+        for month in months:
+            incoming, replaced = batch.pop(month)
+            if incoming is not None:
+                # Only the newest copy of a record is written, and only to the month it is in now
+                incoming = incoming.drop_duplicates('COLLISION_ID', keep='last')
+                incoming = incoming[self.index['month'].reindex(incoming['COLLISION_ID']).to_numpy() == month]
+            self._write_partition(month, incoming, replaced)
+        return months
+
+    def _write_index(self):
+        write_parquet(self.index.reset_index(), self.index_path)
+
+    def _write_partition(self, month, incoming, replaced):
+        path = self.partition_path(month)
+        frames = [] if incoming is None else [incoming]
+        if os.path.exists(path):
+            existing = pd.read_parquet(path)
+            frames.insert(0, existing[~existing['COLLISION_ID'].isin(replaced)])
+        partition = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if partition.empty:
+            for stale in (path, self.aggregate_path(month)):
+                if os.path.exists(stale):
+                    os.remove(stale)
+            return
+        partition = apply_schema(partition.sort_values('COLLISION_ID', kind='stable').reset_index(drop=True))
+        write_parquet(partition, path)
+        write_parquet(partition_aggregates(partition), self.aggregate_path(month))
+
+    def refresh(self, path, chunksize=DEFAULT_CHUNKSIZE):
+        """Ingests a full export, reading it in chunks and keeping only new or changed rows.
+
+        A COLLISION_ID repeated in the export keeps its last occurrence, even across chunks.
+        Returns the list of months that were rewritten.
+        """
+        pending = []
+        for chunk in read_crashes_csv(path, chunksize=chunksize):
+            # An earlier copy of a record is superseded by this chunk, whether or not it changed
+            ids = chunk['COLLISION_ID'].to_numpy()
+            pending = [rows[~rows['COLLISION_ID'].isin(ids)] for rows in pending]
+            pending.append(self.changes(chunk))
+        pending = [chunk for chunk in pending if not chunk.empty]
+        if not pending:
+            return []
+        return self.ingest(apply_schema(pd.concat(pending, ignore_index=True)))
+
+    def pull(self, source, since=None, until=None, buffer_rows=PULL_BUFFER_ROWS):
+        """Ingests the pages of a tdsp_sources DataSource as they arrive.
+
+        Only crashes with CRASH DATE in [since, until) are requested. Pages are staged in
+        memory and each month is written once, as soon as a page starts past it (pages come
+        ordered by date), or when more than `buffer_rows` rows are waiting; the index is
+        written once at the end. Returns the sorted list of months that were rewritten.
+        """
+        batch = _Batch()
+        affected = set()
+        for page in source.pages(since, until):
+            self._stage(page, batch)
+            if batch.rows > buffer_rows:
+                complete = batch.dirty
+            else:
+                dates = page['CRASH DATE'].dropna()
+                first = dates.min().strftime('%Y-%m') if len(dates) else ''
+                complete = [month for month in batch.dirty if month < first]
+            affected.update(self._flush(batch, complete))
+        affected.update(self._flush(batch, batch.dirty))
+        if affected:
+            self._write_index()
+        return sorted(affected)
+
+    def load(self, months=None, columns=None):
+        """Loads the stored crashes, optionally only some months and columns."""
+        months = self.months() if months is None else months
+        frames = [pd.read_parquet(self.partition_path(month), columns=columns) for month in months]
+        if not frames:
+            return pd.DataFrame(columns=columns or list(SCHEMA))
+        return apply_schema(pd.concat(frames, ignore_index=True))
+
+    def aggregates(self):
+        """Returns the cached aggregates combined over all partitions.
+
+        Keys: 'monthly_crashes', 'daily_crashes', 'hourly_crashes', 'borough_count',
+        'factor_count' and 'vehicle_count'.
+        """
+        frames = [pd.read_parquet(self.aggregate_path(month)) for month in self.months()]
+        counts = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['kind', 'key', 'count'])
+
+        def kind(name):
+            return counts[counts['kind'] == name].set_index('key')['count']
+
+        daily = kind('daily')
+        daily.index = pd.to_datetime(daily.index)
+        daily = daily.groupby(level=0).sum().sort_index().rename_axis('CRASH DATE')
+        hourly = kind('hourly')
+        hourly.index = hourly.index.astype('int64')
+        results = {
+            'daily_crashes': daily,
+            'monthly_crashes': daily.groupby(daily.index.to_period('M')).sum(),
+            'hourly_crashes': hourly.groupby(level=0).sum().reindex(range(24), fill_value=0).rename_axis('Hour of Day'),
+        }
+        for name, column in AGGREGATE_COLUMNS.items():
+            totals = kind(name).groupby(level=0).sum().sort_index()
+            results['%s_count' % name] = totals.sort_values(ascending=False, kind='stable').rename_axis(column)
+        return results
+
+
+def partition_aggregates(partition):
+    """Returns the daily, hourly and category counts of one partition as a long table."""
+    pieces = []
+    daily = partition['CRASH DATE'].value_counts(sort=False)
+    pieces.append(('daily', daily.index.strftime('%Y-%m-%d'), daily.to_numpy()))
+    hours = crash_hours(partition['CRASH TIME'])
+    hourly = np.bincount(hours[hours >= 0], minlength=24)
+    pieces.append(('hourly', np.arange(24).astype(str), hourly))
+    for name, column in AGGREGATE_COLUMNS.items():
+        counts = partition[column].value_counts(sort=False)
+        counts = counts[counts > 0]
+        pieces.append((name, counts.index.astype(str), counts.to_numpy()))
+    return pd.DataFrame({
+        'kind': np.concatenate([np.full(len(keys), kind, dtype=object) for kind, keys, _ in pieces]),
+        'key': np.concatenate([np.asarray(keys, dtype=object) for _, keys, _ in pieces]),
+        'count': np.concatenate([counts for _, _, counts in pieces]).astype('int64'),
+    })
@@ -0,0 +1,253 @@
+"""Streaming summaries of the crashes CSV, read in bounded chunks.
+
+Each accumulator is fed one chunk at a time and can be merged with another accumulator of
+the same kind, so peak memory depends on the chunk size rather than on the size of the file.
+"""
+
+import numpy as np
+import pandas as pd
+
+from tdsp_data import COUNT_COLUMNS, DATA_PATH, FACTOR_COLUMNS, VEHICLE_COLUMNS, read_crashes_csv
+from tdsp_time import crash_hours
+
+
+DEFAULT_CHUNKSIZE = 250000
+
+MOMENT_COLUMNS = ['LATITUDE', 'LONGITUDE'] + COUNT_COLUMNS + ['COLLISION_ID']
+CATEGORY_COLUMNS = ['BOROUGH'] + FACTOR_COLUMNS + VEHICLE_COLUMNS
+
+
+class MissingCounts:
+    """Number of missing values per column, as in pd.isnull(data).sum()."""
+
+    def __init__(self):
+        self.rows = 0
+        self.missing = None
+
+    def update(self, chunk):
+        counts = chunk.isnull().sum()
+        self.missing = counts if self.missing is None else self.missing.add(counts, fill_value=0)
+        self.rows += len(chunk)
+
+    def merge(self, other):
+        if other.missing is not None:
+            self.missing = other.missing if self.missing is None else self.missing.add(other.missing, fill_value=0)
+        self.rows += other.rows
+
+    def result(self):
+        """Returns the 'Missing Values' / 'Percentage (%)' table used in explorer_tdsp.py."""
+        missing = self.missing.astype('int64')
+        return pd.DataFrame({'Missing Values': missing, 'Percentage (%)': (missing / self.rows) * 100})
+
+
+_INT64_MAX = np.iinfo('int64').max
+
+
+def exact_sum_of_squares(values):
+    """Returns the sum of squares of an int64 array exactly, as a Python int.
+
+    Squaring values as large as COLLISION_ID overflows int64 over a few hundred thousand
+    rows, so the values are shifted to start at zero and squared in blocks whose sums fit
+    in int64; the shift is undone with Python ints.
+    """
+    if not len(values):
+        return 0
+    low = int(values.min())
+    if int(values.max()) - low > _INT64_MAX:
+        return sum(value * value for value in values.tolist())
+    shifted = values - low
+    largest = int(shifted.max())
+    if largest * largest > _INT64_MAX:
+        squares = sum(value * value for value in shifted.tolist())
+    else:
+        block = _INT64_MAX // max(largest * largest, 1)
+        squares = sum(int(np.dot(part, part)) for part in np.array_split(shifted, -(-len(shifted) // block)))
+    total = int(shifted.sum()) if largest * len(values) <= _INT64_MAX else sum(shifted.tolist())
+    # sum((d + low)^2) = sum(d^2) + 2 low sum(d) + n low^2
+    return squares + 2 * low * total + len(values) * low * low
+
+
+class Moments:
+    """Count, mean, standard deviation, min and max per numeric column (the moments of describe()).
+
+    Integer columns keep exact integer sums, so their results do not depend at all on how
+    the file was chunked. Float columns are combined with the pairwise
+    update of Chan et al., whose rounding depends on the chunking: their mean and standard
+    deviation agree with the in-memory results to rounding error, not bit for bit.
+    Quartiles are not mergeable and are left out.
+    """
+
+    def __init__(self, columns=MOMENT_COLUMNS):
+        self.columns = list(columns)
+        self.state = {}
+
+    def update(self, chunk):
+        for column in self.columns:
+            if column not in chunk:
+                continue
+            values = chunk[column].dropna()
+            if values.empty:
+                continue
+            if pd.api.types.is_integer_dtype(values.dtype):
+                values = values.to_numpy(dtype='int64')
+                stats = {
+                    'count': len(values),
+                    'sum': int(values.sum()),
+                    'sumsq': exact_sum_of_squares(values),
+                    'min': int(values.min()),
+                    'max': int(values.max()),
+                }
+            else:
+                values = values.to_numpy(dtype='float64')
+                mean = values.mean()
+                stats = {
+                    'count': len(values),
+                    'mean': mean,
+                    'm2': float(((values - mean) ** 2).sum()),
+                    'min': float(values.min()),
+                    'max': float(values.max()),
+                }
+            self._combine(column, stats)
+
+    def merge(self, other):
+        for column, stats in other.state.items():
+            self._combine(column, dict(stats))
+
+    def _combine(self, column, stats):
+        current = self.state.get(column)
+        if current is None:
+            self.state[column] = stats
+            return
+        current['min'] = min(current['min'], stats['min'])
+        current['max'] = max(current['max'], stats['max'])
+        if 'sum' in current:
+            current['sum'] += stats['sum']
+            current['sumsq'] += stats['sumsq']
+        else:
+            count = current['count'] + stats['count']
+            delta = stats['mean'] - current['mean']
+            current['m2'] += stats['m2'] + delta * delta * current['count'] * stats['count'] / count
+            current['mean'] += delta * stats['count'] / count
+        current['count'] += stats['count']
+
+    def result(self):
+        """Returns a describe()-shaped table with the count, mean, std, min and max rows."""
+        table = {}
+        for column in self.columns:
+            stats = self.state.get(column)
+            if stats is None:
+                continue
+            count = stats['count']
+            if 'sum' in stats:
+                mean = stats['sum'] / count
+                # Exact integer arithmetic for the sum of squared deviations
+                m2 = (stats['sumsq'] * count - stats['sum'] ** 2) / count
+            else:
+                mean, m2 = stats['mean'], stats['m2']
+            std = np.sqrt(m2 / (count - 1)) if count > 1 else np.nan
+            table[column] = [count, mean, std, stats['min'], stats['max']]
+        return pd.DataFrame(table, index=['count', 'mean', 'std', 'min', 'max'], dtype='float64')
+
+
+class CategoryCounts:
+    """value_counts() for categorical columns such as boroughs, factors and vehicle types."""
+
+    def __init__(self, columns=CATEGORY_COLUMNS):
+        self.columns = list(columns)
+        self.counts = {}
+
+    def update(self, chunk):
+        for column in self.columns:
+            if column not in chunk:
+                continue
+            counts = chunk[column].value_counts(sort=False)
+            self._add(column, counts[counts > 0])
+
+    def merge(self, other):
+        for column, counts in other.counts.items():
+            self._add(column, counts)
+
+    def _add(self, column, counts):
+        counts = counts.set_axis(counts.index.astype(object)).astype('int64')
+        current = self.counts.get(column)
+        self.counts[column] = counts if current is None else current.add(counts, fill_value=0).astype('int64')
+
+    def result(self, column):
+        """Returns the counts of one column, largest first (ties broken by label)."""
+        counts = self.counts.get(column, pd.Series(dtype='int64'))
+        counts = counts.sort_index().sort_values(ascending=False, kind='stable')
+        counts.index.name = column
+        return counts.rename('count')
+
+
+class TimeHistograms:
+    """Crash counts per hour of day, per day and per month."""
+
+    def __init__(self):
+        self.hourly = np.zeros(24, dtype='int64')
+        self.daily = pd.Series(dtype='int64')
+
+    def update(self, chunk):
+        if 'CRASH TIME' in chunk:
+            hours = crash_hours(chunk['CRASH TIME'])
+            self.hourly += np.bincount(hours[hours >= 0], minlength=24)
+        if 'CRASH DATE' in chunk:
+            self._add_daily(chunk['CRASH DATE'].value_counts(sort=False))
+
+    def merge(self, other):
+        self.hourly += other.hourly
+        self._add_daily(other.daily)
+
+    def _add_daily(self, counts):
+        self.daily = counts if self.daily.empty else self.daily.add(counts, fill_value=0)
+        self.daily = self.daily.astype('int64')
+
+    def hourly_counts(self):
+        return pd.Series(self.hourly, index=pd.RangeIndex(24, name='Hour of Day'))
+
+    def daily_counts(self):
+        daily = self.daily.sort_index()
+        daily.index.name = 'CRASH DATE'
+        return daily
+
+    def monthly_counts(self):
+        daily = self.daily_counts()
+        return daily.groupby(daily.index.to_period('M')).sum()
+
+
+class CrashSummary:
+    """All of the streaming accumulators used by the exploratory analysis, updated together."""
+
+    def __init__(self):
+        self.missing = MissingCounts()
+        self.moments = Moments()
+        self.categories = CategoryCounts()
+        self.time = TimeHistograms()
+
+    @property
+    def parts(self):
+        return [self.missing, self.moments, self.categories, self.time]
+
+    def update(self, chunk):
+        for part in self.parts:
+            part.update(chunk)
+
+    def merge(self, other):
+        for part, other_part in zip(self.parts, other.parts):
+            part.merge(other_part)
+        return self
+
+
+def summarize(data):
+    """Runs the accumulators over a DataFrame that is already in memory."""
+    summary = CrashSummary()
+    summary.update(data)
+    return summary
+
+
+def stream_summary(path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE):
+    """Reads the CSV in chunks of `chunksize` rows and returns the merged CrashSummary."""
+    summary = CrashSummary()
+    for chunk in read_crashes_csv(path, chunksize=chunksize):
+        summary.update(chunk)
+    return summary
@@ -0,0 +1,231 @@
+"""Synthetic Motor Vehicle Collisions - Crashes records at any size, for benchmarks and tests.
+
+The generated rows follow the export's columns, formats and quirks: MM/DD/YYYY dates with a
+yearly and weekly rhythm and the 2020 drop, H:MM times peaking in the afternoon rush,
+boroughs and ZIP codes with coordinates around each borough (some missing or at 0, 0),
+street names in several spellings, one to five vehicles per crash with matching factor
+slots, and injury and death counts at roughly the city's rates. Values are drawn
+independently per row, so only the marginal distributions are realistic.
+
+    python tdsp_synthetic.py 10000000 synthetic_10M.csv
+
+writes the CSV in chunks, so the size of the file is not limited by memory.
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from tdsp_data import COUNT_COLUMNS, FACTOR_COLUMNS, VEHICLE_COLUMNS, apply_schema
+from tdsp_time import DATE_FORMAT
+
+
+# Column order of the export
+EXPORT_COLUMNS = (
+    ['CRASH DATE', 'CRASH TIME', 'BOROUGH', 'ZIP CODE', 'LATITUDE', 'LONGITUDE', 'LOCATION',
+     'ON STREET NAME', 'CROSS STREET NAME', 'OFF STREET NAME']
+    + COUNT_COLUMNS + FACTOR_COLUMNS + ['COLLISION_ID'] + VEHICLE_COLUMNS
+)
+
+FIRST_DAY = '2012-07-01'
+LAST_DAY = '2024-10-06'
+
+# Borough -> (share of crashes, latitude, longitude, spread in degrees, ZIP codes)
+BOROUGHS = {
+    'BROOKLYN': (0.30, 40.650, -73.950, 0.035, ['11201', '11203', '11207', '11208', '11211', '11226', '11236']),
+    'QUEENS': (0.26, 40.720, -73.820, 0.045, ['11354', '11368', '11373', '11385', '11434', '11435']),
+    'MANHATTAN': (0.20, 40.770, -73.975, 0.025, ['10001', '10002', '10016', '10019', '10022', '10036']),
+    'BRONX': (0.18, 40.845, -73.880, 0.025, ['10451', '10453', '10456', '10458', '10462', '10467']),
+    'STATEN ISLAND': (0.06, 40.590, -74.120, 0.030, ['10301', '10304', '10306', '10312', '10314']),
+}
+MISSING_BOROUGH = 0.30
+MISSING_COORDINATES = 0.07
+ZERO_COORDINATES = 0.002
+
+# Relative crashes per hour of day, midnight first
+HOUR_WEIGHTS = [
+    3.0, 1.6, 1.2, 1.0, 1.1, 1.5, 2.4, 3.4, 5.0, 4.8, 4.6, 4.9,
+    5.1, 5.2, 5.9, 6.2, 6.3, 6.3, 5.6, 4.6, 4.0, 3.6, 3.3, 3.0,
+]
+# Relative crashes per month (January first) and weekday (Monday first)
+MONTH_WEIGHTS = [0.90, 0.84, 0.92, 0.93, 1.04, 1.07, 1.02, 1.01, 1.03, 1.07, 1.03, 1.02]
+WEEKDAY_WEIGHTS = [1.00, 1.03, 1.04, 1.06, 1.12, 0.95, 0.80]
+
+STREETS = [
+    'BROADWAY', 'ATLANTIC AVENUE', 'ATLANTIC AVE', '3 AVENUE', '3 AVE', 'NORTHERN BOULEVARD',
+    'QUEENS BOULEVARD', 'QUEENS BLVD', 'FLATBUSH AVENUE', 'GRAND CONCOURSE', 'BELT PARKWAY',
+    'BROOKLYN QUEENS EXPRESSWAY', 'LONG ISLAND EXPRESSWAY', 'MAJOR DEEGAN EXPRESSWAY', 'EASTERN PARKWAY',
+    'LINDEN BOULEVARD', 'HYLAN BOULEVARD', 'RICHMOND AVENUE', 'JAMAICA AVENUE', 'ROCKAWAY BOULEVARD',
+    'FDR DRIVE', 'WEST STREET', '2 AVENUE', '1 AVENUE', 'LEXINGTON AVENUE', 'EAST 14 STREET',
+    'WEST 42 STREET', 'KINGS HIGHWAY', 'OCEAN PARKWAY', 'BRUCKNER BOULEVARD',
+]
+
+# Contributing factors and vehicle types with their approximate shares, spelling variants included
+FACTORS = {
+    'Unspecified': 0.35, 'Driver Inattention/Distraction': 0.20, 'Failure to Yield Right-of-Way': 0.06,
+    'Following Too Closely': 0.05, 'Backing Unsafely': 0.04, 'Other Vehicular': 0.03,
+    'Passing or Lane Usage Improper': 0.03, 'Passing Too Closely': 0.025, 'Turning Improperly': 0.025,
+    'Fatigued/Drowsy': 0.02, 'Unsafe Lane Changing': 0.02, 'Traffic Control Disregarded': 0.015,
+    'Driver Inexperience': 0.015, 'Unsafe Speed': 0.012, 'Lost Consciousness': 0.01,
+    'Pavement Slippery': 0.01, 'Alcohol Involvement': 0.01, 'Reaction to Uninvolved Vehicle': 0.008,
+    'Prescription Medication': 0.005, 'View Obstructed/Limited': 0.008, 'Outside Car Distraction': 0.005,
+    'Oversized Vehicle': 0.005, 'Aggressive Driving/Road Rage': 0.005, 'Pedestrian/Bicyclist/Other Pedestrian Error/Confusion': 0.005,
+    'Illnes': 0.002, 'Illness': 0.001, 'Cell Phone (hand-Held)': 0.001, 'Cell Phone (hand-held)': 0.001,
+    'Drugs (illegal)': 0.001, 'Steering Failure': 0.003, 'Brakes Defective': 0.004,
+}
+VEHICLES = {
+    'Sedan': 0.28, 'Station Wagon/Sport Utility Vehicle': 0.22, 'PASSENGER VEHICLE': 0.14,
+    'SPORT UTILITY / STATION WAGON': 0.09, 'Taxi': 0.03, 'TAXI': 0.015, 'Pick-up Truck': 0.025,
+    'Box Truck': 0.015, 'Bike': 0.02, 'Bus': 0.015, 'Tractor Truck Diesel': 0.008, 'Van': 0.008,
+    'Motorcycle': 0.006, 'E-Bike': 0.008, 'E-Scooter': 0.004, 'Ambulance': 0.003, 'AMBUL': 0.001,
+    'Dump': 0.003, 'Convertible': 0.002, 'Garbage or Refuse': 0.002, 'FIRE TRUCK': 0.001,
+    'Flat Bed': 0.002, 'Tow Truck / Wrecker': 0.002, 'LIVERY VEHICLE': 0.004, 'UNKNOWN': 0.004,
+    'Moped': 0.003, 'Chassis Cab': 0.001, 'Motorscooter': 0.002,
+}
+# Share of crashes with 1, 2, 3, 4 and 5 vehicles
+VEHICLES_PER_CRASH = [0.22, 0.66, 0.09, 0.02, 0.01]
+
+# Per crash: mean persons injured, and the chance that one person was killed
+INJURY_RATE = 0.27
+DEATH_RATE = 0.0013
+# Who was hurt: pedestrians, cyclists, motorists
+VICTIM_SHARES = [0.20, 0.10, 0.70]
+
+
+def _choice(rng, table, size):
+    labels = np.array(list(table), dtype=object)
+    weights = np.array(list(table.values()), dtype='float64')
+    return labels[rng.choice(len(labels), size=size, p=weights / weights.sum())]
+
+
+def _day_weights(days):
+    weights = np.array(MONTH_WEIGHTS)[days.month - 1] * np.array(WEEKDAY_WEIGHTS)[days.dayofweek]
+    # Slow growth until 2019, the 2020 lockdown drop and a partial recovery
+    years = (days - days[0]).days.to_numpy() / 365.25
+    weights = weights * np.where(days < '2019-07-01', 1 + 0.02 * years, 1.1 - 0.05 * (years - 7))
+    weights = weights * np.where((days >= '2020-03-15') & (days < '2020-06-01'), 0.45, 1.0)
+    weights = weights * np.where(days >= '2020-06-01', 0.6, 1.0)
+    weights = np.clip(weights, 0.05, None)
+    return weights / weights.sum()
+
+
+def generate_raw(n, seed=0, first_id=4000000):
+    """Returns `n` crashes as the export's raw strings and numbers, in its column order."""
+    rng = np.random.default_rng(seed)
+    days = pd.date_range(FIRST_DAY, LAST_DAY, freq='D')
+    day_codes = rng.choice(len(days), size=n, p=_day_weights(days))
+    dates = np.array(days.strftime(DATE_FORMAT), dtype=object)[day_codes]
+
+    hours = rng.choice(24, size=n, p=np.array(HOUR_WEIGHTS) / sum(HOUR_WEIGHTS))
+    # Reported times bunch up on the hour
+    minutes = np.where(rng.random(n) < 0.15, 0, rng.integers(0, 60, n))
+    times = np.array(['%d:%02d' % (m // 60, m % 60) for m in range(1440)], dtype=object)[hours * 60 + minutes]
+
+    names = list(BOROUGHS)
+    shares = np.array([BOROUGHS[name][0] for name in names])
+    borough_codes = rng.choice(len(names), size=n, p=shares / shares.sum())
+    centers = np.array([BOROUGHS[name][1:4] for name in names])
+    latitude = centers[borough_codes, 0] + rng.normal(0, 1, n) * centers[borough_codes, 2]
+    longitude = centers[borough_codes, 1] + rng.normal(0, 1, n) * centers[borough_codes, 2] * 1.3
+    zip_codes = np.empty(n, dtype=object)
+    for code, name in enumerate(names):
+        rows = borough_codes == code
+        zip_codes[rows] = np.array(BOROUGHS[name][4], dtype=object)[rng.integers(0, len(BOROUGHS[name][4]), rows.sum())]
+    boroughs = np.array(names, dtype=object)[borough_codes]
+    no_borough = rng.random(n) < MISSING_BOROUGH
+    boroughs[no_borough] = None
+    zip_codes[no_borough] = None
+
+    draw = rng.random(n)
+    latitude[draw < ZERO_COORDINATES] = 0.0
+    longitude[draw < ZERO_COORDINATES] = 0.0
+    missing = draw > 1 - MISSING_COORDINATES
+    latitude, longitude = np.round(latitude, 6), np.round(longitude, 6)
+    latitude[missing] = np.nan
+    longitude[missing] = np.nan
+    location = ('(' + pd.Series(latitude).astype(str) + ', ' + pd.Series(longitude).astype(str) + ')').to_numpy()
+    location[missing] = None
+
+    streets = np.array(STREETS + [None], dtype=object)
+    on_street = streets[rng.integers(0, len(streets), n)]
+    cross_street = streets[rng.integers(0, len(streets), n)]
+    # Crashes away from an intersection have an off street name instead
+    off_street = np.where(rng.random(n) < 0.2, streets[rng.integers(0, len(STREETS), n)], None)
+    cross_street[off_street != None] = None  # noqa: E711
+
+    columns = {
+        'CRASH DATE': dates, 'CRASH TIME': times, 'BOROUGH': boroughs, 'ZIP CODE': zip_codes,
+        'LATITUDE': latitude, 'LONGITUDE': longitude, 'LOCATION': location,
+        'ON STREET NAME': on_street, 'CROSS STREET NAME': cross_street, 'OFF STREET NAME': off_street,
+    }
+
+    injured = rng.poisson(INJURY_RATE, n)
+    killed = (rng.random(n) < DEATH_RATE).astype('int64')
+    # Splits the injured among pedestrians, cyclists and motorists one share at a time
+    pedestrians = rng.binomial(injured, VICTIM_SHARES[0])
+    cyclists = rng.binomial(injured - pedestrians, VICTIM_SHARES[1] / (1 - VICTIM_SHARES[0]))
+    victims = np.stack([pedestrians, cyclists, injured - pedestrians - cyclists], axis=1)
+    killed_as = rng.choice(3, size=n, p=VICTIM_SHARES)
+    columns['NUMBER OF PERSONS INJURED'] = injured
+    columns['NUMBER OF PERSONS KILLED'] = killed
+    for slot, kind in enumerate(['PEDESTRIANS', 'CYCLIST', 'MOTORIST']):
+        columns['NUMBER OF %s INJURED' % kind] = victims[:, slot]
+        columns['NUMBER OF %s KILLED' % kind] = killed * (killed_as == slot)
+
+    vehicles = rng.choice(5, size=n, p=VEHICLES_PER_CRASH) + 1
+    for slot in range(5):
+        present = vehicles > slot
+        factor = _choice(rng, FACTORS, n)
+        vehicle = _choice(rng, VEHICLES, n)
+        factor[~present] = None
+        vehicle[~present] = None
+        columns[FACTOR_COLUMNS[slot]] = factor
+        columns[VEHICLE_COLUMNS[slot]] = vehicle
+    columns['COLLISION_ID'] = np.arange(first_id, first_id + n, dtype='int64')
+    return pd.DataFrame(columns)[EXPORT_COLUMNS]
+
+
+def generate(n, seed=0, first_id=4000000):
+    """Returns `n` synthetic crashes in the SCHEMA types, as load_crashes would."""
+    return apply_schema(generate_raw(n, seed, first_id))
+
+
+def write_csv(path, n, seed=0, chunksize=1000000):
+    """Writes `n` synthetic crashes to a CSV in chunks of `chunksize` rows; returns the path.
+
+    Chunk i is generated with seed `seed + i`, so for the same seed and chunksize the full
+    chunks of a smaller file are the first rows of every larger one: with the default
+    chunksize the 1M benchmark file is a prefix of the 10M one. A partial last chunk is
+    drawn differently. With n=0 only the header is written.
+    """
+    if n < 0:
+        raise ValueError('cannot write %d rows' % n)
+    tmp_path = path + '.tmp'
+    # range(0, 0) is empty, so a single empty chunk still writes the header
+    for start in range(0, n, chunksize) or [0]:
+        chunk = generate_raw(min(chunksize, n - start), seed=seed + start // chunksize, first_id=4000000 + start)
+        chunk.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic crash records in the export format.')
+    parser.add_argument('rows', type=int, help='number of crashes')
+    parser.add_argument('path', help='CSV file to write')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--chunksize', type=int, default=1000000, help='rows generated at a time (default: 1000000)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    write_csv(args.path, args.rows, args.seed, args.chunksize)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""Tiled severity map: every geocoded crash, clustered per zoom level and loaded by tile.
+
+The severity map in tdsp_maps holds all of its markers in the page, which only works for a
+sample. Here the crashes are clustered ahead of time for each zoom level in TILE_ZOOMS on
+the Web Mercator pixel grid the map itself uses: crashes of the same severity class that
+fall in the same CLUSTER_PIXELS square become one marker at their mean position, sized by
+the number of crashes and labelled with their totals. From STREET_ZOOM on, fatal crashes
+are not merged with their neighbours, so every fatality has a marker of its own.
+
+The clusters are written as one small file per 256-pixel tile,
+
+    severity_tiles.html
+    severity_tiles_files/<zoom>/<x>/<y>.js
+
+and the page loads only the tiles in view at the current zoom (the nearest of TILE_ZOOMS
+beyond them), dropping the others as the map moves. Each tile is a script that hands its
+columns to the page, rather than a JSON file, so the map also works when opened from disk
+without a web server.
+"""
+
+import json
+import os
+import shutil
+
+import folium
+import numpy as np
+import pandas as pd
+from branca.element import MacroElement
+from folium.elements import JSCSSMixin
+from folium.features import RegularPolygonMarker
+from jinja2 import Template
+
+from tdsp_maps import COORDINATE_PRECISION, NYC_CENTER, SEVERITY_STYLES, severity_classes
+from tdsp_profile import profiled
+from tdsp_spatial import valid_coordinates
+
+
+TILE_SIZE = 256
+TILE_ZOOMS = range(9, 17)
+STREET_ZOOM = 15
+
+# Side of the square, in screen pixels, whose crashes are merged into one marker; it must
+# divide TILE_SIZE so that no cluster straddles two tiles
+CLUSTER_PIXELS = 32
+
+SEVERITIES = list(SEVERITY_STYLES)
+
+TILE_COLUMNS = ['zoom', 'x', 'y', 'severity', 'LATITUDE', 'LONGITUDE', 'crashes', 'injured', 'killed']
+
+# Keys of the tile files and the cluster columns they hold: the page reads each tile as these lists
+PAYLOAD_COLUMNS = {'lat': 'LATITUDE', 'lon': 'LONGITUDE', 'severity': 'severity', 'crashes': 'crashes',
+                   'injured': 'injured', 'killed': 'killed'}
+
+_CELL_BITS = 25
+
+
+def tile_directory(path):
+    """Returns the directory the tiles of the map page at `path` are written to."""
+    return os.path.splitext(path)[0] + '_files'
+
+
+def mercator_pixels(latitude, longitude, zoom):
+    """Returns the x/y pixel position of each point on the whole Web Mercator map at `zoom`."""
+    scale = TILE_SIZE * 2.0 ** zoom
+    sin = np.sin(np.radians(latitude))
+    x = (longitude + 180.0) / 360.0 * scale
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)) * scale
+    return x, y
+
+
+def severity_codes(data):
+    """Returns the position in SEVERITIES of each crash's severity class."""
+    codes = np.empty(len(data), dtype='int64')
+    for code, mask in enumerate(severity_classes(data).values()):
+        codes[mask] = code
+    return codes
+
+
+def cluster_zoom(latitude, longitude, severity, injured, killed, zoom,
+                 street_zoom=STREET_ZOOM, cluster_pixels=CLUSTER_PIXELS):
+    """Clusters the crashes for one zoom level; returns one row per cluster (see TILE_COLUMNS)."""
+    x, y = mercator_pixels(latitude, longitude, zoom)
+    # Fatal crashes get 1-pixel cells from street zoom on: only crashes at the same spot share a marker
+    single = (severity == SEVERITIES.index('killed')) & (zoom >= street_zoom)
+    cell = np.where(single, 1, cluster_pixels)
+    keys = (severity << 2 * _CELL_BITS) | ((x // cell).astype('int64') << _CELL_BITS) | (y // cell).astype('int64')
+    keys, inverse = np.unique(keys, return_inverse=True)
+    crashes = np.bincount(inverse, minlength=len(keys))
+
+    cluster_severity = keys >> 2 * _CELL_BITS
+    cluster_cell = np.where((cluster_severity == SEVERITIES.index('killed')) & (zoom >= street_zoom), 1, cluster_pixels)
+    mask = (1 << _CELL_BITS) - 1
+    return pd.DataFrame({
+        'zoom': np.full(len(keys), zoom, dtype='int64'),
+        'x': ((keys >> _CELL_BITS) & mask) * cluster_cell // TILE_SIZE,
+        'y': (keys & mask) * cluster_cell // TILE_SIZE,
+        'severity': cluster_severity,
+        'LATITUDE': np.bincount(inverse, weights=latitude, minlength=len(keys)) / crashes,
+        'LONGITUDE': np.bincount(inverse, weights=longitude, minlength=len(keys)) / crashes,
+        'crashes': crashes,
+        'injured': np.bincount(inverse, weights=injured, minlength=len(keys)).astype('int64'),
+        'killed': np.bincount(inverse, weights=killed, minlength=len(keys)).astype('int64'),
+    }, columns=TILE_COLUMNS)
+
+
+@profiled()
+def cluster_tiles(data, zooms=TILE_ZOOMS, street_zoom=STREET_ZOOM, cluster_pixels=CLUSTER_PIXELS):
+    """Clusters every crash with valid coordinates for each zoom level in `zooms`.
+
+    Returns one row per cluster, ordered by tile and, within a tile, with fatal clusters
+    last so that they are drawn on top.
+    """
+    if TILE_SIZE % cluster_pixels:
+        raise ValueError('cluster_pixels must divide %d, not %r' % (TILE_SIZE, cluster_pixels))
+    latitude = data['LATITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+    longitude = data['LONGITUDE'].to_numpy(dtype='float64', na_value=np.nan)
+    valid = valid_coordinates(latitude, longitude)
+    latitude, longitude = latitude[valid], longitude[valid]
+    severity = severity_codes(data)[valid]
+    injured = data['NUMBER OF PERSONS INJURED'].to_numpy(dtype='int64', na_value=0)[valid]
+    killed = data['NUMBER OF PERSONS KILLED'].to_numpy(dtype='int64', na_value=0)[valid]
+
+    levels = [cluster_zoom(latitude, longitude, severity, injured, killed, zoom, street_zoom, cluster_pixels)
+              for zoom in zooms]
+    clusters = pd.concat(levels, ignore_index=True) if levels else pd.DataFrame(columns=TILE_COLUMNS)
+    clusters = clusters.sort_values(['zoom', 'x', 'y', 'severity'], ascending=[True, True, True, False],
+                                    kind='stable')
+    return clusters.reset_index(drop=True)
+
+
+@profiled()
+def write_tiles(clusters, directory):
+    """Writes one <zoom>/<x>/<y>.js file per non-empty tile, replacing any earlier tiles.
+
+    Returns the number of tiles written.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    tiles = clusters[['zoom', 'x', 'y']].to_numpy()
+    starts = np.flatnonzero(np.r_[True, (tiles[1:] != tiles[:-1]).any(axis=1)]) if len(tiles) else []
+    ends = np.r_[starts[1:], len(tiles)] if len(tiles) else []
+    # Converted to lists once; each tile is then a slice of every list
+    columns = {key: clusters[column].to_numpy() for key, column in PAYLOAD_COLUMNS.items()}
+    for key in ('lat', 'lon'):
+        columns[key] = columns[key].round(COORDINATE_PRECISION)
+    columns = {key: values.tolist() for key, values in columns.items()}
+    for start, end in zip(starts, ends):
+        zoom, x, y = (int(value) for value in tiles[start])
+        payload = {key: values[start:end] for key, values in columns.items()}
+        payload.update(z=zoom, x=x, y=y)
+        path = os.path.join(directory, str(zoom), str(x), '%d.js' % y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as handle:
+            handle.write('tdspTile(%s);\n' % json.dumps(payload, separators=(',', ':')))
+    return len(starts)
+
+
+class TiledSeverityLayer(JSCSSMixin, MacroElement):
+    """Loads the tiles in view from `url` and draws their clusters with the severity styles."""
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            (function () {
+                var map = {{ this._parent.get_name() }};
+                var options = {{ this.options|tojson }};
+                var layer = L.layerGroup().addTo(map);
+                var tiles = {};
+
+                function marker(tile, i) {
+                    var style = options.styles[tile.severity[i]];
+                    var crashes = tile.crashes[i];
+                    var markerOptions = {
+                        radius: options.radius + 2 * Math.log(crashes),
+                        color: style.color, fill: true, fillColor: style.color, fillOpacity: 0.7, weight: 1
+                    };
+                    var latlng = [tile.lat[i], tile.lon[i]];
+                    var shape;
+                    if (style.numberOfSides) {
+                        markerOptions.numberOfSides = style.numberOfSides;
+                        shape = new L.RegularPolygonMarker(latlng, markerOptions);
+                    } else {
+                        shape = L.circleMarker(latlng, markerOptions);
+                    }
+                    return shape.bindTooltip(crashes + (crashes === 1 ? ' crash, ' : ' crashes, ')
+                        + tile.injured[i] + ' injured, ' + tile.killed[i] + ' killed');
+                }
+
+                // Called by every tile script as it loads
+                window.tdspTile = function (tile) {
+                    var entry = tiles[tile.z + '/' + tile.x + '/' + tile.y];
+                    if (!entry || entry.group) { return; }
+                    entry.group = L.layerGroup(tile.crashes.map(function (crashes, i) {
+                        return marker(tile, i);
+                    })).addTo(layer);
+                };
+
+                function load(key) {
+                    var script = document.createElement('script');
+                    tiles[key] = {group: null};
+                    script.src = options.url + '/' + key + '.js';
+                    // Empty tiles are not written, so a missing file is expected
+                    script.onload = script.onerror = function () { script.remove(); };
+                    document.head.appendChild(script);
+                }
+
+                function update() {
+                    var zoom = Math.min(options.maxZoom, map.getZoom());
+                    var wanted = {};
+                    // Below the coarsest tiles a view covers far too many of them, so none are shown
+                    if (zoom >= options.minZoom) {
+                        var bounds = map.getBounds();
+                        var low = map.project(bounds.getNorthWest(), zoom).divideBy({{ this.tile_size }}).floor();
+                        var high = map.project(bounds.getSouthEast(), zoom).divideBy({{ this.tile_size }}).floor();
+                        for (var x = low.x; x <= high.x; x++) {
+                            for (var y = low.y; y <= high.y; y++) {
+                                var key = zoom + '/' + x + '/' + y;
+                                wanted[key] = true;
+                                if (!(key in tiles)) { load(key); }
+                            }
+                        }
+                    }
+                    Object.keys(tiles).forEach(function (key) {
+                        if (wanted[key]) { return; }
+                        if (tiles[key].group) { layer.removeLayer(tiles[key].group); }
+                        delete tiles[key];
+                    });
+                }
+
+                map.on('moveend', update);
+                update();
+            })();
+        {% endmacro %}
+    """)
+
+    default_js = RegularPolygonMarker.default_js
+
+    def __init__(self, url, min_zoom=min(TILE_ZOOMS), max_zoom=max(TILE_ZOOMS), radius=5):
+        super().__init__()
+        self._name = 'TiledSeverityLayer'
+        self.tile_size = TILE_SIZE
+        styles = [{'color': SEVERITY_STYLES[name]['color'], 'numberOfSides': SEVERITY_STYLES[name]['number_of_sides']}
+                  for name in SEVERITIES]
+        self.options = {'url': url, 'minZoom': min_zoom, 'maxZoom': max_zoom, 'radius': radius, 'styles': styles}
+
+
+def tiled_severity_map(url, min_zoom=min(TILE_ZOOMS), max_zoom=max(TILE_ZOOMS), zoom_start=10, radius=5):
+    """Builds the map page that loads its clusters from the tiles under `url`."""
+    m = folium.Map(location=NYC_CENTER, zoom_start=max(zoom_start, min_zoom), min_zoom=min_zoom, prefer_canvas=True)
+    TiledSeverityLayer(url, min_zoom, max_zoom, radius).add_to(m)
+    return m
+
+
+def save_tiled_map(clusters, path, zoom_start=10, radius=5):
+    """Writes the clusters from cluster_tiles as tiles next to `path` and the page to `path`."""
+    directory = tile_directory(path)
+    write_tiles(clusters, directory)
+    zooms = clusters['zoom'] if len(clusters) else pd.Series(list(TILE_ZOOMS))
+    m = tiled_severity_map(os.path.basename(directory), int(zooms.min()), int(zooms.max()), zoom_start, radius)
+    m.save(path)
+    return m
+
+
+def export_severity_tiles(data, path='severity_tiles.html', zoom_start=10, radius=5, **kwargs):
+    """Clusters every geocoded crash of `data` and writes the tiled severity map to `path`.
+
+    Keyword arguments are passed on to cluster_tiles.
+    """
+    return save_tiled_map(cluster_tiles(data, **kwargs), path, zoom_start, radius)
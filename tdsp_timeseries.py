@@ -0,0 +1,164 @@
+"""Daily, weekly and monthly crash series for every slice of a column, with STL decomposition.
+
+A single grouped pass per column (borough, primary factor, hour of day, ...) builds the
+daily counts of every slice at once; the weekly and monthly series are resampled from them.
+Each series is decomposed with STL, which unlike seasonal_decompose has no NaN edges, and
+the series are spread over a process pool. When new days arrive, only the tail of each
+series is refit.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from statsmodels.tsa.seasonal import STL
+
+
+# Granularity -> (resampling rule, seasonal period); the period is one year in each case
+GRANULARITIES = {
+    'daily': ('D', 365),
+    'weekly': ('W', 52),
+    'monthly': ('MS', 12),
+}
+
+DEFAULT_SLICES = ['BOROUGH', 'CONTRIBUTING FACTOR VEHICLE 1', 'Hour of Day']
+
+# Name of the slice holding the citywide total
+TOTAL = 'ALL'
+
+COMPONENTS = ['observed', 'trend', 'seasonal', 'resid']
+
+
+def daily_counts(data, column=None):
+    """Returns crashes per day with one column per value of `column` (or a single TOTAL column).
+
+    Days without crashes are filled with zero so every series is on the same daily index.
+    """
+    if column is None:
+        counts = data.groupby('CRASH DATE').size().to_frame(TOTAL)
+    else:
+        counts = data.groupby(['CRASH DATE', column], observed=True).size().unstack(fill_value=0)
+        counts.columns = counts.columns.astype(str)
+    if counts.empty:
+        return counts
+    index = pd.date_range(counts.index.min(), counts.index.max(), freq='D', name='CRASH DATE')
+    return counts.reindex(index, fill_value=0)
+
+
+def resample(daily, granularity):
+    rule, _ = GRANULARITIES[granularity]
+    return daily if rule == 'D' else daily.resample(rule).sum()
+
+
+def stl_components(series, period, robust=True):
+    """Decomposes one series with STL; returns None when it is shorter than two periods.
+
+    The trend and low-pass smoothers are evaluated at every period // 10-th point and
+    interpolated in between, which is about 30 times faster on a daily series with a yearly
+    period and changes the trend by well under one crash.
+    """
+    series = series.astype('float64')
+    if len(series) < 2 * period:
+        return None
+    jump = max(1, period // 10)
+    result = STL(series, period=period, robust=robust, trend_jump=jump, low_pass_jump=jump).fit()
+    return pd.DataFrame({
+        'observed': series,
+        'trend': result.trend,
+        'seasonal': result.seasonal,
+        'resid': result.resid,
+    })
+
+
+def _decompose_one(args):
+    name, series, period = args
+    return name, stl_components(series, period)
+
+
+def decompose_all(frame, period, workers=None):
+    """Decomposes every column of `frame`; returns {column: components or None}.
+
+    The columns are spread over `workers` processes; workers=1 runs them in this process.
+    """
+    jobs = [(name, frame[name], period) for name in frame.columns]
+    if workers == 1 or len(jobs) <= 1:
+        return dict(map(_decompose_one, jobs))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(_decompose_one, jobs, chunksize=max(1, len(jobs) // 32)))
+
+
+class TimeSeriesEngine:
+    """Crash series of every slice of `slices` at every granularity, with their decompositions.
+
+    engine.daily[column] is the daily frame for a column (None for the citywide total) and
+    engine.components[granularity][column][slice] the STL components of one series.
+    """
+
+    def __init__(self, slices=DEFAULT_SLICES, granularities=GRANULARITIES, workers=None, tail_periods=8):
+        self.slices = [None] + list(slices)
+        self.granularities = dict(granularities)
+        self.workers = workers
+        self.tail_periods = tail_periods
+        self.daily = {}
+        self.components = {granularity: {} for granularity in self.granularities}
+
+    def build(self, data):
+        """Builds and decomposes every series from scratch."""
+        self.daily = {column: daily_counts(data, column) for column in self.slices}
+        for granularity, (_, period) in self.granularities.items():
+            for column in self.slices:
+                frame = resample(self.daily[column], granularity)
+                self.components[granularity][column] = decompose_all(frame, period, self.workers)
+        return self
+
+    def series(self, column=None, granularity='daily'):
+        """Returns the frame of series for `column` (None for the total) at `granularity`."""
+        return resample(self.daily[column], granularity)
+
+    def update(self, data):
+        """Refreshes the series with every crash on the days present in `data`.
+
+        `data` must hold all crashes of those days, e.g. the months returned by
+        CrashStore.ingest loaded back with CrashStore.load(months). Each series is refit on
+        its last `tail_periods` seasonal periods only, and just the values from the first
+        refreshed day onward are replaced; earlier components are left as they were. STL
+        smooths the seasonal component over seven periods, so a window much shorter than the
+        default eight leaves the refit tail far from what a full build would give.
+        """
+        if data.empty:
+            return self
+        start = data['CRASH DATE'].min()
+        for column in self.slices:
+            fresh = daily_counts(data, column)
+            current = self.daily.get(column)
+            if current is None or current.empty:
+                self.daily[column] = fresh
+                continue
+            kept = current[current.index < start]
+            combined = pd.concat([kept, fresh]).fillna(0).astype('int64')
+            index = pd.date_range(combined.index.min(), combined.index.max(), freq='D', name='CRASH DATE')
+            self.daily[column] = combined.reindex(index, fill_value=0)
+
+        for granularity, (_, period) in self.granularities.items():
+            for column in self.slices:
+                self._refit_tail(granularity, column, period, start)
+        return self
+
+    def _refit_tail(self, granularity, column, period, start):
+        frame = resample(self.daily[column], granularity)
+        if frame.empty:
+            return
+        # Label of the (possibly partial) bucket holding the first refreshed day
+        rule, _ = self.granularities[granularity]
+        first = pd.Series([0], index=[start]).resample(rule).sum().index[0]
+        # The window covers the last `tail_periods` periods and at least one period before `first`
+        position = frame.index.searchsorted(first)
+        begin = max(0, min(position - period, len(frame) - self.tail_periods * period))
+        fitted = decompose_all(frame.iloc[begin:], period, self.workers)
+
+        existing = self.components[granularity].setdefault(column, {})
+        for name, components in fitted.items():
+            previous = existing.get(name)
+            if components is None or previous is None:
+                existing[name] = stl_components(frame[name], period)
+            else:
+                existing[name] = pd.concat([previous[previous.index < first], components[components.index >= first]])
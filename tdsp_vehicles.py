@@ -0,0 +1,201 @@
+"""Per-vehicle counts over all five VEHICLE TYPE CODE / CONTRIBUTING FACTOR VEHICLE slots.
+
+A crash has up to five vehicles, each with its type and contributing factor in the columns
+numbered 1-5. Instead of melting those columns into a long frame (five rows per crash, with
+the labels repeated), each chunk of crashes is turned into an (n, 5) array of integer codes
+per kind, and everything is counted from those arrays with bincount and sparse matrices:
+
+* vehicle types and factors, per vehicle or per crash (a type counted once per crash);
+* vehicle-type pairs that crash together;
+* factor x vehicle type, pairing each vehicle's factor with its own type.
+
+Crashes are processed `chunksize` rows at a time and the counts are merged, so memory stays
+bounded however large the data; the same accumulator also runs over the CSV in chunks.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from tdsp_categories import load_normalizers, normalize_categories
+from tdsp_data import DATA_PATH, FACTOR_COLUMNS, VEHICLE_COLUMNS, map_categories, read_crashes_csv
+from tdsp_stream import DEFAULT_CHUNKSIZE
+
+
+SLOT_PAIRS = list(itertools.combinations(range(len(VEHICLE_COLUMNS)), 2))
+
+
+def slot_ids(chunk, columns, vocabulary):
+    """Returns an (n, slots) int32 array of ids per label, growing `vocabulary` ({label: id}).
+
+    Only the categories of each column are looked up; -1 marks an empty slot.
+    """
+    ids = np.full((len(chunk), len(columns)), -1, dtype='int32')
+    for slot, column in enumerate(columns):
+        if column not in chunk:
+            continue
+        ids[:, slot] = map_categories(chunk[column], lambda label: vocabulary.setdefault(label, len(vocabulary)),
+                                      -1, 'int32')
+    return ids
+
+
+def distinct_per_row(keys):
+    """Returns the keys of each row with repeats within the row and -1 entries dropped."""
+    keys = np.sort(keys, axis=1)
+    keep = keys >= 0
+    keep[:, 1:] &= keys[:, 1:] != keys[:, :-1]
+    return keys[keep]
+
+
+def _pair_counts(rows, columns, shape):
+    keys = rows.astype('int64') * shape[1] + columns
+    keys, counts = np.unique(keys, return_counts=True)
+    return sparse.csr_matrix((counts, (keys // shape[1], keys % shape[1])), shape=shape, dtype='int64')
+
+
+def _grow(counts, size):
+    return np.concatenate([counts, np.zeros(size - len(counts), dtype='int64')]) if len(counts) < size else counts
+
+
+def _resize(matrix, shape):
+    matrix = matrix.copy()
+    matrix.resize(shape)
+    return matrix
+
+
+class VehicleCounts:
+    """Mergeable per-vehicle counts of types, factors and their co-occurrence.
+
+    Labels are given ids in the order they are first seen; the counts are kept per id and
+    matched back to labels in the result methods.
+    """
+
+    def __init__(self):
+        self.crashes = 0
+        self.vehicles = {}
+        self.factors = {}
+        self.type_vehicles = np.zeros(0, dtype='int64')
+        self.type_crashes = np.zeros(0, dtype='int64')
+        self.factor_vehicles = np.zeros(0, dtype='int64')
+        self.factor_crashes = np.zeros(0, dtype='int64')
+        # Upper-triangular vehicle type x vehicle type, and factor x vehicle type
+        self.pairs = sparse.csr_matrix((0, 0), dtype='int64')
+        self.factor_type = sparse.csr_matrix((0, 0), dtype='int64')
+
+    def update(self, chunk):
+        types = slot_ids(chunk, VEHICLE_COLUMNS, self.vehicles)
+        factors = slot_ids(chunk, FACTOR_COLUMNS, self.factors)
+        self._add(types, factors)
+        self.crashes += len(chunk)
+
+    def _add(self, types, factors):
+        size_v, size_f = len(self.vehicles), len(self.factors)
+        self.type_vehicles = _grow(self.type_vehicles, size_v) + np.bincount(types[types >= 0], minlength=size_v)
+        self.type_crashes = _grow(self.type_crashes, size_v) + np.bincount(distinct_per_row(types), minlength=size_v)
+        self.factor_vehicles = _grow(self.factor_vehicles, size_f) + np.bincount(factors[factors >= 0], minlength=size_f)
+        self.factor_crashes = _grow(self.factor_crashes, size_f) + np.bincount(distinct_per_row(factors),
+                                                                               minlength=size_f)
+
+        # Each unordered pair of types is counted once per crash, a type with itself included
+        low = np.stack([np.minimum(types[:, i], types[:, j]) for i, j in SLOT_PAIRS], axis=1)
+        high = np.stack([np.maximum(types[:, i], types[:, j]) for i, j in SLOT_PAIRS], axis=1)
+        keys = np.where(low >= 0, low.astype('int64') * max(size_v, 1) + high, -1)
+        keys = distinct_per_row(keys)
+        pairs = _pair_counts(keys // max(size_v, 1), keys % max(size_v, 1), (size_v, size_v))
+        self.pairs = _resize(self.pairs, (size_v, size_v)) + pairs
+
+        both = (factors >= 0) & (types >= 0)
+        factor_type = _pair_counts(factors[both], types[both], (size_f, size_v))
+        self.factor_type = _resize(self.factor_type, (size_f, size_v)) + factor_type
+
+    def merge(self, other):
+        """Adds the counts of another VehicleCounts, whose ids may differ from these."""
+        vehicle_ids = np.array([self.vehicles.setdefault(label, len(self.vehicles)) for label in other.vehicles],
+                               dtype='int64')
+        factor_ids = np.array([self.factors.setdefault(label, len(self.factors)) for label in other.factors],
+                              dtype='int64')
+        size_v, size_f = len(self.vehicles), len(self.factors)
+        for name, ids, size in (('type_vehicles', vehicle_ids, size_v), ('type_crashes', vehicle_ids, size_v),
+                                ('factor_vehicles', factor_ids, size_f), ('factor_crashes', factor_ids, size_f)):
+            counts = _grow(getattr(self, name), size)
+            np.add.at(counts, ids, getattr(other, name))
+            setattr(self, name, counts)
+
+        pairs = other.pairs.tocoo()
+        low, high = vehicle_ids[pairs.row], vehicle_ids[pairs.col]
+        pairs = sparse.csr_matrix((pairs.data, (np.minimum(low, high), np.maximum(low, high))), shape=(size_v, size_v))
+        self.pairs = _resize(self.pairs, (size_v, size_v)) + pairs
+        factor_type = other.factor_type.tocoo()
+        factor_type = sparse.csr_matrix((factor_type.data, (factor_ids[factor_type.row], vehicle_ids[factor_type.col])),
+                                        shape=(size_f, size_v))
+        self.factor_type = _resize(self.factor_type, (size_f, size_v)) + factor_type
+        self.crashes += other.crashes
+        return self
+
+    @staticmethod
+    def _labels(vocabulary):
+        return np.array(list(vocabulary), dtype=object)
+
+    def _counts(self, vocabulary, counts, name):
+        counts = pd.Series(counts, index=pd.Index(self._labels(vocabulary), name=name), name='count')
+        return counts[counts > 0].sort_index().sort_values(ascending=False, kind='stable')
+
+    def type_counts(self, per='vehicle'):
+        """Vehicle types counted for every vehicle (per='vehicle') or once per crash (per='crash')."""
+        counts = self.type_vehicles if per == 'vehicle' else self.type_crashes
+        return self._counts(self.vehicles, counts, 'VEHICLE TYPE')
+
+    def factor_counts(self, per='vehicle'):
+        """Contributing factors counted for every vehicle (per='vehicle') or once per crash (per='crash')."""
+        counts = self.factor_vehicles if per == 'vehicle' else self.factor_crashes
+        return self._counts(self.factors, counts, 'CONTRIBUTING FACTOR')
+
+    def vehicle_pairs(self, n=None):
+        """Returns the pairs of vehicle types that crash together, with the number of crashes."""
+        pairs = self.pairs.tocoo()
+        labels = self._labels(self.vehicles)
+        table = pd.DataFrame({'VEHICLE TYPE A': labels[pairs.row], 'VEHICLE TYPE B': labels[pairs.col],
+                              'crashes': pairs.data})
+        table = table[table['crashes'] > 0].sort_values(['crashes', 'VEHICLE TYPE A', 'VEHICLE TYPE B'],
+                                                        ascending=[False, True, True], ignore_index=True)
+        return table if n is None else table.head(n)
+
+    def factor_by_type(self, n=None):
+        """Returns (factor, vehicle type) pairs with the number of vehicles they were recorded for."""
+        counts = self.factor_type.tocoo()
+        table = pd.DataFrame({'CONTRIBUTING FACTOR': self._labels(self.factors)[counts.row],
+                              'VEHICLE TYPE': self._labels(self.vehicles)[counts.col], 'vehicles': counts.data})
+        table = table[table['vehicles'] > 0].sort_values(['vehicles', 'CONTRIBUTING FACTOR', 'VEHICLE TYPE'],
+                                                         ascending=[False, True, True], ignore_index=True)
+        return table if n is None else table.head(n)
+
+    def factor_type_table(self, factors=10, types=10):
+        """Returns the factor x vehicle type table for the most frequent factors and types."""
+        top_factors = self.factor_counts().index[:factors]
+        top_types = self.type_counts().index[:types]
+        rows = [self.factors[label] for label in top_factors]
+        columns = [self.vehicles[label] for label in top_types]
+        return pd.DataFrame(self.factor_type[rows][:, columns].toarray(), index=top_factors, columns=top_types)
+
+
+def vehicle_counts(data, chunksize=DEFAULT_CHUNKSIZE):
+    """Counts a DataFrame that is already in memory, `chunksize` rows at a time."""
+    counts = VehicleCounts()
+    for start in range(0, len(data), chunksize):
+        counts.update(data.iloc[start:start + chunksize])
+    return counts
+
+
+def stream_vehicle_counts(path=DATA_PATH, chunksize=DEFAULT_CHUNKSIZE, mapping=None):
+    """Reads only the vehicle and factor columns of the CSV in chunks and counts them.
+
+    Each chunk is normalized with the category mapping at `mapping` (see
+    tdsp_categories.mapping_path); the mapping file itself is not changed.
+    """
+    normalizers = load_normalizers(mapping)
+    counts = VehicleCounts()
+    for chunk in read_crashes_csv(path, usecols=VEHICLE_COLUMNS + FACTOR_COLUMNS, chunksize=chunksize):
+        counts.update(normalize_categories(chunk, normalizers=normalizers))
+    return counts
@@ -0,0 +1,46 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from tdsp_anomaly import CrashMonitor, SeasonalZScore
+
+
+def monthly_counts(years=10, seed=0):
+    # A steady level with a January/February low, plus Poisson noise
+    months = pd.date_range('2013-01-01', periods=12 * years, freq='MS')
+    season = np.array([0.85, 0.78, 1.0, 1.0, 1.05, 1.08, 1.05, 1.05, 1.05, 1.05, 1.0, 1.0])[months.month - 1]
+    counts = np.random.default_rng(seed).poisson(9000 * season * months.days_in_month / 30)
+    return pd.Series(counts, index=months)
+
+
+def scores(counts, detector):
+    results = [detector.update(float(value), date.days_in_month) for date, value in counts.items()]
+    return [result[2] for result in results if result is not None]
+
+
+def test_seasonal_lows_are_not_outliers():
+    detector = SeasonalZScore()
+    assert max(abs(score) for score in scores(monthly_counts(), detector)) < detector.threshold
+
+
+def test_seasonal_outlier_is_flagged():
+    counts = monthly_counts()
+    counts.iloc[100] = counts.iloc[100] // 2
+    detector = SeasonalZScore()
+    flagged = [abs(score) >= detector.threshold for score in scores(counts, detector)]
+    assert sum(flagged) == 1
+
+
+def test_monitor_state_round_trip():
+    dates = np.repeat(pd.date_range('2015-01-01', '2019-12-31'), 20)
+    data = pd.DataFrame({'CRASH DATE': dates, 'BOROUGH': pd.Categorical(['QUEENS'] * len(dates))})
+    split = data['CRASH DATE'] < '2018-01-01'
+    resumed = CrashMonitor()
+    resumed.update(data[split])
+    resumed = CrashMonitor.from_state(json.loads(json.dumps(resumed.state())))
+    fresh = CrashMonitor()
+    expected = fresh.update(data)
+    expected = expected[expected['date'] >= '2018-01-01'].reset_index(drop=True)
+    pd.testing.assert_frame_equal(resumed.update(data).reset_index(drop=True), expected)
+    assert resumed.state() == fresh.state()
@@ -0,0 +1,69 @@
+import json
+
+import pandas as pd
+import pytest
+
+from tdsp_categories import (VEHICLE_ALIASES, CategoryNormalizer, load_normalizers, normalize_categories,
+                             save_normalizers)
+
+
+def learned(raw_values, min_count=100):
+    counts = pd.Series(1, index=raw_values)
+    return CategoryNormalizer(VEHICLE_ALIASES, min_count=min_count).learn(counts).mapping
+
+
+@pytest.mark.parametrize('raw, canonical', [
+    ('TAXI ', 'Taxi'),
+    ('Sport Utility / Station Wagon', 'Station Wagon/Sport Utility Vehicle'),
+    ('AMBUL', 'Ambulance'),
+    ('UNKNO', 'Unknown'),
+    ('Sedn', 'Sedan'),
+    ('Motorcyle', 'Motorcycle'),
+])
+def test_variants_join_their_category(raw, canonical):
+    assert learned([raw])[raw] == canonical
+
+
+@pytest.mark.parametrize('raw, wrong', [
+    ('Scooter', 'E-Scooter'),
+    ('Motor', 'Motorcycle'),
+    ('Station', 'Station Wagon/Sport Utility Vehicle'),
+    ('E-Bik', 'Bike'),
+])
+def test_distinct_vehicles_are_not_merged(raw, wrong):
+    assert learned([raw])[raw] != wrong
+
+
+def test_blank_values_map_to_none():
+    assert learned(['  '])['  '] is None
+
+
+def test_mapping_round_trip(tmp_path):
+    path = str(tmp_path / 'categories.json')
+    data = pd.DataFrame({'VEHICLE TYPE CODE 1': ['TAXI', 'Scooter', None], 'VEHICLE TYPE CODE 2': ['AMBUL', None, None]})
+    normalizers = load_normalizers(path)
+    normalize_categories(data.copy(), normalizers=normalizers)
+    save_normalizers(normalizers, path)
+    assert load_normalizers(path)['vehicle'].mapping == normalizers['vehicle'].mapping
+
+
+def test_mapping_of_older_rules_is_relearned(tmp_path):
+    path = str(tmp_path / 'categories.json')
+    with open(path, 'w') as handle:
+        json.dump({'vehicle': {'mapping': {'Scooter': 'E-Scooter'}, 'canonical': {}}}, handle)
+    assert 'Scooter' not in load_normalizers(path)['vehicle'].mapping
+
+
+@pytest.mark.parametrize('columns', [
+    ['VEHICLE TYPE CODE 1', 'VEHICLE TYPE CODE 2'],
+    ['VEHICLE TYPE CODE 2', 'VEHICLE TYPE CODE 1'],
+])
+def test_min_count_is_summed_over_columns(columns):
+    # 'Zambonis' is rare in each column but frequent over both, so it is a category of its own
+    first = ['Zamboni'] * 150 + ['Zambonis'] * 60
+    second = ['Zambonis'] * 60 + [None] * 150
+    data = pd.DataFrame({columns[0]: pd.Categorical(first), columns[1]: pd.Categorical(second)})
+    normalizers = load_normalizers(min_count=100)
+    normalize_categories(data, normalizers=normalizers)
+    assert normalizers['vehicle'].mapping['Zambonis'] == 'Zambonis'
+    assert (data == 'Zambonis').sum().sum() == 120
@@ -0,0 +1,65 @@
+import pandas as pd
+import pytest
+
+from tdsp_cube import MEASURES, CrashCube
+from tdsp_data import COUNT_COLUMNS
+from tdsp_synthetic import generate
+from tdsp_time import crash_hours
+
+
+@pytest.fixture(scope='module')
+def data():
+    return generate(5000, seed=11)
+
+
+@pytest.fixture(scope='module')
+def cube(data):
+    return CrashCube.build(data)
+
+
+def raw_counts(data, by, keep=None):
+    """Sums the measures straight from the crash rows, without the cube."""
+    rows = pd.DataFrame({name: values.to_numpy() for name, values in by.items()})
+    rows['crashes'] = 1
+    for column in COUNT_COLUMNS:
+        rows[column] = data[column].fillna(0).astype('int64').to_numpy()
+    if keep is not None:
+        rows = rows[keep.to_numpy()]
+    return rows.groupby(list(by), dropna=False)[MEASURES].sum()
+
+
+def comparable(counts):
+    counts = counts.reset_index()
+    columns = list(counts.columns)
+    counts = counts.astype({column: object for column in columns if column not in MEASURES})
+    return counts.sort_values(columns[:-len(MEASURES)], key=lambda values: values.astype(str)).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('by', [['hour'], ['borough', 'vehicle'], ['month', 'borough']])
+def test_rollups_match_the_raw_rows(data, cube, by):
+    columns = {
+        'hour': pd.Series(crash_hours(data['CRASH TIME'])),
+        'borough': data['BOROUGH'],
+        'vehicle': data['VEHICLE TYPE CODE 1'],
+        'month': data['CRASH DATE'].dt.to_period('M'),
+    }
+    expected = raw_counts(data, {dim: columns[dim] for dim in by})
+    pd.testing.assert_frame_equal(comparable(cube.query(by=by)), comparable(expected), check_dtype=False)
+
+
+def test_filtered_query_matches_the_raw_rows(data, cube):
+    keep = data['BOROUGH'].isin(['BROOKLYN', 'QUEENS']) & (data['CRASH DATE'].dt.dayofweek >= 5)
+    expected = raw_counts(data, {'hour': pd.Series(crash_hours(data['CRASH TIME']))}, keep)
+    actual = cube.query(by=['hour'], where={'borough': ['BROOKLYN', 'QUEENS'], 'weekday': [5, 6]})
+    pd.testing.assert_frame_equal(comparable(actual), comparable(expected), check_dtype=False)
+    totals = cube.query(where={'borough': 'BROOKLYN'})
+    assert totals['crashes'] == (data['BOROUGH'] == 'BROOKLYN').sum()
+
+
+def test_save_and_load(cube, tmp_path):
+    path = str(tmp_path / 'cube.parquet')
+    cube.save(path)
+    loaded = CrashCube.load(path)
+    pd.testing.assert_frame_equal(loaded.base, cube.base, check_categorical=False)
+    for by in [['month', 'borough'], ['hour', 'weekday', 'borough']]:
+        pd.testing.assert_frame_equal(comparable(loaded.query(by=by)), comparable(cube.query(by=by)), check_dtype=False)
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tdsp_intersections import CrashIndex, normalize_street
+
+
+@pytest.mark.parametrize('raw, normalized', [
+    ('ST NICHOLAS AVENUE', 'ST NICHOLAS AVENUE'),
+    ('DR MARTIN LUTHER KING JR BLVD', 'DR MARTIN LUTHER KING JR BOULEVARD'),
+    ('E 14th St.', 'EAST 14 STREET'),
+    ('AVENUE S', 'AVENUE S'),
+    ('W  ST', 'WEST STREET'),
+    (' ', ''),
+])
+def test_normalize_street(raw, normalized):
+    assert normalize_street(raw) == normalized
+
+
+@pytest.fixture
+def crashes():
+    return pd.DataFrame({
+        'LATITUDE': [40.7500, 40.7502, 40.7600, np.nan, 0.0],
+        'LONGITUDE': [-73.9900, -73.9901, -73.9900, -73.9900, 0.0],
+        'NUMBER OF PERSONS INJURED': [1, 0, 2, 0, 0],
+        'NUMBER OF PERSONS KILLED': [0, 0, 1, 0, 0],
+    })
+
+
+def test_within_finds_nearby_crashes(crashes):
+    index = CrashIndex(crashes)
+    assert list(index.within(40.7501, -73.9900, 50)) == [0, 1]
+    assert list(index.crashes_within(40.7600, -73.9900, 50).index) == [2]
+
+
+def test_within_an_empty_neighbourhood(crashes):
+    index = CrashIndex(crashes)
+    found = index.within(40.6000, -73.8000, 50)
+    assert len(found) == 0 and found.dtype.kind == 'i'
+    assert index.crashes_within(40.6000, -73.8000, 50).empty
@@ -0,0 +1,32 @@
+import pytest
+
+from tdsp_data import read_crashes_csv
+from tdsp_profile import PROFILER, stage
+from tdsp_synthetic import write_csv
+
+
+@pytest.fixture
+def profiler():
+    PROFILER.reset(enabled=True)
+    yield PROFILER
+    PROFILER.reset()
+
+
+def test_chunked_read_is_timed_per_chunk(profiler, tmp_path):
+    path = write_csv(str(tmp_path / 'crashes.csv'), 2500)
+    with stage('consume'):
+        chunks = [len(chunk) for chunk in read_crashes_csv(path, chunksize=1000)]
+    assert chunks == [1000, 1000, 500]
+
+    reads = [record for record in profiler.records if record['name'] == 'read_crashes_csv']
+    assert {record['path'] for record in reads} == {'consume;read_crashes_csv'}
+    # Opening the reader, one call per chunk, and the call that finds the end of the file
+    assert [record['rows'] for record in reads] == [None, 1000, 1000, 500, None]
+    consume = next(record for record in profiler.records if record['name'] == 'consume')
+    assert 0 < sum(record['wall_seconds'] for record in reads) <= consume['wall_seconds']
+
+
+def test_whole_read_is_one_call(profiler, tmp_path):
+    path = write_csv(str(tmp_path / 'crashes.csv'), 300)
+    read_crashes_csv(path)
+    assert [record['rows'] for record in profiler.records if record['name'] == 'read_crashes_csv'] == [300]
@@ -0,0 +1,34 @@
+import pandas as pd
+
+from tdsp_categories import load_normalizers, mapping_path, save_normalizers
+from tdsp_rates import cached_counts, rates_cache_path
+
+
+def write_export(path):
+    pd.DataFrame({
+        'CRASH DATE': ['01/05/2020', '01/06/2020', '01/07/2020'],
+        'BOROUGH': ['BROOKLYN', 'QUEENS', 'QUEENS'],
+        'NUMBER OF PERSONS INJURED': [1, 0, 2],
+        'NUMBER OF PERSONS KILLED': [0, 0, 0],
+        'COLLISION_ID': [1, 2, 3],
+        'VEHICLE TYPE CODE 1': ['Sedan', 'Zamboni', 'Zamboni'],
+    }).to_csv(path, index=False)
+
+
+def test_cached_counts_follow_the_category_mapping(tmp_path):
+    path = str(tmp_path / 'crashes.csv')
+    write_export(path)
+    cache_dir = str(tmp_path / 'cache')
+    by = 'VEHICLE TYPE CODE 1'
+    before = cached_counts(path, by, cache_dir)
+    assert list(before[by]) == ['sedan', 'zamboni']
+
+    normalizers = load_normalizers(mapping_path(path))
+    normalizers['vehicle'].mapping['Zamboni'] = 'Sedan'
+    save_normalizers(normalizers, mapping_path(path))
+    after = cached_counts(path, by, cache_dir)
+    assert list(after[by]) == ['sedan']
+    assert list(after['crashes']) == [3]
+
+    # Counts not grouped by a normalized column do not depend on the mapping
+    assert rates_cache_path(path, 'BOROUGH', cache_dir).endswith('-borough-r1.parquet')
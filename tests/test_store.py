@@ -0,0 +1,128 @@
+import os
+
+import pandas as pd
+import pytest
+
+import tdsp_store
+from tdsp_data import read_crashes_csv, write_parquet
+from tdsp_sources import MockSodaServer, SodaSource, incremental_since
+from tdsp_store import UNKNOWN_MONTH, CrashStore
+from tdsp_synthetic import generate_raw
+
+
+ROWS = 3000
+
+
+def sorted_crashes(data):
+    data = data.sort_values('COLLISION_ID', kind='stable').reset_index(drop=True)
+    # Categories depend on which values each frame happened to see, so values are compared as objects
+    return data.astype({column: object for column in data if isinstance(data[column].dtype, pd.CategoricalDtype)})
+
+
+def assert_same_crashes(actual, expected):
+    pd.testing.assert_frame_equal(sorted_crashes(actual), sorted_crashes(expected[list(actual.columns)]))
+
+
+@pytest.fixture(scope='module')
+def raw():
+    return generate_raw(ROWS, seed=5)
+
+
+@pytest.fixture(scope='module')
+def export_path(raw, tmp_path_factory):
+    path = tmp_path_factory.mktemp('export') / 'crashes.csv'
+    raw.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def data(export_path):
+    return read_crashes_csv(export_path)
+
+
+def test_pull_retries_failed_pages(data, tmp_path):
+    store = CrashStore(str(tmp_path))
+    with MockSodaServer(data, fail_every=3) as server:
+        source = SodaSource(server.url, page_size=250, workers=4, backoff=0.01)
+        months = store.pull(source)
+        assert server.requests > ROWS // 250
+    assert months == store.months()
+    assert_same_crashes(store.load(), data)
+
+
+def test_incremental_pull_rewrites_nothing(data, tmp_path):
+    store = CrashStore(str(tmp_path))
+    with MockSodaServer(data) as server:
+        source = SodaSource(server.url, page_size=500, workers=2)
+        store.pull(source)
+        since = incremental_since(store)
+        assert since == data['CRASH DATE'].max() - pd.Timedelta(days=30)
+        assert store.pull(source, since=since) == []
+    assert_same_crashes(store.load(), data)
+
+
+def test_refresh_writes_only_changed_months(raw, export_path, data, tmp_path):
+    store = CrashStore(str(tmp_path / 'store'))
+    assert store.refresh(export_path, chunksize=700) == store.months()
+
+    updated = raw.copy()
+    dates = read_crashes_csv(export_path)['CRASH DATE']
+    months = dates.dt.strftime('%Y-%m')
+    changed, moved, duplicated = 10, 20, 30
+    updated.loc[changed, 'NUMBER OF PERSONS INJURED'] += 1
+    # Moved to a month none of the other records are in
+    updated.loc[moved, 'CRASH DATE'] = '06/15/2012'
+    # A later copy of a record overrides the earlier one
+    duplicate = updated.loc[[duplicated]].assign(**{'NUMBER OF PERSONS KILLED': 2})
+    updated = pd.concat([updated, duplicate], ignore_index=True)
+    path = str(tmp_path / 'updated.csv')
+    updated.to_csv(path, index=False)
+
+    rewritten = store.refresh(path, chunksize=700)
+    assert rewritten == sorted({months[changed], months[moved], '2012-06', months[duplicated]})
+    expected = read_crashes_csv(path).drop_duplicates('COLLISION_ID', keep='last')
+    assert_same_crashes(store.load(), expected)
+    assert store.refresh(path, chunksize=700) == []
+
+
+def test_records_without_a_date_are_kept_apart(raw, tmp_path):
+    dated = raw.iloc[:200].copy()
+    undated = dated.copy()
+    undated.loc[5, 'CRASH DATE'] = None
+    path = str(tmp_path / 'undated.csv')
+    undated.to_csv(path, index=False)
+    store = CrashStore(str(tmp_path / 'store'))
+
+    assert store.refresh(path)[-1] == UNKNOWN_MONTH
+    assert list(store.load([UNKNOWN_MONTH])['COLLISION_ID']) == [dated.loc[5, 'COLLISION_ID']]
+    assert_same_crashes(store.load(), read_crashes_csv(path))
+    assert incremental_since(store) == read_crashes_csv(path)['CRASH DATE'].max() - pd.Timedelta(days=30)
+
+    # Once the record gets its date it moves out of the unknown partition
+    dated.to_csv(path, index=False)
+    month = read_crashes_csv(path)['CRASH DATE'].dt.strftime('%Y-%m')[5]
+    assert store.refresh(path) == sorted([month, UNKNOWN_MONTH])
+    assert UNKNOWN_MONTH not in store.months()
+    assert_same_crashes(store.load(), read_crashes_csv(path))
+
+
+def test_pull_writes_each_month_once(data, tmp_path, monkeypatch):
+    writes = []
+
+    def counted(frame, path):
+        writes.append(path)
+        write_parquet(frame, path)
+
+    monkeypatch.setattr(tdsp_store, 'write_parquet', counted)
+    store = CrashStore(str(tmp_path))
+    with MockSodaServer(data) as server:
+        source = SodaSource(server.url, page_size=250, workers=2)
+        months = store.pull(source)
+        partitions = [path for path in writes if os.path.dirname(path) == store.partition_dir]
+        assert sorted(partitions) == [store.partition_path(month) for month in months]
+        assert writes.count(store.index_path) == 1
+
+        writes.clear()
+        assert store.pull(source) == []
+        assert writes == []
+    assert_same_crashes(store.load(), data)
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tdsp_data import COUNT_COLUMNS, read_crashes_csv
+from tdsp_stream import MOMENT_COLUMNS, exact_sum_of_squares, stream_summary, summarize
+from tdsp_synthetic import generate_raw
+
+
+# Enough rows with export-sized COLLISION_IDs (4-5 million) for their squares to overflow int64
+ROWS = 600000
+
+
+@pytest.fixture(scope='module')
+def export_path(tmp_path_factory):
+    path = tmp_path_factory.mktemp('stream') / 'crashes.csv'
+    columns = ['CRASH DATE', 'CRASH TIME', 'BOROUGH'] + MOMENT_COLUMNS
+    generate_raw(ROWS, seed=3)[columns].to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.fixture(scope='module')
+def data(export_path):
+    return read_crashes_csv(export_path)
+
+
+def test_exact_sum_of_squares():
+    for values in [np.arange(4000000, 4600000), np.array([7]), np.array([-5, 2 ** 40, 3]), np.zeros(0)]:
+        values = values.astype('int64')
+        assert exact_sum_of_squares(values) == sum(int(value) ** 2 for value in values)
+
+
+def test_moments_match_describe(data):
+    moments = summarize(data).moments.result()
+    columns = ['LATITUDE', 'LONGITUDE', 'COLLISION_ID'] + COUNT_COLUMNS
+    expected = data[columns].astype('float64').describe().loc[['count', 'mean', 'std', 'min', 'max']]
+    assert not moments['COLLISION_ID'].isna().any()
+    pd.testing.assert_frame_equal(moments[columns], expected, rtol=1e-9)
+
+
+@pytest.mark.parametrize('chunksize', [7919, 100000, ROWS])
+def test_stream_summary_matches_in_memory(export_path, data, chunksize):
+    streamed = stream_summary(export_path, chunksize=chunksize)
+    in_memory = summarize(data)
+    integer_columns = ['COLLISION_ID'] + COUNT_COLUMNS
+    # Integer columns are summed exactly, so the chunking must not change them at all
+    pd.testing.assert_frame_equal(streamed.moments.result()[integer_columns],
+                                  in_memory.moments.result()[integer_columns], rtol=0, atol=0)
+    # Float moments are merged with Chan's update, so they only agree up to rounding
+    pd.testing.assert_frame_equal(streamed.moments.result(), in_memory.moments.result(), rtol=1e-9)
+    pd.testing.assert_series_equal(streamed.time.daily_counts(), in_memory.time.daily_counts(), check_freq=False)
+    pd.testing.assert_series_equal(streamed.categories.result('BOROUGH'), in_memory.categories.result('BOROUGH'))
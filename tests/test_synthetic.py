@@ -0,0 +1,18 @@
+import pandas as pd
+
+from tdsp_data import read_crashes_csv
+from tdsp_synthetic import EXPORT_COLUMNS, write_csv
+
+
+def test_smaller_files_are_prefixes(tmp_path):
+    small = read_crashes_csv(write_csv(str(tmp_path / 'small.csv'), 200, seed=1, chunksize=100))
+    large = read_crashes_csv(write_csv(str(tmp_path / 'large.csv'), 420, seed=1, chunksize=100))
+    assert len(small) == 200 and len(large) == 420
+    assert large['COLLISION_ID'].is_unique
+    pd.testing.assert_frame_equal(small, large.iloc[:200], check_categorical=False)
+
+
+def test_empty_file_has_a_header(tmp_path):
+    path = write_csv(str(tmp_path / 'empty.csv'), 0)
+    assert list(pd.read_csv(path).columns) == list(EXPORT_COLUMNS)
+    assert read_crashes_csv(path).empty
@@ -0,0 +1,75 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from tdsp_tiles import SEVERITIES, STREET_ZOOM, TILE_SIZE, cluster_tiles, mercator_pixels, save_tiled_map
+
+
+# Fatal crashes about 20 m apart: one marker at city zooms, one each from street zoom on
+FATAL = 12
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(2)
+    n = 2000
+    latitude = np.r_[rng.uniform(40.55, 40.9, n), 40.7000 + 0.0002 * np.arange(FATAL), np.nan]
+    longitude = np.r_[rng.uniform(-74.1, -73.75, n), np.full(FATAL, -73.9500), -73.9]
+    killed = np.r_[np.zeros(n, dtype='int64'), np.ones(FATAL, dtype='int64'), 1]
+    injured = np.r_[rng.poisson(0.3, n), np.ones(FATAL, dtype='int64'), 0]
+    return pd.DataFrame({'LATITUDE': latitude, 'LONGITUDE': longitude,
+                         'NUMBER OF PERSONS INJURED': injured, 'NUMBER OF PERSONS KILLED': killed})
+
+
+@pytest.fixture(scope='module')
+def clusters(data):
+    return cluster_tiles(data)
+
+
+def test_every_crash_is_in_one_cluster_per_zoom(data, clusters):
+    valid = data.dropna(subset=['LATITUDE'])
+    totals = clusters.groupby('zoom')[['crashes', 'injured', 'killed']].sum()
+    assert (totals['crashes'] == len(valid)).all()
+    assert (totals['injured'] == valid['NUMBER OF PERSONS INJURED'].sum()).all()
+    assert (totals['killed'] == FATAL).all()
+
+
+def test_fatalities_are_unclustered_at_street_zoom(clusters):
+    fatal = clusters[clusters['severity'] == SEVERITIES.index('killed')]
+    per_zoom = fatal.groupby('zoom')['crashes']
+    assert (per_zoom.max()[per_zoom.max().index < STREET_ZOOM] > 1).any()
+    street = fatal[fatal['zoom'] >= STREET_ZOOM]
+    assert (street['crashes'] == 1).all()
+    assert (street.groupby('zoom').size() == FATAL).all()
+
+
+def test_clusters_lie_in_their_tile(clusters):
+    for zoom, level in clusters.groupby('zoom'):
+        x, y = mercator_pixels(level['LATITUDE'].to_numpy(), level['LONGITUDE'].to_numpy(), zoom)
+        np.testing.assert_array_equal(x // TILE_SIZE, level['x'])
+        np.testing.assert_array_equal(y // TILE_SIZE, level['y'])
+
+
+def test_no_tiles_below_min_zoom(data, tmp_path):
+    clusters = cluster_tiles(data, zooms=range(12, 17))
+    path = str(tmp_path / 'severity_tiles.html')
+    save_tiled_map(clusters, path)
+    directory = os.path.join(str(tmp_path), 'severity_tiles_files')
+    assert sorted(int(zoom) for zoom in os.listdir(directory)) == list(range(12, 17))
+
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            with open(os.path.join(root, name)) as handle:
+                payload = json.loads(handle.read()[len('tdspTile('):-len(');\n')])
+            written += sum(payload['crashes'])
+    assert written == 5 * data['LATITUDE'].notna().sum()
+
+    with open(path) as handle:
+        page = handle.read()
+    # The map cannot be zoomed out past the coarsest tiles, and the layer loads none below them
+    assert page.count('"minZoom": 12') == 2
+    assert 'zoom >= options.minZoom' in page
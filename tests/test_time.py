@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tdsp_synthetic import generate_raw
+from tdsp_time import TIME_FORMAT, add_temporal_features, compare_parsing, crash_hours, parse_dates
+
+
+@pytest.fixture(scope='module')
+def raw():
+    raw = generate_raw(3000, seed=8)[['CRASH DATE', 'CRASH TIME', 'COLLISION_ID']]
+    raw.loc[[3, 40], 'CRASH DATE'] = np.nan
+    raw.loc[[7, 40], 'CRASH TIME'] = np.nan
+    return raw
+
+
+@pytest.mark.parametrize('categorical', [False, True])
+def test_parsing_matches_pandas(raw, categorical):
+    dates, times = raw['CRASH DATE'], raw['CRASH TIME']
+    if categorical:
+        dates, times = dates.astype('category'), times.astype('category')
+    expected_dates = pd.to_datetime(raw['CRASH DATE'], format='%m/%d/%Y')
+    expected_hours = pd.to_datetime(raw['CRASH TIME'], format=TIME_FORMAT).dt.hour.fillna(-1)
+    pd.testing.assert_series_equal(parse_dates(dates), expected_dates.astype('datetime64[ns]'))
+    np.testing.assert_array_equal(crash_hours(times), expected_hours.to_numpy(dtype='int64'))
+
+
+def test_temporal_features(raw):
+    data = add_temporal_features(raw.copy())
+    stamps = pd.to_datetime(raw['CRASH DATE'] + ' ' + raw['CRASH TIME'], format='%m/%d/%Y %H:%M')
+    dated = data['CRASH DATE'].notna().to_numpy()
+    timed = raw['CRASH TIME'].notna().to_numpy()
+    # A missing time falls back to midnight of the crash date
+    expected = np.where(timed, stamps.to_numpy(dtype='datetime64[ns]'), data['CRASH DATE'].to_numpy())
+    np.testing.assert_array_equal(data['CRASH TIMESTAMP'].to_numpy()[dated], expected[dated].view('int64'))
+    np.testing.assert_array_equal(data['Weekday'].to_numpy()[dated], data['CRASH DATE'].dt.dayofweek[dated])
+    assert (data['Weekday'].to_numpy()[~dated] == -1).all()
+    assert data['Month'].isna().to_numpy()[~dated].all()
+    assert (data['Month'][dated] == data['CRASH DATE'][dated].dt.to_period('M')).all()
+    assert (data['Hour of Day'].to_numpy()[~timed] == -1).all()
+
+
+def test_compare_parsing_checks_both_paths(raw, tmp_path):
+    path = tmp_path / 'crashes.csv'
+    raw.to_csv(path, index=False)
+    assert set(compare_parsing(str(path))) == {'pandas', 'unique values'}
@@ -0,0 +1,49 @@
+import pandas as pd
+import pytest
+
+from tdsp_synthetic import generate
+from tdsp_timeseries import GRANULARITIES, TimeSeriesEngine, stl_components
+
+
+# First day left out of the initial build; the update brings in everything from it on
+CUTOFF = pd.Timestamp('2024-09-01')
+
+
+@pytest.fixture(scope='module')
+def data():
+    return generate(300000, seed=4)
+
+
+@pytest.fixture(scope='module')
+def engines(data):
+    earlier = data['CRASH DATE'] < CUTOFF
+    fresh = TimeSeriesEngine(['BOROUGH'], workers=1).build(data)
+    old = TimeSeriesEngine(['BOROUGH'], workers=1).build(data[earlier])
+    updated = TimeSeriesEngine(['BOROUGH'], workers=1).build(data[earlier]).update(data[~earlier])
+    return fresh, old, updated
+
+
+@pytest.mark.parametrize('granularity', ['daily', 'weekly', 'monthly'])
+def test_update_matches_a_fresh_build(engines, granularity):
+    fresh, old, updated = engines
+    _, period = GRANULARITIES[granularity]
+    for column in [None, 'BOROUGH']:
+        series = fresh.series(column, granularity)
+        pd.testing.assert_frame_equal(updated.series(column, granularity), series)
+        for name, expected in fresh.components[granularity][column].items():
+            actual = updated.components[granularity][column][name]
+            pd.testing.assert_index_equal(actual.index, expected.index)
+            pd.testing.assert_series_equal(actual['observed'], expected['observed'])
+
+            # The tail is a decomposition of the last tail_periods periods of the fresh series
+            tail = expected.index >= CUTOFF
+            window = stl_components(series[name].iloc[-updated.tail_periods * period:], period)
+            pd.testing.assert_frame_equal(actual[tail], window[window.index >= CUTOFF])
+            # and its trend stays close to that of the whole series
+            difference = (actual['trend'] - expected['trend'])[tail].abs().max()
+            assert difference <= 0.05 * expected['observed'].std(), (column, name)
+
+            # Buckets before the new days keep their earlier components
+            before = old.components[granularity][column][name]
+            kept = before.index[before.index < actual.index[tail][0]]
+            pd.testing.assert_frame_equal(actual.loc[kept], before.loc[kept])
@@ -0,0 +1,102 @@
+import collections
+import itertools
+
+import pandas as pd
+import pytest
+
+from tdsp_data import FACTOR_COLUMNS, VEHICLE_COLUMNS
+from tdsp_vehicles import VehicleCounts, stream_vehicle_counts, vehicle_counts
+
+
+# Empty slots in between, repeated types within a crash, factors without a type and the reverse
+TYPES = [
+    ['Sedan', 'Sedan', None, None, None],
+    ['Taxi', None, 'Bike', None, None],
+    ['Sedan', 'Taxi', 'Sedan', 'Taxi', 'Box Truck'],
+    [None, None, None, None, None],
+    ['Bike', None, None, None, 'Bike'],
+    ['Box Truck', 'Sedan', None, None, None],
+    ['Taxi', 'Taxi', 'Taxi', None, None],
+]
+FACTORS = [
+    ['Unsafe Speed', 'Unspecified', None, None, None],
+    ['Unspecified', 'Backing Unsafely', 'Unspecified', None, None],
+    ['Unsafe Speed', None, 'Unsafe Speed', 'Unspecified', None],
+    ['Unspecified', None, None, None, None],
+    [None, None, None, None, 'Unspecified'],
+    ['Backing Unsafely', 'Unsafe Speed', None, None, None],
+    ['Unspecified', 'Unspecified', 'Unsafe Speed', None, None],
+]
+
+
+@pytest.fixture(scope='module')
+def data():
+    frame = pd.DataFrame(TYPES, columns=VEHICLE_COLUMNS).join(pd.DataFrame(FACTORS, columns=FACTOR_COLUMNS))
+    return frame.astype('category')
+
+
+def melted(data):
+    """One row per vehicle slot, as the counts would be computed with pd.melt."""
+    long = pd.concat([
+        pd.DataFrame({'crash': data.index, 'type': data[vehicle].astype(object), 'factor': data[factor].astype(object)})
+        for vehicle, factor in zip(VEHICLE_COLUMNS, FACTOR_COLUMNS)
+    ], ignore_index=True)
+    return long.where(long.notna(), None)
+
+
+def expected_counts(data):
+    long = melted(data)
+    types = long.dropna(subset=['type'])
+    factors = long.dropna(subset=['factor'])
+    pairs = collections.Counter()
+    for _, crash in types.groupby('crash'):
+        labels = list(crash['type'])
+        pairs.update({tuple(sorted(pair)) for pair in itertools.combinations(labels, 2)})
+    return {
+        'type_vehicles': types['type'].value_counts().to_dict(),
+        'type_crashes': types.drop_duplicates(['crash', 'type'])['type'].value_counts().to_dict(),
+        'factor_vehicles': factors['factor'].value_counts().to_dict(),
+        'factor_crashes': factors.drop_duplicates(['crash', 'factor'])['factor'].value_counts().to_dict(),
+        'pairs': dict(pairs),
+        'factor_type': long.dropna().groupby(['factor', 'type']).size().to_dict(),
+    }
+
+
+def actual_counts(counts):
+    pairs = counts.vehicle_pairs()
+    factor_type = counts.factor_by_type()
+    return {
+        'type_vehicles': counts.type_counts('vehicle').to_dict(),
+        'type_crashes': counts.type_counts('crash').to_dict(),
+        'factor_vehicles': counts.factor_counts('vehicle').to_dict(),
+        'factor_crashes': counts.factor_counts('crash').to_dict(),
+        'pairs': {tuple(sorted(pair)): crashes
+                  for pair, crashes in zip(zip(pairs['VEHICLE TYPE A'], pairs['VEHICLE TYPE B']), pairs['crashes'])},
+        'factor_type': dict(zip(zip(factor_type['CONTRIBUTING FACTOR'], factor_type['VEHICLE TYPE']),
+                                factor_type['vehicles'])),
+    }
+
+
+@pytest.mark.parametrize('chunksize', [1, 3, 100])
+def test_counts_match_melt(data, chunksize):
+    counts = vehicle_counts(data, chunksize=chunksize)
+    assert counts.crashes == len(data)
+    assert actual_counts(counts) == expected_counts(data)
+
+
+def test_merge_with_other_ids(data):
+    # The second half sees its labels in another order, so its ids differ from the first's
+    first = vehicle_counts(data.iloc[:3])
+    second = VehicleCounts()
+    second.update(data.iloc[3:].iloc[::-1])
+    merged = first.merge(second)
+    assert merged.crashes == len(data)
+    assert actual_counts(merged) == expected_counts(data)
+
+
+def test_stream_matches_melt(data, tmp_path):
+    path = str(tmp_path / 'crashes.csv')
+    data.to_csv(path, index=False)
+    counts = stream_vehicle_counts(path, chunksize=2)
+    assert counts.crashes == len(data)
+    assert actual_counts(counts) == expected_counts(data)